@@ -0,0 +1,429 @@
+"""Per-sample analysis pipelines, independent of the Streamlit UI.
+
+A pipeline is planned as a ``Scheduler`` DAG of tool steps, run, and its
+steps collected into a results dictionary with the keys used everywhere
+else ('flagstat_text', 'stats_text', 'stats', 'idxstats_text',
+'qualimap_results', 'qualimap_skipped_rows', 'errors', 'warnings', and
+'stats_shards' when samtools stats was merged from shards). The app runs
+pipelines with a live progress table; batch mode and scripts call
+``analyze_sample`` directly. samtools stats and QualiMap steps carry a
+``ToolProgress`` (see progress.py) fed from their streamed output.
+
+A whole-file run reads the alignment once for samtools stats and flagstat:
+the file is teed into both tools (``tools.samtools_scan``), and the stats
+step's result carries the flagstat text along. idxstats only reads the
+index.
+
+Given target regions, every tool reads only those regions through the
+index: samtools stats gets region arguments and ``-t``, flagstat reads a
+region view of its own, and QualiMap runs with ``-gff`` on a BAM of the
+region reads. The results then also carry 'regions'.
+
+With the native coverage engine, BAM coverage tables are computed in
+process (``coverage_engine.native_coverage``) instead of by QualiMap; they are
+stored under 'qualimap_results' with QualiMap's names, so plotting is the same.
+
+With more than one stats shard, a whole-file samtools stats run is split
+into contig shards run side by side and merged into one report (see
+sharding.py); native coverage is sharded the same way.
+"""
+import os
+import subprocess
+
+from coverage_engine import native_coverage
+from parsers import StatsStreamParser, load_qualimap_raw_data, parse_qualimap_progress, qualimap_raw_data_dir
+from progress import ToolProgress, contig_layout, file_progress
+from regions import MAX_REGION_ARGS, region_string, write_regions
+from result_cache import get_tool_versions, make_cache_key
+from scheduler import DONE, DEFAULT_THREADS, Scheduler, split_thread_budget
+from sharding import (coverage_shard_step, coverage_shards, merge_coverage, merge_flagstat, merged_stats_result,
+                      shard_label, stats_shard_step, stats_shards)
+from tools import (COVERAGE_ENGINE, JVM_OVERHEAD_MB, SAMTOOLS_MEM_MB, STATS_SHARDS, java_mem_to_mb, qualimap_bamqc,
+                   qualimap_java_mem, samtools_extract_regions, samtools_faidx, samtools_flagstat,
+                   samtools_idxstats, samtools_index, samtools_scan, samtools_stats)
+
+
+class AnalysisError(Exception):
+    """A step the analysis cannot do without has failed"""
+
+
+def is_cram_path(path):
+    """Check whether a path names a CRAM file"""
+    return path.lower().endswith('.cram')
+
+
+def analysis_cache_key(is_cram, alignment_key, reference_key="", regions_key="",
+                       coverage_engine=COVERAGE_ENGINE, shards=STATS_SHARDS):
+    """Result cache key for one sample, its reference, its regions and the tool versions"""
+    parts = [regions_key] if regions_key else []
+    if is_cram:
+        # QualiMap cannot read CRAM: coverage is native, and needs the reference
+        coverage_engine = 'native' if reference_key else 'qualimap'
+    if coverage_engine != 'qualimap':
+        parts.append(f"coverage:{coverage_engine}")
+    # Merged shards have no GCD section; the shard count changes nothing else
+    if shards > 1 and not regions_key and (reference_key or not is_cram):
+        parts.append("stats:sharded")
+    return make_cache_key(
+        "cram" if is_cram else "bam", alignment_key, reference_key, *parts, *get_tool_versions()
+    )
+
+
+def step_error_message(step):
+    """Describe why a scheduler step did not complete"""
+    error = step.error
+    if isinstance(error, subprocess.CalledProcessError):
+        return error.stderr or str(error)
+    return str(error)
+
+
+def require_step(step, message):
+    """Return a step's result, raising ``AnalysisError`` if the step failed"""
+    if step.state != DONE:
+        raise AnalysisError(f"{message}: {step_error_message(step)}")
+    return step.result
+
+
+def samtools_stats_step(file_path, workdir, reference_path=None, threads=1, regions=None,
+                        region_files=None, progress=None, indexed=False, flagstat_threads=1):
+    """Run samtools stats and return its raw text, parsed sections and the flagstat text.
+
+    A whole-file run reads the file once for samtools stats and flagstat;
+    with ``regions`` flagstat runs as a step of its own and the flagstat
+    text is None. ``region_files`` are the ``(targets_path, bed_path)``
+    written for ``regions``. Sections are parsed while the output streams
+    in and handed to ``progress``, which also tracks the bytes read of a
+    whole-file run.
+    """
+    stats_file = os.path.join(workdir, "samtools_stats.txt")
+    region_args = {}
+    if regions:
+        targets_path, bed_path = region_files
+        region_args['targets_path'] = targets_path
+        if len(regions) <= MAX_REGION_ARGS:
+            region_args['regions'] = [region_string(region) for region in regions]
+        else:
+            region_args['bed_path'] = bed_path
+    parser = StatsStreamParser(progress.add_section if progress else None)
+    if regions:
+        stats_text = samtools_stats(file_path, stats_file, reference_path, threads,
+                                    on_line=parser.feed, **region_args)
+        return stats_text, parser.finish(), None
+    if progress is not None:
+        progress.set_contigs(*contig_layout(file_path, indexed))
+    stats_text, flagstat_text = samtools_scan(
+        file_path, stats_file, os.path.join(workdir, "samtools_flagstat.txt"), reference_path, threads,
+        flagstat_threads, on_line=parser.feed, on_bytes=progress.advance if progress is not None else None
+    )
+    return stats_text, parser.finish(), flagstat_text
+
+
+def qualimap_step(file_path, out_dir, threads=1, bed_path=None, progress=None, java_mem=None):
+    """Run QualiMap bamqc and load its raw data tables.
+
+    With ``bed_path`` QualiMap reads a BAM of just the reads in those
+    regions, extracted through the index, and reports on them (``-gff``).
+    ``progress`` follows the windows QualiMap reports as processed;
+    ``java_mem`` is its heap, sized from the input by default.
+    """
+    def on_line(line):
+        windows = parse_qualimap_progress(line)
+        if windows and progress is not None:
+            progress.set_done(*windows)
+
+    if bed_path:
+        file_path = samtools_extract_regions(
+            file_path, bed_path, os.path.join(os.path.dirname(out_dir), "regions.bam"), threads
+        )
+    java_mem = java_mem or qualimap_java_mem(os.path.getsize(file_path))
+    qualimap_bamqc(file_path, out_dir, java_mem=java_mem, threads=threads, feature_file=bed_path,
+                   on_line=on_line)
+    return load_qualimap_raw_data(out_dir, max_workers=threads)
+
+
+def coverage_step(file_path, workdir, threads=1, regions=None, reference_path=None):
+    """Compute QualiMap's coverage tables with the native engine"""
+    return native_coverage(file_path, workdir, regions, reference_path, threads=threads)
+
+
+def add_stats_shards(scheduler, file_path, workdir, shards, deps=(), reference_path=None, indexed=False):
+    """Add a samtools stats and flagstat step per contig shard, named ``stats_shard_<n>``"""
+    contig_shards = stats_shards(file_path, shards, indexed)
+    for index, contigs in enumerate(contig_shards):
+        scheduler.add(f"stats_shard_{index}",
+                      lambda contigs=contigs, index=index: stats_shard_step(
+                          file_path, workdir, contigs, reference_path, f"shard_{index}"),
+                      deps=deps, mem_mb=SAMTOOLS_MEM_MB,
+                      label=f"samtools stats ({index + 1}/{len(contig_shards)}: {shard_label(contigs)})")
+
+
+def add_coverage_shards(scheduler, file_path, workdir, shards, deps=(), reference_path=None):
+    """Add a native coverage step per contig shard, named ``coverage_shard_<n>``"""
+    contig_shards = coverage_shards(file_path, shards)
+    for index, contigs in enumerate(contig_shards):
+        scheduler.add(f"coverage_shard_{index}",
+                      lambda contigs=contigs, index=index: coverage_shard_step(
+                          file_path, workdir, contigs, reference_path, f"shard_{index}"),
+                      deps=deps, mem_mb=SAMTOOLS_MEM_MB,
+                      label=f"coverage ({index + 1}/{len(contig_shards)}: {shard_label(contigs)})")
+
+
+def add_stats_step(scheduler, file_path, workdir, shares, regions, region_files, indexed, deps,
+                   reference_path=None):
+    """Add the samtools stats step; a whole-file run reads flagstat in the same pass"""
+    progress = file_progress(file_path)
+    cpus = shares['stats'] if regions else shares['stats'] + shares['flagstat']
+    scheduler.add("stats",
+                  lambda: samtools_stats_step(file_path, workdir, reference_path, shares['stats'], regions,
+                                              region_files, progress, indexed, shares['flagstat']),
+                  deps=deps, cpus=cpus, mem_mb=SAMTOOLS_MEM_MB,
+                  label="samtools stats" if regions else "samtools stats + flagstat",
+                  progress=progress)
+
+
+def shard_steps(steps, prefix):
+    """Steps of one kind of shard, in shard order"""
+    return [steps[name] for name in sorted((name for name in steps if name.startswith(prefix)),
+                                           key=lambda name: int(name[len(prefix):]))]
+
+
+def plan_cram_analysis(file_path, reference_path, workdir, reference_indexed=False,
+                       threads=DEFAULT_THREADS, index_ready=False, regions=None, shards=STATS_SHARDS):
+    """Scheduler running the CRAM tools; only flagstat runs without a reference.
+
+    With a reference the CRAM gets the BAM steps: idxstats and coverage
+    read it through its .crai index, built first if missing, and coverage
+    comes from the native engine, since QualiMap cannot read CRAM; flagstat
+    shares samtools stats' read of a whole-file run. The CRAM is never
+    converted to BAM. ``shards`` above 1 splits stats and coverage of a
+    whole-file run into contig shards.
+    """
+    sharded = shards > 1 and not regions
+    shares = split_thread_budget(threads, {'index': 4, 'stats': 3, 'flagstat': 2})
+    region_files = write_regions(regions, workdir) if regions else (None, None)
+    scheduler = Scheduler(max_cpus=threads)
+    index_deps = []
+    if (regions or reference_path) and not index_ready:
+        scheduler.add("index", lambda: samtools_index(file_path, shares['index']),
+                      cpus=shares['index'], mem_mb=SAMTOOLS_MEM_MB, label="samtools index")
+        index_deps = ["index"]
+    region_deps = index_deps if regions else []
+    faidx_deps = []
+    if reference_path and not reference_indexed:
+        scheduler.add("faidx", lambda: samtools_faidx(reference_path), label="samtools faidx")
+        faidx_deps = ["faidx"]
+    if reference_path and sharded:
+        add_coverage_shards(scheduler, file_path, workdir, shards, index_deps + faidx_deps, reference_path)
+        add_stats_shards(scheduler, file_path, workdir, shards, index_deps + faidx_deps, reference_path,
+                         index_ready)
+    elif reference_path:
+        # Index and coverage never overlap, so they share one slice of the budget
+        scheduler.add("coverage",
+                      lambda: coverage_step(file_path, workdir, shares['index'], regions, reference_path),
+                      deps=index_deps + faidx_deps, cpus=shares['index'], mem_mb=SAMTOOLS_MEM_MB,
+                      label="coverage (native)")
+        add_stats_step(scheduler, file_path, workdir, shares, regions, region_files, index_ready,
+                       faidx_deps + region_deps, reference_path)
+    if reference_path:
+        scheduler.add("idxstats", lambda: samtools_idxstats(file_path), deps=index_deps,
+                      label="samtools idxstats")
+    if regions or not reference_path:
+        # A region view decodes the reads, so it needs the reference as well
+        flagstat_deps = region_deps + faidx_deps if regions else []
+        scheduler.add("flagstat",
+                      lambda: samtools_flagstat(file_path, shares['flagstat'], region_files[1], reference_path),
+                      deps=flagstat_deps, cpus=shares['flagstat'], mem_mb=SAMTOOLS_MEM_MB,
+                      label="samtools flagstat")
+    return scheduler
+
+
+def plan_bam_analysis(file_path, workdir, index_ready=False, threads=DEFAULT_THREADS, regions=None,
+                      coverage_engine=COVERAGE_ENGINE, shards=STATS_SHARDS):
+    """Scheduler running the BAM tools, with the index built first if needed.
+
+    ``coverage_engine`` 'native' replaces QualiMap with the in-process engine.
+    ``shards`` above 1 splits samtools stats (and native coverage) of a
+    whole-file run into contig shards read through the index.
+    """
+    sharded = shards > 1 and not regions
+    out_dir = os.path.join(workdir, "qualimap_out")
+    region_files = write_regions(regions, workdir) if regions else (None, None)
+
+    # Index and QualiMap never overlap, so they share one slice of the budget
+    shares = split_thread_budget(threads, {'index': 4, 'stats': 3, 'flagstat': 2})
+
+    # Only QualiMap, idxstats and region reads need the index; the critical
+    # path goes first
+    scheduler = Scheduler(max_cpus=threads)
+    index_deps = []
+    if not index_ready:
+        scheduler.add("index", lambda: samtools_index(file_path, shares['index']),
+                      cpus=shares['index'], mem_mb=SAMTOOLS_MEM_MB, label="samtools index")
+        index_deps = ["index"]
+    region_deps = index_deps if regions else []
+    if coverage_engine == 'native' and sharded:
+        add_coverage_shards(scheduler, file_path, workdir, shards, index_deps)
+    elif coverage_engine == 'native':
+        scheduler.add("coverage", lambda: coverage_step(file_path, workdir, shares['index'], regions),
+                      deps=index_deps, cpus=shares['index'], label="coverage (native)")
+    else:
+        # The heap follows the whole file even for regions: the extract is
+        # not known yet, and a heap that is too small fails the run
+        java_mem = qualimap_java_mem(os.path.getsize(file_path))
+        qualimap_progress = ToolProgress(unit="windows")
+        scheduler.add("qualimap",
+                      lambda: qualimap_step(file_path, out_dir, shares['index'], region_files[1],
+                                            qualimap_progress, java_mem),
+                      deps=index_deps, cpus=shares['index'],
+                      mem_mb=java_mem_to_mb(java_mem) + JVM_OVERHEAD_MB, label="QualiMap bamqc",
+                      progress=qualimap_progress, jvm=True)
+    if sharded:
+        add_stats_shards(scheduler, file_path, workdir, shards, index_deps, indexed=index_ready)
+    else:
+        add_stats_step(scheduler, file_path, workdir, shares, regions, region_files, index_ready, region_deps)
+    if regions:
+        scheduler.add("flagstat", lambda: samtools_flagstat(file_path, shares['flagstat'], region_files[1]),
+                      deps=region_deps, cpus=shares['flagstat'], mem_mb=SAMTOOLS_MEM_MB,
+                      label="samtools flagstat")
+    scheduler.add("idxstats", lambda: samtools_idxstats(file_path), deps=index_deps,
+                  label="samtools idxstats")
+    return scheduler
+
+
+def collect_flagstat(steps, rerun=None):
+    """flagstat text of its own step, or of the samtools stats pass (or shards) that read it too.
+
+    When that pass failed, ``rerun()`` runs flagstat on its own, so a
+    samtools stats failure only loses the statistics; without ``rerun`` or
+    if it fails too, ``AnalysisError`` is raised.
+    """
+    message = "❌ Failed to run samtools flagstat"
+    if 'flagstat' in steps:
+        return require_step(steps['flagstat'], message)
+    scans = [steps['stats']] if 'stats' in steps else shard_steps(steps, "stats_shard_")
+    failed = [step for step in scans if step.state != DONE]
+    if failed and rerun is not None:
+        try:
+            return rerun()
+        except subprocess.CalledProcessError as e:
+            raise AnalysisError(f"{message}: {e.stderr or e}") from e
+    if 'stats' in steps:
+        return require_step(steps['stats'], message)[2]
+    return merge_flagstat([require_step(step, message)[1] for step in scans])
+
+
+def collect_stats(results, step):
+    """Store the samtools stats step output, recording failures"""
+    if step.state == DONE:
+        results['stats_text'], results['stats'] = step.result[:2]
+    else:
+        results['errors'].append(f"samtools stats failed with error: {step_error_message(step)}")
+        results['stats'] = {}
+
+
+def collect_stats_shards(results, steps):
+    """Merge the samtools stats shards into one report, recording failures and the shard count"""
+    shards = shard_steps(steps, "stats_shard_")
+    failed = [step for step in shards if step.state != DONE]
+    if failed:
+        results['errors'].append(f"samtools stats failed with error: {step_error_message(failed[0])}")
+        results['stats'] = {}
+        return
+    results['stats_text'], results['stats'] = merged_stats_result(
+        [step.result[0] for step in shards], results.get('flagstat_text')
+    )
+    results['stats_shards'] = len(shards)
+
+
+def collect_coverage(steps):
+    """Native coverage tables, merged from the shards of a sharded run"""
+    if 'coverage' in steps:
+        return require_step(steps['coverage'], "❌ Coverage computation failed")
+    return merge_coverage([require_step(step, "❌ Coverage computation failed")
+                           for step in shard_steps(steps, "coverage_shard_")])
+
+
+def collect_qualimap(results, step, workdir):
+    """Store the QualiMap tables, noting files that could not be read"""
+    frames, skipped_rows, errors = step.result
+    raw_data_dir = qualimap_raw_data_dir(os.path.join(workdir, "qualimap_out"))
+    if not os.path.isdir(raw_data_dir):
+        results['warnings'].append(f"QualiMap raw data directory not found: {raw_data_dir}")
+    for name, error in errors.items():
+        results['warnings'].append(f"Error parsing {name}: {str(error)}")
+    results['qualimap_results'] = frames
+    results['qualimap_skipped_rows'] = skipped_rows
+
+
+def collect_cram_results(steps, regions=None, rerun_flagstat=None):
+    """Results of a finished CRAM scheduler run (see ``collect_flagstat`` for ``rerun_flagstat``)"""
+    results = {'errors': [], 'warnings': []}
+    if regions:
+        results['regions'] = list(regions)
+    if 'index' in steps:
+        require_step(steps['index'], "❌ Failed to index CRAM")
+    results['flagstat_text'] = collect_flagstat(steps, rerun_flagstat)
+    if 'idxstats' in steps:
+        results['qualimap_results'] = collect_coverage(steps)
+        results['qualimap_skipped_rows'] = {}
+        results['idxstats_text'] = require_step(steps['idxstats'], "❌ Failed to run samtools idxstats")
+    if 'stats' in steps:
+        collect_stats(results, steps['stats'])
+    elif 'stats_shard_0' in steps:
+        collect_stats_shards(results, steps)
+    return results
+
+
+def collect_bam_results(steps, workdir, regions=None, rerun_flagstat=None):
+    """Results of a finished BAM scheduler run (see ``collect_flagstat`` for ``rerun_flagstat``)"""
+    results = {'errors': [], 'warnings': []}
+    if regions:
+        results['regions'] = list(regions)
+    if 'index' in steps:
+        require_step(steps['index'], "❌ Failed to index BAM")
+    results['flagstat_text'] = collect_flagstat(steps, rerun_flagstat)
+    if 'qualimap' in steps:
+        require_step(steps['qualimap'], "❌ Command execution failed")
+    else:
+        results['qualimap_results'] = collect_coverage(steps)
+        results['qualimap_skipped_rows'] = {}
+    results['idxstats_text'] = require_step(steps['idxstats'], "❌ Command execution failed")
+
+    if 'qualimap' in steps:
+        collect_qualimap(results, steps['qualimap'], workdir)
+    if 'stats' in steps:
+        collect_stats(results, steps['stats'])
+    else:
+        collect_stats_shards(results, steps)
+    return results
+
+
+def flagstat_rerun(file_path, workdir, reference_path=None, threads=DEFAULT_THREADS, regions=None):
+    """flagstat run on its own over what the analysis covers, for ``collect_flagstat``'s ``rerun``"""
+    def rerun():
+        bed_path = write_regions(regions, workdir)[1] if regions else None
+        return samtools_flagstat(file_path, threads, bed_path, reference_path)
+    return rerun
+
+
+def analyze_sample(file_path, workdir, reference_path=None, index_ready=False,
+                   reference_indexed=False, threads=DEFAULT_THREADS, on_update=None, regions=None,
+                   coverage_engine=COVERAGE_ENGINE, shards=STATS_SHARDS):
+    """Run the full analysis of one BAM/CRAM file and return its results.
+
+    Raises ``AnalysisError`` when a required step fails; optional steps
+    (samtools stats) are reported in ``results['errors']`` instead. If the
+    samtools stats pass that also reads flagstat fails, flagstat is rerun
+    on its own. ``regions`` restricts every tool to those merged regions;
+    ``coverage_engine`` picks QualiMap or the native engine for BAM
+    coverage; ``shards`` above 1 runs a whole-file analysis's stats and
+    native coverage as contig shards.
+    """
+    rerun_flagstat = flagstat_rerun(file_path, workdir, reference_path, threads, regions)
+    if is_cram_path(file_path):
+        scheduler = plan_cram_analysis(file_path, reference_path, workdir, reference_indexed,
+                                       threads, index_ready, regions, shards)
+        return collect_cram_results(scheduler.run(on_update=on_update), regions, rerun_flagstat)
+    scheduler = plan_bam_analysis(file_path, workdir, index_ready, threads, regions, coverage_engine,
+                                  shards)
+    return collect_bam_results(scheduler.run(on_update=on_update), workdir, regions, rerun_flagstat)
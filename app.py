@@ -2,15 +2,24 @@ import streamlit as st
 import subprocess
 import tempfile
 import os
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import re
+import shutil
+import time
+import mimetypes
 from datetime import datetime
 import base64
-import requests
-from io import BytesIO
-import zipfile
-import shutil
+from result_cache import ResultCache
+from exports import (RenderCache, IMAGE_FORMATS, IMAGE_MIME_TYPES, EXPORTS_DIR, STATIC_FILE_MAX_BYTES,
+                     analysis_zip_entries, export_path, export_url, write_results_zip)
+from inputs import (copy_upload, upload_size, resolve_local_paths, local_file_fingerprint,
+                    prepare_local_input, find_index, LOCAL_ROOTS, FASTA_EXTENSIONS)
+from regions import load_regions, regions_key, regions_length
+from scheduler import (FINISHED_STATES, PENDING, RUNNING, DONE, FAILED, SKIPPED, MAX_CPUS, DEFAULT_THREADS,
+                       GOVERNOR)
+from tools import COVERAGE_ENGINES, COVERAGE_ENGINE, STATS_SHARDS, samtools_header, samtools_idxstats
+
+# pandas, plotly and the modules built on them are imported further down,
+# only once there is a file to analyze, so the landing page paints quickly
 
 # Set Streamlit page config
 st.set_page_config(
@@ -20,17 +29,33 @@ st.set_page_config(
     page_icon="🧬"
 )
 
-# Load and encode the background image
-def get_base64_image(image_url):
-    try:
-        response = requests.get(image_url)
-        return base64.b64encode(response.content).decode()
-    except:
-        return None
+# Background image: a bundled file is inlined once per process; otherwise the
+# browser loads the URL itself, so the server never waits on the network
+BACKGROUND_IMAGE_PATH = os.environ.get(
+    "BAMCRAM_BACKGROUND_IMAGE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "background.jpg")
+)
+BACKGROUND_IMAGE_URL = os.environ.get(
+    "BAMCRAM_BACKGROUND_URL",
+    "https://img.freepik.com/free-photo/3d-render-medical-background-with-abstract-virus-cells-dna-strands_1048-14041.jpg?semt=ais_items_boosted&w=740"
+)
+
+# How often a page following a background job checks on it
+JOB_POLL_SECONDS = 0.5
+
+# Contigs with the most mapped reads drawn in the instant summary's chart
+INSTANT_PLOT_CONTIGS = 40
 
-# ✅ Use your desired image URL here
-bg_image_url = "https://img.freepik.com/free-photo/3d-render-medical-background-with-abstract-virus-cells-dna-strands_1048-14041.jpg?semt=ais_items_boosted&w=740"
-bg_image_base64 = get_base64_image(bg_image_url)
+@st.cache_resource
+def get_background_image_url():
+    """URL of the page background: an inlined bundled file, the remote URL or ''"""
+    if os.path.isfile(BACKGROUND_IMAGE_PATH):
+        mime = mimetypes.guess_type(BACKGROUND_IMAGE_PATH)[0] or "image/jpeg"
+        with open(BACKGROUND_IMAGE_PATH, "rb") as f:
+            return f"data:{mime};base64,{base64.b64encode(f.read()).decode()}"
+    return BACKGROUND_IMAGE_URL
+
+bg_image_url = get_background_image_url()
 
 # Inject custom CSS with better contrast
 st.markdown(f"""
@@ -67,7 +92,7 @@ st.markdown(f"""
 
     /* 🔹 Background image */
     .stApp {{
-        background-image: url("data:image/jpeg;base64,{bg_image_base64 if bg_image_base64 else ''}");
+        background-image: {f'url("{bg_image_url}")' if bg_image_url else 'none'};
         background-size: cover;
         background-position: center;
         background-repeat: no-repeat;
@@ -200,7 +225,7 @@ with st.sidebar:
     **BAM/CRAM Analyzer** is a comprehensive bioinformatics tool designed for analyzing BAM (Binary Alignment Map) and CRAM files with ease and precision.
     
     ### 🔬 Key Features:
-    - **Quality Control Analysis** using QualiMap (BAM only)
+    - **Quality Control Analysis** using QualiMap (BAM) or native coverage (BAM and CRAM)
     - **Alignment Statistics** via Samtools
     - **Interactive Visualizations** with Plotly
     - **Chromosome Coverage Analysis**
@@ -208,11 +233,11 @@ with st.sidebar:
 
     ### 📊 What You'll Get:
     - Detailed alignment metrics
-    - Coverage statistics (BAM only)
-    - Quality score distributions (BAM only)
-    - Insert size analysis (BAM only)
-    - GC content analysis (BAM only)
-    - Mapping quality plots (BAM only)
+    - Coverage statistics (BAM, and CRAM with a reference)
+    - Quality score distributions (BAM, and CRAM with a reference)
+    - Insert size analysis (BAM, and CRAM with a reference)
+    - GC content analysis (BAM, and CRAM with a reference)
+    - Mapping quality plots (BAM with QualiMap)
 
     ### 🛠️ Tools Used:
     - **Samtools**: For BAM/CRAM file processing
@@ -233,12 +258,51 @@ with st.sidebar:
     - For CRAM analysis, upload a reference genome
     - Larger files may take longer to process
     - For full QC analysis, use BAM files
-    - Results are temporary and not stored
+    - Results are cached on the server, so re-opening the same file is instant
     """)
 
     st.markdown("---")
     st.markdown("**Version:** 2.1")
     st.markdown(f"**Last Updated:** {datetime.now().strftime('%Y-%m-%d')}")
+
+    # Threads shared by all tools of an analysis (samtools -@, QualiMap -nt)
+    thread_budget = DEFAULT_THREADS
+    if MAX_CPUS > 1:
+        thread_budget = st.slider(
+            "⚙️ Thread budget", min_value=1, max_value=MAX_CPUS, value=DEFAULT_THREADS,
+            help="Total threads shared by the samtools and QualiMap steps of an analysis"
+        )
+
+    # QualiMap gives the full report; the native engine only coverage, but much faster
+    coverage_engine = st.radio(
+        "📈 BAM coverage engine", COVERAGE_ENGINES, index=COVERAGE_ENGINES.index(COVERAGE_ENGINE),
+        format_func={'qualimap': "QualiMap (full report)", 'native': "Native (coverage only, fast)"}.get,
+        help="The native engine computes the coverage plots in process, without QualiMap's JVM"
+    )
+
+    # Whole-file samtools stats split into contig shards, one per thread, merged exactly
+    stats_shards = 1
+    if st.checkbox(
+        "🧩 Shard samtools stats by contig", value=STATS_SHARDS > 1, disabled=thread_budget < 2,
+        help="Run samtools stats (and native coverage) on groups of contigs in parallel through the "
+             "index and merge the results; the largest contig bounds the speedup"
+    ):
+        stats_shards = max(STATS_SHARDS, thread_budget)
+
+    # Background analyses keep running without a page; any session can come back to one
+    def attach_job():
+        job_id = st.session_state.attach_job.strip()
+        if job_id:
+            st.query_params["job"] = job_id
+        else:
+            st.query_params.pop("job", None)
+
+    st.text_input("🔗 Attach to job ID", key="attach_job", on_change=attach_job,
+                  help="Show a background analysis started earlier, from any browser")
+
+    # Filled in at the end of the script so the counters include this run
+    cache_stats_placeholder = st.empty()
+    server_load_placeholder = st.empty()
     
     st.markdown("---")
     st.markdown("""
@@ -307,703 +371,979 @@ st.markdown("""
     </div>
     """, unsafe_allow_html=True)
 
-# File uploader that accepts BAM and CRAM files
-uploaded_file = st.file_uploader("Upload BAM or CRAM file", type=["bam", "cram"])
-uploaded_reference = st.file_uploader("Upload Reference FASTA file (required for CRAM)", type=["fa", "fna", "fasta"])
+# Server-side files can be analyzed in place when BAMCRAM_LOCAL_ROOTS is set
+input_mode = "📤 Upload"
+if LOCAL_ROOTS:
+    input_mode = st.radio("Input source", ["📤 Upload", "🗄️ Server path"], horizontal=True)
+
+# Batch mode analyzes a whole cohort and shows one row per sample
+batch_mode = st.toggle("📚 Batch mode - analyze a cohort of files",
+                       help="Run every file on a bounded worker pool and compare samples side by side")
+
+@st.cache_resource
+def get_reference_registry():
+    """Return the server's reference registry, with samtools pointed at its sequence cache"""
+    from references import ReferenceRegistry
+    registry = ReferenceRegistry()
+    registry.install()
+    return registry
+
+# Registered-reference choice meaning "find it from the CRAM header"
+AUTO_REFERENCE = ""
+
+uploaded_file = uploaded_reference = None
+local_file = local_reference = None
+uploaded_files = local_files = []
+
+if input_mode == "📤 Upload":
+    # File uploader that accepts BAM and CRAM files
+    if batch_mode:
+        uploaded_files = st.file_uploader("Upload BAM or CRAM files", type=["bam", "cram"],
+                                          accept_multiple_files=True)
+    else:
+        uploaded_file = st.file_uploader("Upload BAM or CRAM file", type=["bam", "cram"])
+    uploaded_reference = st.file_uploader("Upload Reference FASTA file (required for CRAM)", type=["fa", "fna", "fasta"])
+else:
+    st.caption(f"Allowed locations: {', '.join(LOCAL_ROOTS)}")
+    local_pattern = st.text_input("BAM or CRAM path or glob on the server", placeholder="/data/run42/*.bam")
+    if local_pattern:
+        local_matches = resolve_local_paths(local_pattern)
+        if not local_matches:
+            st.warning("⚠️ No BAM/CRAM files match this path in the allowed locations")
+        elif batch_mode:
+            local_files = local_matches
+            st.caption(f"📚 {len(local_files)} files match")
+        elif len(local_matches) == 1:
+            local_file = local_matches[0]
+        else:
+            local_file = st.selectbox(f"{len(local_matches)} files match - choose one", local_matches)
+
+    reference_pattern = st.text_input("Reference FASTA path on the server (required for CRAM)")
+    if reference_pattern:
+        reference_matches = resolve_local_paths(reference_pattern, extensions=FASTA_EXTENSIONS)
+        if reference_matches:
+            local_reference = reference_matches[0]
+        else:
+            st.warning("⚠️ No FASTA file matches this path in the allowed locations")
+
+# References registered on the server spare uploading the FASTA with every CRAM
+reference_registry = get_reference_registry()
+reference_choice = AUTO_REFERENCE
+if reference_registry.names():
+    reference_choice = st.selectbox(
+        "📚 Registered reference (for CRAM files without a FASTA above)",
+        [AUTO_REFERENCE] + reference_registry.names(),
+        format_func=lambda name: name or "🔎 Detect from the CRAM header",
+        help="Detection matches the MD5s of the CRAM header's @SQ lines against the registered references"
+    )
+register_reference = False
+if uploaded_reference or local_reference:
+    register_reference = st.button(
+        "💾 Keep this reference on the server",
+        help="Store and index the FASTA once; CRAM files made against it then find it without an upload"
+    )
 
-def parse_all_qualimap_graphs(report_dir):
-    """Parse all QualiMap graph data files into DataFrames"""
-    results = {}
-    raw_data_dir = os.path.join(report_dir, "raw_data_qualimapReport")
-    
-    if not os.path.exists(raw_data_dir):
-        st.warning(f"QualiMap raw data directory not found: {raw_data_dir}")
-        return results
-    
-    file_parsers = {
-        'coverage_across_reference': lambda parts: {'Position': float(parts[0]), 'Coverage': float(parts[1])},
-        'coverage_histogram': lambda parts: {'Coverage': float(parts[0]), 'Frequency': float(parts[1])},
-        'duplication_rate_histogram': lambda parts: {'Duplication Rate': float(parts[0]), 'Count': float(parts[1])},
-        'genome_fraction_coverage': lambda parts: {'Coverage': float(parts[0]), 'Genome Fraction': float(parts[1])},
-        'homopolymer_indels': lambda parts: {'Type of indel': parts[0], 'Number of indels': int(parts[1])},
-        'insert_size_across_reference': lambda parts: {'Position': float(parts[0]), 'Insert Size': float(parts[1])},
-        'insert_size_histogram': lambda parts: {'Insert Size': float(parts[0]), 'Count': float(parts[1])},
-        'mapped_reads_gc-content_distribution': lambda parts: {'GC Content (%)': float(parts[0]), 'Sample': float(parts[1])},
-        'mapped_reads_nucleotide_content': lambda parts: {
-            'Position (bp)': float(parts[0]),
-            'A': float(parts[1]), 'C': float(parts[2]),
-            'G': float(parts[3]), 'T': float(parts[4]),
-            'N': float(parts[5])},
-        'mapping_quality_across_reference': lambda parts: {'Position': float(parts[0]), 'Mapping Quality': float(parts[1])},
-        'mapping_quality_histogram': lambda parts: {'Mapping Quality': float(parts[0]), 'Count': float(parts[1])}
+# Optional target regions: the tools then read only these parts of the file via its index
+with st.expander("🎯 Target regions (optional)"):
+    region_text = st.text_area(
+        "Regions (chr, chr:start-end), one per line",
+        placeholder="chr17:43,044,295-43,125,483\nchr13:32,315,508-32,400,268\nchrM",
+        help="Coordinates are 1-based and inclusive, as in samtools; combined with the BED file below"
+    )
+    uploaded_bed = st.file_uploader("Or upload a BED file (gene panel, exome targets)", type=["bed"])
+try:
+    regions = load_regions(region_text, uploaded_bed.getvalue().decode() if uploaded_bed else "")
+except ValueError as e:
+    st.error(f"❌ {e}")
+    st.stop()
+region_key = regions_key(regions) if regions else ""
+if regions:
+    region_bases = regions_length(regions)
+    st.caption(f"🎯 Restricted to {len(regions):,} regions"
+               + (f" ({region_bases:,} bp)" if region_bases else "")
+               + " - only reads overlapping them are analyzed")
+
+# Quick look: estimates from windows read through the index, for triage in seconds
+quick_look_mode = st.toggle(
+    "⚡ Quick look - estimate the statistics from a sample of the file", key="quick_look",
+    disabled=batch_mode or bool(regions),
+    help="Reads evenly spread windows through the index and extrapolates flagstat and samtools stats, "
+         "with 95% confidence intervals. Server files with an up-to-date index: BAM files, or CRAM "
+         "files with a reference."
+) and not batch_mode and not regions
+
+@st.cache_resource
+def get_result_cache():
+    """Return the process-wide on-disk result cache"""
+    return ResultCache()
+
+@st.cache_resource
+def get_result_store():
+    """Return the process-wide Parquet store of past analyses"""
+    from result_store import ResultStore
+    return ResultStore()
+
+@st.cache_resource
+def get_render_cache():
+    """Return the process-wide cache of rendered PNG/PDF exports"""
+    return RenderCache()
+
+def render_plot_downloads(fig, plot_name, key_prefix):
+    """Download buttons for one plot; PNG/PDF are rendered only on request"""
+    render_cache = get_render_cache()
+    columns = st.columns(1 + len(IMAGE_FORMATS))
+    with columns[0]:
+        st.download_button(
+            label=f"📥 {plot_name} (HTML)",
+            data=fig.to_html(),
+            file_name=f"{plot_name}.html",
+            mime="text/html",
+            key=f"{key_prefix}_{plot_name}_html",
+            on_click="ignore"
+        )
+    for column, fmt in zip(columns[1:], IMAGE_FORMATS):
+        with column:
+            label = f"{plot_name} ({fmt.upper()})"
+            image = render_cache.get(fig, fmt)
+            if image is None and st.button(f"🖼️ Render {label}", key=f"{key_prefix}_{plot_name}_{fmt}"):
+                with st.spinner(f"Rendering {label}..."):
+                    image = render_cache.render(fig, fmt)
+            if image is not None:
+                st.download_button(
+                    label=f"📥 {label}",
+                    data=image,
+                    file_name=f"{plot_name}.{fmt}",
+                    mime=IMAGE_MIME_TYPES[fmt],
+                    key=f"{key_prefix}_{plot_name}_{fmt}_download",
+                    on_click="ignore"
+                )
+
+def render_zip_download(zip_path, file_name):
+    """Download for a results archive: a link the web server streams from disk when it can serve
+    the file, otherwise a download button, which holds the archive in memory"""
+    label = "📦 Download All Results (ZIP)"
+    if os.path.dirname(os.path.dirname(zip_path)) == EXPORTS_DIR and \
+            os.path.getsize(zip_path) <= STATIC_FILE_MAX_BYTES:
+        st.markdown(f"""
+        <a href="{export_url(zip_path)}" download="{file_name}"
+           style="display: inline-block; background-color: #ffffff; color: #000000; text-decoration: none;
+                  border: 2px solid #4CAF50; border-radius: 8px; padding: 0.5rem 1rem; font-weight: bold;">
+            {label}
+        </a>
+        """, unsafe_allow_html=True)
+        return
+    with open(zip_path, "rb") as f:
+        st.download_button(
+            label=label,
+            data=f,
+            file_name=file_name,
+            mime="application/zip",
+            on_click="ignore"
+        )
+
+def zoom_ranges():
+    """Zoomed-in position ranges of the genome-wide plots, from the sliders"""
+    return {
+        name: st.session_state[f"zoom_{name}"]
+        for name in ZOOMABLE_PLOTS if f"zoom_{name}" in st.session_state
     }
-    
-    for name, parser in file_parsers.items():
-        file_path = os.path.join(raw_data_dir, f"{name}.txt")
-        if os.path.exists(file_path):
-            try:
-                data = []
-                with open(file_path, 'r') as f:
-                    for line in f:
-                        if not line.startswith('#'):
-                            parts = line.strip().split()
-                            if len(parts) >= 2:
-                                try:
-                                    data.append(parser(parts))
-                                except ValueError:
-                                    continue
-                results[name] = pd.DataFrame(data)
-            except Exception as e:
-                st.error(f"Error parsing {name}: {str(e)}")
-    
+
+def render_zoom_control(name, frame, fig):
+    """Position range slider that redraws a plot from full-resolution data"""
+    positions = frame['Position']
+    low, high = float(positions.min()), float(positions.max())
+    if low >= high:
+        return
+    st.slider(
+        "🔍 Zoom to position range (bp)", min_value=low, max_value=high,
+        value=(low, high), key=f"zoom_{name}"
+    )
+    shown = len(fig.data[0].x) if fig.data else 0
+    if shown < len(frame):
+        st.caption(f"📉 Showing {shown:,} of {len(frame):,} points (min/max per bucket); "
+                   f"narrow the range to see full resolution")
+
+def get_upload_id(uploaded):
+    """Stable identifier of an upload within the session"""
+    return getattr(uploaded, "file_id", None) or f"{uploaded.name}:{uploaded.size}"
+
+def get_upload_digest(uploaded):
+    """Content hash of an upload if it was already computed in this session"""
+    return st.session_state.setdefault("upload_digests", {}).get(get_upload_id(uploaded))
+
+def stage_upload(uploaded, directory):
+    """Stream an upload to disk with a throughput readout; returns (path, digest)
+
+    The content hash is computed during the copy the first time an upload is
+    seen and remembered for the rest of the session.
+    """
+    digests = st.session_state.setdefault("upload_digests", {})
+    upload_id = get_upload_id(uploaded)
+    total = max(upload_size(uploaded), 1)
+    progress_bar = st.progress(0.0, text=f"📥 Saving {uploaded.name}...")
+
+    def on_progress(copied):
+        progress_bar.progress(
+            min(copied / total, 1.0),
+            text=f"📥 Saving {uploaded.name}: {copied / 1024 ** 2:,.0f} / {total / 1024 ** 2:,.0f} MB"
+        )
+
+    copy = copy_upload(
+        uploaded, os.path.join(directory, uploaded.name),
+        compute_hash=upload_id not in digests, on_progress=on_progress
+    )
+    progress_bar.empty()
+    if copy.digest:
+        digests[upload_id] = copy.digest
+
+    st.caption(
+        f"📥 Saved {uploaded.name}: {copy.bytes_copied / 1024 ** 2:,.1f} MB in "
+        f"{copy.seconds:.1f} s ({copy.throughput_mb_s:,.0f} MB/s)"
+    )
+    return copy.path, digests[upload_id]
+
+def format_step_rows(rows):
+    """Render ``(label, state, wall time, progress)`` rows as a markdown status table"""
+    icons = {PENDING: "⏳", RUNNING: "🔄", DONE: "✅", FAILED: "❌", SKIPPED: "⏭️"}
+    lines = ["| Step | Status | Wall time | Progress |", "|---|---|---|---|"]
+    for label, state, wall_time, progress in rows:
+        wall_time = f"{wall_time:.1f} s" if wall_time is not None else "-"
+        lines.append(f"| {label} | {icons[state]} {state} | {wall_time} | {progress} |")
+    return "\n".join(lines)
+
+def step_progress_text(step):
+    """Progress column of a step: its tool's progress, or what it is queued for"""
+    if step.state == RUNNING and step.progress:
+        return step.progress.describe()
+    if step.state == PENDING and step.waiting_for:
+        return f"🚦 waiting for {step.waiting_for}"
+    return ""
+
+def format_step_table(steps):
+    """Render scheduler steps as a markdown status table"""
+    return format_step_rows((step.label, step.state, step.wall_time, step_progress_text(step))
+                            for step in steps)
+
+def steps_done_fraction(steps):
+    """Overall progress: finished steps plus the reported share of running ones"""
+    done = 0.0
+    for step in steps:
+        if step.state in FINISHED_STATES:
+            done += 1
+        elif step.state == RUNNING and step.progress:
+            done += step.progress.fraction() or 0.0
+    return done / len(steps)
+
+def render_partial_stats(preview, steps, shown):
+    """Plot the samtools stats sections finished so far, while the tools run"""
+    for step in steps:
+        if step.progress is None or step.state != RUNNING:
+            continue
+        version, sections = step.progress.snapshot()
+        if not sections or shown.get(step.name) == version:
+            continue
+        shown[step.name] = version
+        plots = create_samtools_plots(sections)
+        with preview.container():
+            st.caption(f"👀 Preview from {step.label} - sections finished so far")
+            for name, fig in plots.items():
+                st.plotly_chart(fig, use_container_width=True, key=f"preview_{step.name}_{name}_{version}")
+
+def step_progress(title, started):
+    """Page elements following scheduler steps; returns ``(on_update, preview)``.
+
+    ``started`` is the wall-clock start time shown as elapsed time.
+    """
+    progress_bar = st.progress(0.0, text=title)
+    step_table = st.empty()
+    preview = st.empty()
+    shown = {}
+
+    def on_update(steps):
+        finished = sum(step.state in FINISHED_STATES for step in steps)
+        progress_bar.progress(
+            steps_done_fraction(steps),
+            text=f"{title} - {finished}/{len(steps)} steps, {time.time() - started:.0f} s elapsed"
+        )
+        step_table.markdown(format_step_table(steps))
+        render_partial_stats(preview, steps, shown)
+
+    return on_update, preview
+
+def run_scheduled_steps(scheduler, title):
+    """Run a scheduler while streaming per-step progress and partial plots into the page"""
+    on_update, preview = step_progress(title, time.time())
+    steps = scheduler.run(on_update=on_update)
+    preview.empty()
+    return steps
+
+def render_skipped_rows(skipped_rows):
+    """Mention QualiMap rows that were dropped as malformed"""
+    skipped = {name: count for name, count in skipped_rows.items() if count}
+    if skipped:
+        details = ", ".join(f"{name} ({count:,})" for name, count in skipped.items())
+        st.warning(f"⚠️ Skipped malformed QualiMap rows: {details}")
+
+def collect_or_stop(collect):
+    """Collect pipeline results, stopping the app if a required step failed"""
+    try:
+        results = collect()
+    except AnalysisError as e:
+        st.error(str(e))
+        st.stop()
+    for warning in results['warnings']:
+        st.warning(warning)
+    for error in results['errors']:
+        st.error(f"❌ {error}")
     return results
 
-def create_all_plots(qualimap_results):
-    """Create plots from QualiMap results"""
-    plots = {}
-    plot_configs = {
-        'coverage_across_reference': {
-            'type': 'line', 'x': 'Position', 'y': 'Coverage',
-            'title': "Coverage Across Reference", 'color': '#00CC96'
-        },
-        'coverage_histogram': {
-            'type': 'line', 'x': 'Coverage', 'y': 'Frequency', 'log_y': True,
-            'title': "Coverage Distribution", 'color': '#00CC96'
-        },
-        'duplication_rate_histogram': {
-            'type': 'bar', 'x': 'Duplication Rate', 'y': 'Count',
-            'title': "Duplication Rate Distribution"
-        },
-        'genome_fraction_coverage': {
-            'type': 'line', 'x': 'Coverage', 'y': 'Genome Fraction',
-            'title': "Genome Fraction Coverage", 'color': '#B6E880'
-        },
-        'homopolymer_indels': {
-            'type': 'bar', 'x': 'Type of indel', 'y': 'Number of indels',
-            'title': "Homopolymer Indels", 'color': 'Type of indel'
-        },
-        'insert_size_across_reference': {
-            'type': 'line', 'x': 'Position', 'y': 'Insert Size',
-            'title': "Insert Size Across Reference", 'color': '#636EFA'
-        },
-        'insert_size_histogram': {
-            'type': 'bar', 'x': 'Insert Size', 'y': 'Count',
-            'title': "Insert Size Distribution"
-        },
-        'mapped_reads_gc-content_distribution': {
-            'type': 'line', 'x': 'GC Content (%)', 'y': 'Sample',
-            'title': "GC Content Distribution", 'color': '#AB63FA'
-        },
-        'mapped_reads_nucleotide_content': {
-            'type': 'stacked', 'x': 'Position (bp)',
-            'cols': ['A', 'C', 'G', 'T', 'N'],
-            'title': "Nucleotide Content", 
-            'colors': ['#636EFA', '#00CC96', '#AB63FA', '#EF553B', '#FFA15A']
-        },
-        'mapping_quality_across_reference': {
-            'type': 'line', 'x': 'Position', 'y': 'Mapping Quality',
-            'title': "Mapping Quality Across Reference", 'color': '#EF553B'
-        },
-        'mapping_quality_histogram': {
-            'type': 'bar', 'x': 'Mapping Quality', 'y': 'Count',
-            'title': "Mapping Quality Distribution"
-        }
-    }
-    
-    for name, config in plot_configs.items():
-        if name in qualimap_results and not qualimap_results[name].empty:
-            df = qualimap_results[name]
-            if config['type'] == 'line':
-                fig = px.line(df, x=config['x'], y=config['y'], title=config['title'])
-                fig.update_traces(line=dict(width=2, color=config.get('color')))
-            elif config['type'] == 'bar':
-                fig = px.bar(df, x=config['x'], y=config['y'], title=config['title'],
-                            color=config.get('color', config['x']))
-            elif config['type'] == 'stacked':
-                fig = go.Figure()
-                for col, color in zip(config['cols'], config['colors']):
-                    fig.add_trace(go.Scatter(
-                        x=df[config['x']], y=df[col], name=col,
-                        line=dict(color=color), stackgroup='one'))
-                fig.update_layout(title=config['title'])
-            
-            plots[name] = apply_plot_style(fig)
-    
-    return plots
-
-def parse_samtools_stats(stats_file):
-    """Parse samtools stats output into a dictionary of DataFrames"""
-    stats = {}
-    current_section = None
-    data_lines = []
-    headers = []
-    
-    def safe_int_convert(value):
-        """Safely convert value to integer, handling special cases"""
-        try:
-            return int(value)
-        except ValueError:
-            # Handle ranges like "[1-1]" by taking the first number
-            if value.startswith('[') and '-' in value and value.endswith(']'):
-                return int(value.split('-')[0].strip('['))
-            return 0  # Default value if conversion fails
-    
-    def safe_float_convert(value):
-        """Safely convert value to float"""
+def get_job_queue(create=True):
+    """Return the process-wide background job queue, or None if ``create`` is false and none exists yet"""
+    from jobs import shared_queue
+    return shared_queue(create)
+
+def stage_job_input(uploaded, staged_path, job):
+    """Give a job its own copy of an upload, moving it if the page already staged it"""
+    if staged_path is not None:
+        return shutil.move(staged_path, job.workdir)
+    return stage_upload(uploaded, job.workdir)[0]
+
+def reference_name(filename):
+    """Registry name for a FASTA file: its base name without the extension, made safe"""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return re.sub(r"[^A-Za-z0-9._-]", "_", stem).lstrip("._-") or "reference"
+
+def save_reference(registry, uploaded_reference, local_reference):
+    """Register the chosen FASTA; an upload is staged inside the registry, so it is moved, not copied"""
+    name = reference_name(uploaded_reference.name if uploaded_reference else local_reference)
+    with st.spinner(f"💾 Storing and indexing {name}..."):
+        if uploaded_reference:
+            with tempfile.TemporaryDirectory(dir=registry.references_dir) as staging:
+                path, _ = stage_upload(uploaded_reference, staging)
+                registry.add(name, path, move=True)
+        else:
+            registry.add(name, local_reference)
+    st.success(f"📚 Registered **{name}** - CRAM files made against it now find it without an upload")
+
+def alignment_header(header_path, alignment_key):
+    """SAM header of an input, remembered per input since reruns do not stage uploads again"""
+    headers = st.session_state.setdefault("alignment_headers", {})
+    if alignment_key not in headers and header_path:
+        headers[alignment_key] = samtools_header(header_path)
+    return headers.get(alignment_key, "")
+
+def find_registered_reference(registry, choice, header_path, alignment_key):
+    """FASTA path of the chosen registered reference, or of the one matching the CRAM header"""
+    if choice != AUTO_REFERENCE:
+        return registry.fasta_path(choice)
+    name = registry.resolve(alignment_header(header_path, alignment_key))
+    if name is None:
+        return None
+    st.info(f"📚 Using the registered reference **{name}**, matched by the CRAM header")
+    return registry.fasta_path(name)
+
+def instant_summary(file_path, alignment_key, indexed=False):
+    """Header and index facts of an input, read before any full scan and remembered per input.
+
+    ``idxstats`` needs an index, so only indexed server files get per-contig
+    read counts; its text is None otherwise.
+    """
+    summaries = st.session_state.setdefault("instant_summaries", {})
+    if alignment_key not in summaries and file_path:
+        started = time.perf_counter()
+        # Unreadable files are left for the full analysis to report
         try:
-            return float(value)
-        except ValueError:
-            return 0.0  # Default value if conversion fails
-    
-    with open(stats_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line.startswith('#'):
-                continue
-            if line.startswith('SN'):
-                # Summary numbers section
-                line = line.split('#')[0].strip()
-                parts = line.split('\t')
-                if len(parts) >= 3:
-                    if 'SN' not in stats:
-                        stats['SN'] = []
-                    stats['SN'].append({
-                        'Metric': parts[1].strip(':'),
-                        'Value': parts[2].strip()
-                    })
-            elif line.startswith('FFQ'):
-                # First fragment qualities
-                parts = line.split('\t')
-                if len(parts) >= 3:
-                    if 'FFQ' not in stats:
-                        stats['FFQ'] = []
-                    stats['FFQ'].append({
-                        'Cycle': safe_int_convert(parts[1]),
-                        'Quality': safe_float_convert(parts[2])
-                    })
-            elif line.startswith('LFQ'):
-                # Last fragment qualities
-                parts = line.split('\t')
-                if len(parts) >= 3:
-                    if 'LFQ' not in stats:
-                        stats['LFQ'] = []
-                    stats['LFQ'].append({
-                        'Cycle': safe_int_convert(parts[1]),
-                        'Quality': safe_float_convert(parts[2])
-                    })
-            elif line.startswith('GCF'):
-                # GC content of first fragments
-                parts = line.split('\t')
-                if len(parts) >= 3:
-                    if 'GCF' not in stats:
-                        stats['GCF'] = []
-                    stats['GCF'].append({
-                        'GC%': safe_float_convert(parts[1]),
-                        'Count': safe_int_convert(parts[2])
-                    })
-            elif line.startswith('GCL'):
-                # GC content of last fragments
-                parts = line.split('\t')
-                if len(parts) >= 3:
-                    if 'GCL' not in stats:
-                        stats['GCL'] = []
-                    stats['GCL'].append({
-                        'GC%': safe_float_convert(parts[1]),
-                        'Count': safe_int_convert(parts[2])
-                    })
-            elif line.startswith('IS'):
-                # Insert sizes
-                parts = line.split('\t')
-                if len(parts) >= 3:
-                    if 'IS' not in stats:
-                        stats['IS'] = []
-                    stats['IS'].append({
-                        'Insert Size': safe_int_convert(parts[1]),
-                        'Count': safe_int_convert(parts[2])
-                    })
-            elif line.startswith('RL'):
-                # Read lengths
-                parts = line.split('\t')
-                if len(parts) >= 3:
-                    if 'RL' not in stats:
-                        stats['RL'] = []
-                    stats['RL'].append({
-                        'Length': safe_int_convert(parts[1]),
-                        'Count': safe_int_convert(parts[2])
-                    })
-            elif line.startswith('COV'):
-                # Coverage distribution
-                parts = line.split('\t')
-                if len(parts) >= 3:
-                    if 'COV' not in stats:
-                        stats['COV'] = []
-                    stats['COV'].append({
-                        'Coverage': safe_int_convert(parts[1]),
-                        'Count': safe_int_convert(parts[2])
-                    })
-    
-    # Convert lists to DataFrames
-    for key in stats:
-        stats[key] = pd.DataFrame(stats[key])
-    
-    return stats
-
-def create_samtools_plots(stats):
-    """Create plots from samtools stats"""
-    plots = {}
-    
-    # Summary metrics
-    if 'SN' in stats:
-        df = stats['SN']
-        # Filter for key metrics
-        key_metrics = ['raw total sequences', 'reads mapped', 'reads mapped and paired', 
-                      'reads properly paired', 'average length', 'average quality',
-                      'insert size average', 'insert size standard deviation',
-                      'inward oriented pairs', 'outward oriented pairs',
-                      'pairs with other orientation', 'pairs on different chromosomes']
-        
-        filtered_df = df[df['Metric'].isin(key_metrics)]
-        
-        # Convert values to numeric where possible
-        filtered_df['Value'] = pd.to_numeric(filtered_df['Value'], errors='coerce')
-        filtered_df = filtered_df.dropna()
-        
-        if not filtered_df.empty:
-            fig = px.bar(filtered_df, x='Metric', y='Value', title="Key Alignment Metrics")
-            plots['summary_metrics'] = apply_plot_style(fig)
-    
-    # First and last fragment qualities
-    if 'FFQ' in stats and 'LFQ' in stats:
-        ffq = stats['FFQ']
-        lfq = stats['LFQ']
-        
-        fig = go.Figure()
-        fig.add_trace(go.Scatter(
-            x=ffq['Cycle'], y=ffq['Quality'],
-            name='First Fragment',
-            line=dict(color='#636EFA')
-        ))
-        fig.add_trace(go.Scatter(
-            x=lfq['Cycle'], y=lfq['Quality'],
-            name='Last Fragment',
-            line=dict(color='#EF553B')
+            header = alignment_header(file_path, alignment_key)
+        except subprocess.CalledProcessError:
+            return None
+        idxstats_text = None
+        if indexed:
+            try:
+                idxstats_text = samtools_idxstats(file_path)
+            except subprocess.CalledProcessError:
+                pass
+        summaries[alignment_key] = {
+            'header': header, 'idxstats_text': idxstats_text, 'seconds': time.perf_counter() - started,
+        }
+    return summaries.get(alignment_key)
+
+def render_instant_summary(summary):
+    """Contigs, read groups, sort order, program chain and mapped reads from the header and index"""
+    header = summary['header']
+    contigs = parse_header_contigs(header)
+    hd = (parse_header_records(header, 'HD') or [{}])[0]
+    read_groups = parse_header_records(header, 'RG')
+    programs = program_chain(parse_header_records(header, 'PG'))
+    idxstats = parse_idxstats(summary['idxstats_text']) if summary['idxstats_text'] else None
+
+    cards = [
+        ("Contigs", f"{len(contigs):,}"),
+        ("Reference length (bp)", f"{sum(length for _, length in contigs):,}"),
+        ("Sort order", hd.get('SO', hd.get('GO', 'unknown'))),
+        ("Read groups", f"{len(read_groups):,}"),
+    ]
+    if idxstats is not None:
+        # The unmapped reads without a position are idxstats' '*' line
+        cards += [("Mapped reads", f"{idxstats['Mapped'].sum():,}"),
+                  ("Unmapped reads", f"{idxstats['Unmapped'].sum():,}")]
+    cols = st.columns(3)
+    for i, (metric, value) in enumerate(cards):
+        with cols[i % 3]:
+            st.markdown(f"""
+            <div class='metric-card glow'>
+                <h4 style='color: white; margin: 0; font-size: 0.9rem;'>{metric}</h4>
+                <h2 style='color: white; margin: 0.5rem 0 0 0;'>{value}</h2>
+            </div>
+            """, unsafe_allow_html=True)
+
+    if programs:
+        st.markdown("**🛠️ Program chain:** " + " → ".join(
+            f"`{program.get('PN', program.get('ID', '?'))}`" for program in programs
         ))
-        fig.update_layout(
-            title='Read Quality by Cycle',
-            xaxis_title='Cycle',
-            yaxis_title='Quality Score'
+        st.dataframe(pd.DataFrame([
+            {'ID': program.get('ID', ''), 'Program': program.get('PN', ''), 'Version': program.get('VN', ''),
+             'Command line': program.get('CL', '')} for program in programs
+        ]), use_container_width=True, hide_index=True)
+    if read_groups:
+        st.markdown("**👥 Read groups**")
+        st.dataframe(pd.DataFrame(read_groups), use_container_width=True, hide_index=True)
+
+    if idxstats is not None:
+        placed = idxstats[idxstats['Chromosome'] != '*']
+        shown = placed.nlargest(INSTANT_PLOT_CONTIGS, 'Mapped').sort_index()
+        title = "Mapped Reads by Contig (from the index)"
+        if len(shown) < len(placed):
+            title += f" - top {len(shown)} of {len(placed)}"
+        fig = px.bar(shown, x='Chromosome', y='Mapped', title=title)
+        fig.update_layout(xaxis_tickangle=-45)
+        st.plotly_chart(apply_plot_style(fig), use_container_width=True)
+    else:
+        st.caption("🗂️ No index next to this file: per-contig read counts come with the full scan")
+    st.caption(f"⚡ Read from the header{' and index' if idxstats is not None else ''} "
+               f"in {summary['seconds'] * 1000:,.0f} ms - the full-scan results fill in below")
+
+def analysis_job(file_path, reference_path, local_file, local_reference, cache_key, name, is_cram,
+                 threads, regions, coverage_engine, shards):
+    """Job function analyzing one file and saving its results, on a worker thread"""
+    result_cache, result_store, job_queue = get_result_cache(), get_result_store(), get_job_queue()
+
+    def run(job):
+        alignment_path, index_ready = file_path, False
+        reference, reference_indexed = reference_path, False
+        # Analyze server files in place, reusing indexes that are newer than the data
+        if local_file:
+            alignment_path, index_ready = prepare_local_input(local_file, job.workdir)
+        if local_reference:
+            reference, reference_indexed = prepare_local_input(local_reference, job.workdir)
+        results = analyze_sample(
+            alignment_path, job.workdir, reference, index_ready, reference_indexed, threads,
+            on_update=job_queue.step_callback(job), regions=regions, coverage_engine=coverage_engine,
+            shards=shards
         )
-        plots['read_quality'] = apply_plot_style(fig)
-    
-    # GC content
-    if 'GCF' in stats and 'GCL' in stats:
-        gcf = stats['GCF']
-        gcl = stats['GCL']
-        
-        fig = go.Figure()
-        fig.add_trace(go.Scatter(
-            x=gcf['GC%'], y=gcf['Count'],
-            name='First Fragment',
-            line=dict(color='#00CC96')
-        ))
-        fig.add_trace(go.Scatter(
-            x=gcl['GC%'], y=gcl['Count'],
-            name='Last Fragment',
-            line=dict(color='#AB63FA')
+        # Only keep complete analyses so failures are retried next time
+        if not results['errors']:
+            result_cache.put(cache_key, results)
+            result_store.save(cache_key, name, "cram" if is_cram else "bam", results)
+        return results
+
+    return run
+
+def follow_job(job, title):
+    """Show a background job's steps until it finishes, then return its results.
+
+    Leaving the page only stops the watching; the job keeps running.
+    """
+    job_queue = get_job_queue()
+    st.info(f"🔗 Job `{job.id}` runs in the background - closing this page does not stop it. "
+            "Reopen this page's link, or attach to the job ID in the sidebar, to come back to it.")
+    on_update, preview = step_progress(title, job.started or job.created)
+    waiting = st.empty()
+    while not job.is_finished:
+        if job.steps:
+            waiting.empty()
+            on_update(job.steps)
+        else:
+            position = job_queue.position(job)
+            if position:
+                waiting.caption(f"⏳ Waiting for a free worker - you are #{position} of "
+                                f"{job_queue.queued()} in the queue")
+        time.sleep(JOB_POLL_SECONDS)
+    waiting.empty()
+    preview.empty()
+    if job.steps:
+        on_update(job.steps)
+    elif job.step_table:
+        # A job of an earlier server process: only its final step states are known
+        st.markdown(format_step_rows(
+            (row['label'], row['state'], row['wall_time'], "") for row in job.step_table
         ))
-        fig.update_layout(
-            title='GC Content Distribution',
-            xaxis_title='GC %',
-            yaxis_title='Count'
+
+    if job.state != DONE:
+        st.error(f"❌ Job {job.id} {job.state}: {job.error}")
+        st.stop()
+    return collect_or_stop(lambda: job.results)
+
+def run_quick_look(file_path, reference_path, tmpdir, index_ready=False, reference_indexed=False,
+                   threads=DEFAULT_THREADS):
+    """Sample the file through its index and return the estimates"""
+    scheduler, genome_length, groups = plan_quick_look(
+        file_path, tmpdir, reference_path, index_ready, reference_indexed, threads
+    )
+    steps = run_scheduled_steps(scheduler, "⚡ Sampling the file")
+    return collect_or_stop(lambda: collect_quick_look(steps, genome_length, groups))
+
+def render_quick_look(results):
+    """Quick-look estimates: metric cards with 95% intervals and the sampled plots"""
+    quick = results['quick_look']
+    st.warning(
+        f"⚡ **Quick look - every number below is an estimate** from {quick['fraction']:.2%} of the genome "
+        f"({quick['windows']} windows in {quick['groups']} groups), with a 95% confidence interval. "
+        "Unmapped reads without a position are not sampled."
+    )
+    st.button("🔬 Run the full analysis", type="primary",
+              on_click=lambda: st.session_state.update(quick_look=False))
+
+    tab1, tab2 = st.tabs(["📊 Estimated Statistics", "📈 Visualizations (sample)"])
+    with tab1:
+        st.markdown("""
+        <div style="background-color: rgba(0, 0, 0, 0.6); padding: 15px; border-radius: 10px;">
+            <h3 style="color: white;">📐 Estimated Alignment Statistics</h3>
+        </div>
+        """, unsafe_allow_html=True)
+
+        cols = st.columns(3)
+        for i, row in quick['flagstat'].iterrows():
+            margin = row['CI High'] - row['Value']
+            with cols[i % 3]:
+                st.markdown(f"""
+                <div class='metric-card glow'>
+                    <h4 style='color: white; margin: 0; font-size: 0.9rem;'>{row['Metric']} (estimate)</h4>
+                    <h2 style='color: white; margin: 0.5rem 0 0 0;'>≈ {row['Value']:,.0f}</h2>
+                    <p style='color: rgba(255, 255, 255, 0.85); margin: 0;'>± {margin:,.0f} (95% CI)</p>
+                </div>
+                """, unsafe_allow_html=True)
+
+        stats = results.get('stats', {})
+        if 'SN' in stats:
+            st.markdown("""
+            <div style="background-color: rgba(0, 0, 0, 0.6); padding: 15px; border-radius: 10px; margin-top: 20px;">
+            <h3 style="color: white;">📋 Estimated Samtools Stats Summary</h3>
+            </div>
+            """, unsafe_allow_html=True)
+            st.dataframe(stats['SN'], use_container_width=True)
+            st.download_button(
+                label="📊 Download Estimates (CSV)",
+                data=stats['SN'].to_csv(index=False),
+                file_name="quick_look_estimates.csv",
+                mime="text/csv"
+            )
+
+    with tab2:
+        st.caption("📐 Distributions are drawn from the sampled windows only")
+        for plot_name, fig in create_samtools_plots(results.get('stats', {})).items():
+            if plot_name != 'summary_metrics':
+                fig.update_layout(title_text=f"{fig.layout.title.text} (sample)")
+            st.plotly_chart(fig, use_container_width=True)
+            render_plot_downloads(fig, plot_name, "quick")
+
+def format_sample_table(samples):
+    """Render cohort samples as a markdown status table"""
+    icons = {PENDING: "⏳", RUNNING: "🔄", DONE: "✅", FAILED: "❌"}
+    lines = ["| Sample | Status | Wall time |", "|---|---|---|"]
+    for sample in samples:
+        if sample.from_cache:
+            status, wall_time = "⚡ cached", "-"
+        else:
+            status = f"{icons[sample.state]} {sample.state}"
+            wall_time = f"{sample.wall_time:.1f} s" if sample.wall_time is not None else "-"
+        lines.append(f"| {sample.name} | {status} | {wall_time} |")
+    return "\n".join(lines)
+
+def run_batch_analysis(uploaded_files, local_files, uploaded_reference, local_reference,
+                       threads=DEFAULT_THREADS, regions=None, coverage_engine=COVERAGE_ENGINE,
+                       reference_choice=AUTO_REFERENCE):
+    """Analyze a cohort of files and show the cross-sample dashboard"""
+    result_cache = get_result_cache()
+    region_key = regions_key(regions) if regions else ""
+    paths = [uploaded.name for uploaded in uploaded_files] or local_files
+    names = unique_sample_names(paths)
+    crams = [path for path in paths if path.lower().endswith('.cram')]
+    needs_reference = bool(crams)
+    if needs_reference and not (uploaded_reference or local_reference):
+        # One reference serves the cohort: the chosen one, or the first server CRAM's
+        first_cram = crams[0] if local_files else None
+        local_reference = find_registered_reference(
+            get_reference_registry(), reference_choice, first_cram,
+            local_file_fingerprint(first_cram) if first_cram else None
         )
-        plots['gc_content'] = apply_plot_style(fig)
-    
-    # Insert size
-    if 'IS' in stats:
-        df = stats['IS']
-        fig = px.line(df, x='Insert Size', y='Count', title="Insert Size Distribution")
-        plots['insert_size'] = apply_plot_style(fig)
-    
-    # Read length
-    if 'RL' in stats:
-        df = stats['RL']
-        fig = px.line(df, x='Length', y='Count', title="Read Length Distribution")
-        plots['read_length'] = apply_plot_style(fig)
-    
-    # Coverage
-    if 'COV' in stats:
-        df = stats['COV']
-        fig = px.area(
-            df, x='Coverage', y='Count', title="Coverage Distribution (Area Plot)", line_shape='spline'
+    if needs_reference and not (uploaded_reference or local_reference):
+        st.warning("⚠️ CRAM samples need a reference genome for samtools stats; "
+                   "they will only get flagstat metrics")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        reference_path, reference_key, reference_indexed = None, "", False
+        if needs_reference and local_reference:
+            reference_path, reference_indexed = prepare_local_input(local_reference, tmpdir)
+            reference_key = local_file_fingerprint(local_reference)
+        elif needs_reference and uploaded_reference:
+            reference_path, reference_key = stage_upload(uploaded_reference, tmpdir)
+
+        samples = []
+        for index, name in enumerate(names):
+            path = paths[index]
+            is_cram = path.lower().endswith('.cram')
+            if local_files:
+                sample = Sample(name, path, analysis_cache_key(
+                    is_cram, local_file_fingerprint(path), reference_key if is_cram else "", region_key,
+                    coverage_engine
+                ), local=True)
+            else:
+                # Uploads live in memory, so each one is staged and hashed
+                upload_dir = os.path.join(tmpdir, f"upload_{index:04d}")
+                os.makedirs(upload_dir)
+                file_path, digest = stage_upload(uploaded_files[index], upload_dir)
+                sample = Sample(name, file_path, analysis_cache_key(
+                    is_cram, digest, reference_key if is_cram else "", region_key, coverage_engine
+                ))
+            samples.append(sample)
+
+        workers = max_parallel_samples()
+        title = f"📚 Analyzing {len(samples)} samples ({workers} at a time)"
+        progress_bar = st.progress(0.0, text=title)
+        sample_table = st.empty()
+        started = time.monotonic()
+
+        def on_update(samples):
+            finished = sum(sample.state in (DONE, FAILED) for sample in samples)
+            progress_bar.progress(
+                finished / len(samples),
+                text=f"{title} - {finished}/{len(samples)} done, {time.monotonic() - started:.0f} s elapsed"
+            )
+            sample_table.markdown(format_sample_table(samples))
+
+        run_cohort(samples, result_cache, tmpdir, reference_path, reference_indexed,
+                   threads=threads, max_workers=workers, on_update=on_update, regions=regions,
+                   coverage_engine=coverage_engine, store=get_result_store())
+
+    render_cohort(samples)
+
+def render_cohort(samples):
+    """Cross-sample dashboard: per-sample metrics and overlaid curves"""
+    analyzed = sum(sample.state == DONE for sample in samples)
+    cached = sum(sample.from_cache for sample in samples)
+    st.success(f"🎉 Cohort Analysis Complete! {analyzed}/{len(samples)} samples "
+               f"({cached} loaded from cache)")
+    for sample in samples:
+        if sample.state == FAILED:
+            st.error(f"❌ {sample.name}: {sample.error}")
+        elif sample.results and sample.results['errors']:
+            st.warning(f"⚠️ {sample.name}: {'; '.join(sample.results['errors'])}")
+
+    tab1, tab2 = st.tabs(["📊 Sample Metrics", "📈 Cohort Curves"])
+    summary = cohort_summary(samples)
+    with tab1:
+        st.markdown("""
+        <div style="background-color: rgba(0, 0, 0, 0.6); padding: 15px; border-radius: 10px;">
+            <h3 style="color: white;">📊 Key Metrics per Sample</h3>
+        </div>
+        """, unsafe_allow_html=True)
+        st.dataframe(summary, use_container_width=True, hide_index=True)
+        st.download_button(
+            label="📊 Download Cohort Metrics (CSV)",
+            data=summary.to_csv(index=False),
+            file_name=f"cohort_metrics_{datetime.now().strftime('%Y%m%d')}.csv",
+            mime="text/csv",
+            on_click="ignore"
         )
-        plots['coverage'] = apply_plot_style(fig)
-    
-    return plots
-
-def apply_plot_style(fig):
-    """Apply consistent styling with bold dark fonts for white background apps"""
-    fig.update_layout(
-        paper_bgcolor='white',  # White background for paper
-        plot_bgcolor='rgba(240,240,240,0.9)',  # Light gray plot area
-        font=dict(
-            color='#222222',          # Very dark gray text (almost black)
-            family='Arial Black',     # Bold font family
-            size=14
-        ),
-        xaxis=dict(
-            gridcolor='rgba(0,0,0,0.1)',  # Light grid lines
-            title_font=dict(size=14, color='#222222', family='Arial Black'),
-            tickfont=dict(size=13, color='#222222', family='Arial Black')
-        ),
-        yaxis=dict(
-            gridcolor='rgba(0,0,0,0.1)',
-            title_font=dict(size=14, color='#222222', family='Arial Black'),
-            tickfont=dict(size=13, color='#222222', family='Arial Black')
-        ),
-        hovermode='x unified',
-        margin=dict(l=50, r=50, b=50, t=70)
+
+    with tab2:
+        # Keep the total number of points in each overlay near the plot budget
+        max_points = max(100, PLOT_MAX_POINTS // max(1, len(samples)))
+        curves = [
+            ('COV', 'Coverage', 'Count', "Coverage Distribution Across Samples", True),
+            ('IS', 'Insert Size', 'Count', "Insert Size Distribution Across Samples", False),
+        ]
+        for section, x, y, title, log_y in curves:
+            frame = cohort_curves(samples, section, x, y, max_points)
+            if frame.empty:
+                continue
+            fig = px.line(frame, x=x, y=y, color='Sample', title=title, log_y=log_y)
+            st.plotly_chart(apply_plot_style(fig), use_container_width=True)
+
+def render_past_analyses(store):
+    """Cross-sample query over the stored analyses, e.g. properly paired % below 90"""
+    from result_store import QUERY_OPERATORS
+
+    if not store.available:
+        st.info("📚 The results store needs pyarrow, which is not available on this server.")
+        return
+    metrics = store.metrics()
+    if not metrics:
+        st.info("📚 No analyses stored yet - completed analyses are saved here automatically.")
+        return
+    default = "percentage of properly paired reads (%)"
+    col1, col2, col3 = st.columns([3, 1, 1])
+    metric = col1.selectbox("Metric", metrics, index=metrics.index(default) if default in metrics else 0)
+    op = col2.selectbox("Condition", list(QUERY_OPERATORS), index=0)
+    value = col3.number_input("Value", value=90.0)
+    matches = store.query(metric, op, value)
+    st.markdown(f"**{len(matches)}** of {len(store.samples())} stored samples match")
+    st.dataframe(matches, use_container_width=True, hide_index=True)
+
+def render_cache_stats(cache):
+    """Show result cache hit/miss counters"""
+    cache_stats = cache.stats()
+    st.markdown("### ⚡ Result Cache")
+    st.markdown(
+        f"**Hits:** {cache_stats['hits']} &nbsp; **Misses:** {cache_stats['misses']}  \n"
+        f"**Entries:** {cache_stats['entries']} "
+        f"({cache_stats['size_bytes'] / 1024 ** 2:,.1f} / {cache_stats['max_bytes'] / 1024 ** 2:,.0f} MB)"
     )
-    return fig
-
-def create_download_zip(temp_dir, files_to_zip, zip_name):
-    """Create a zip file from multiple files in a temporary directory"""
-    zip_path = os.path.join(temp_dir, zip_name)
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
-        for file_info in files_to_zip:
-            file_path = file_info['path']
-            arcname = file_info.get('arcname', os.path.basename(file_path))
-            zipf.write(file_path, arcname)
-    return zip_path
-
-def save_plotly_figure(fig, path, format='html'):
-    """Save plotly figure in multiple formats"""
-    if format == 'html':
-        fig.write_html(path)
-    elif format == 'png':
-        fig.write_image(path)
-    elif format == 'svg':
-        fig.write_image(path, format='svg')
-    elif format == 'pdf':
-        fig.write_image(path, format='pdf')
-
-if uploaded_file:
-    is_cram = uploaded_file.name.lower().endswith('.cram')
-    is_bam = uploaded_file.name.lower().endswith('.bam')
 
+def render_server_load(governor, job_queue):
+    """Show the shared resource budget in use and, once there is a job queue, its waits"""
+    load = governor.stats()
+    memory = (f"{load['used_mem_mb'] / 1024:,.1f} / {load['max_mem_mb'] / 1024:,.1f} GB"
+              if load['max_mem_mb'] else "unlimited")
+    st.markdown("### 🚦 Server Load")
+    lines = [
+        f"**CPUs:** {load['used_cpus']} / {load['max_cpus']} &nbsp; "
+        f"**JVMs:** {load['used_jvms']} / {load['max_jvms']}",
+        f"**Memory:** {memory}",
+        f"**Steps waiting:** {load['waiting']} (mean wait {load['mean_wait']:.1f} s)",
+    ]
+    jobs = job_queue.metrics() if job_queue else None
+    if jobs:
+        lines.append(f"**Jobs:** {jobs['running']} running, {jobs['queued']} / {jobs['max_queued']} queued")
+    if jobs and jobs['wait_mean'] is not None:
+        lines.append(f"**Queue wait:** {jobs['wait_median']:.0f} s median, {jobs['wait_max']:.0f} s max")
+    if jobs and jobs['run_mean'] is not None:
+        lines.append(f"**Run time:** {jobs['run_median']:.0f} s median, {jobs['run_max']:.0f} s max")
+    st.markdown("  \n".join(lines))
+
+if register_reference:
+    save_reference(reference_registry, uploaded_reference, local_reference)
+
+# A background job to show: from the page's ?job= link or the sidebar, when no file is chosen
+attached_job_id = None
+if not (uploaded_files or local_files or uploaded_file or local_file):
+    attached_job_id = st.query_params.get("job")
+
+if uploaded_files or local_files or uploaded_file or local_file or attached_job_id:
+    import pandas as pd
+    import plotly.express as px
+    from downsample import PLOT_MAX_POINTS
+    from parsers import (parse_flagstat, parse_header_contigs, parse_header_records, parse_idxstats,
+                         program_chain)
+    from plots import create_all_plots, create_samtools_plots, apply_plot_style, ZOOMABLE_PLOTS
+    from analysis import AnalysisError, analysis_cache_key, analyze_sample
+    from sharding import SHARDED_STATS_CAVEAT
+    from jobs import QueueFull
+    from cohort import (Sample, run_cohort, cohort_summary, cohort_curves, max_parallel_samples,
+                        unique_sample_names)
+    from quicklook import collect_quick_look, plan_quick_look, quick_look_cache_key
+
+if uploaded_files or local_files:
+    run_batch_analysis(uploaded_files, local_files, uploaded_reference, local_reference, thread_budget,
+                       regions, coverage_engine, reference_choice)
+
+elif uploaded_file or local_file or attached_job_id:
+    attached_job = None
+    if not (uploaded_file or local_file):
+        attached_job = get_job_queue().get(attached_job_id)
+        if attached_job is None:
+            st.error(f"❌ No job with ID {attached_job_id} on this server")
+            st.stop()
+        input_name = attached_job.name
+    else:
+        input_name = uploaded_file.name if uploaded_file else os.path.basename(local_file)
+    is_cram = input_name.lower().endswith('.cram')
+    is_bam = input_name.lower().endswith('.bam')
+
+    if attached_job:
+        confirmation = f"Attached to Job {attached_job.id}"
+    else:
+        confirmation = 'File Uploaded Successfully!' if uploaded_file else 'Server File Selected!'
     # Stylish Upload Confirmation
     st.markdown(f"""
     <div style='background: linear-gradient(135deg, rgba(0, 184, 148, 0.9), rgba(0, 160, 133, 0.9)); 
                 padding: 1rem; border-radius: 10px; color: white; margin: 1rem 0;
                 box-shadow: 0 4px 15px rgba(0, 0, 0, 0.3); border: 1px solid rgba(255, 255, 255, 0.2);'>
-        <h4 style='color: white; margin: 0;'>✅ File Uploaded Successfully!</h4>
-        <p style='margin: 0.5rem 0 0 0;'>Processing: <strong>{uploaded_file.name}</strong></p>
+        <h4 style='color: white; margin: 0;'>✅ {confirmation}</h4>
+        <p style='margin: 0.5rem 0 0 0;'>Processing: <strong>{input_name}</strong></p>
     </div>
     """, unsafe_allow_html=True)
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        file_path = os.path.join(tmpdir, uploaded_file.name)
-        reference_path = None
+    result_cache = get_result_cache()
+    use_reference = attached_job.info.get('use_reference', False) if attached_job else False
+    title = "🧬 Analyzing CRAM file" if is_cram else "🧬 Analyzing BAM file"
 
-        # Save files
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.read())
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = reference_path = None
+        index_ready = reference_indexed = False
+        quick = reopened = False
+
+        if attached_job:
+            results = follow_job(attached_job, title)
+        else:
+            if local_file:
+                alignment_key = local_file_fingerprint(local_file)
+            else:
+                # New uploads are hashed while they are saved; reruns reuse the hash
+                if get_upload_digest(uploaded_file) is None:
+                    file_path, _ = stage_upload(uploaded_file, tmpdir)
+                alignment_key = get_upload_digest(uploaded_file)
+
+            # Without a FASTA, a CRAM uses a registered reference: the chosen one or its header's
+            if is_cram and not (uploaded_reference or local_reference):
+                local_reference = find_registered_reference(
+                    reference_registry, reference_choice, local_file or file_path, alignment_key
+                )
+            use_reference = is_cram and bool(uploaded_reference or local_reference)
+            if use_reference and local_reference:
+                reference_key = local_file_fingerprint(local_reference)
+            elif use_reference:
+                if get_upload_digest(uploaded_reference) is None:
+                    reference_path, _ = stage_upload(uploaded_reference, tmpdir)
+                reference_key = get_upload_digest(uploaded_reference)
+            else:
+                reference_key = ""
+
+            # A quick look at a CRAM file needs the reference to decode the sampled reads, and
+            # any quick look an index: building one would read the whole file first
+            indexed = bool(local_file and find_index(local_file))
+            quick = quick_look_mode and (not is_cram or use_reference) and indexed
+            if quick_look_mode and not indexed:
+                st.warning("⚠️ A quick look samples the file through its index, and this file has none "
+                           "(uploads never do); running the full analysis")
+            elif quick_look_mode and not quick:
+                st.warning("⚠️ A quick look at a CRAM file needs its reference genome; running the full analysis")
+
+            # Reuse results from an earlier run on identical inputs and tool versions
+            if quick:
+                cache_key = quick_look_cache_key(is_cram, alignment_key, reference_key)
+            else:
+                cache_key = analysis_cache_key(is_cram, alignment_key, reference_key, region_key,
+                                               coverage_engine, stats_shards)
+            results = result_cache.get(cache_key)
+            if results is None and not quick:
+                results = get_result_store().load(cache_key)
+                reopened = results is not None
+
+            # Header and index facts come first, before any full scan starts
+            summary = instant_summary(local_file or file_path, alignment_key, indexed)
+            if summary:
+                with st.expander("⚡ Instant summary - header and index", expanded=results is None):
+                    render_instant_summary(summary)
+
+        if results is None and quick:
+            # Only indexed server files get a quick look; they are read in place
+            file_path, index_ready = prepare_local_input(local_file, tmpdir)
+            if use_reference and local_reference:
+                reference_path, reference_indexed = prepare_local_input(local_reference, tmpdir)
+            elif use_reference and reference_path is None:
+                reference_path, _ = stage_upload(uploaded_reference, tmpdir)
+
+            results = run_quick_look(
+                file_path, reference_path, tmpdir, index_ready, reference_indexed, thread_budget
+            )
+            if not results['errors']:
+                result_cache.put(cache_key, results)
+        elif results is None:
+            # Full analyses run as background jobs, so they outlive this page;
+            # a job already computing the same results is joined instead
+            job_queue = get_job_queue()
+            job = job_queue.find_active(cache_key)
+            if job is None:
+                def stage_inputs(job):
+                    staged_file, staged_reference = file_path, reference_path
+                    if not local_file:
+                        staged_file = stage_job_input(uploaded_file, file_path, job)
+                    if use_reference and not local_reference:
+                        staged_reference = stage_job_input(uploaded_reference, reference_path, job)
+                    return staged_file, staged_reference
+                try:
+                    # Failed copies, reruns and stops while saving leave no job behind
+                    job, (file_path, reference_path) = job_queue.create_staged(
+                        input_name, stage_inputs, cache_key, {'use_reference': use_reference}
+                    )
+                except QueueFull as e:
+                    st.error(f"🚦 The server is busy: {e}")
+                    st.stop()
+                job_queue.start(job, analysis_job(
+                    file_path, reference_path, local_file, local_reference if use_reference else None,
+                    cache_key, input_name, is_cram, thread_budget, regions, coverage_engine, stats_shards
+                ))
+            st.query_params["job"] = job.id
+            results = follow_job(job, title)
+        elif reopened:
+            st.info("📂 Reopened this analysis from the results store - no tools were re-run.")
+        elif not attached_job:
+            st.info("⚡ Loaded cached results for this file - no tools were re-run.")
+
+        if quick:
+            render_quick_look(results)
+            with cache_stats_placeholder.container():
+                render_cache_stats(result_cache)
+            with server_load_placeholder.container():
+                render_server_load(GOVERNOR, get_job_queue(create=False))
+            st.stop()
+
+        flagstat_text = results['flagstat_text']
+
+        # 🚀 For CRAM without a reference: flagstat only
+        if is_cram and not use_reference:
+            st.success("🎉 Basic CRAM Analysis Complete!")
+            st.warning("⚠️ For full CRAM analysis including coverage metrics, please upload a reference genome "
+                       "or register it on the server (💾) so it is found from the CRAM header")
             
-        if uploaded_reference:
-            reference_path = os.path.join(tmpdir, uploaded_reference.name)
-            with open(reference_path, "wb") as f:
-                f.write(uploaded_reference.read())
+            # Display results in a single tab
+            tab = st.tabs(["📊 Alignment Statistics"])[0]
             
-        # Run flagstat for both BAM and CRAM
-        with st.spinner("🔍 Running samtools flagstat..."):
-            try:
-                flagstat_result = subprocess.run(
-                    ["samtools", "flagstat", file_path],
-                    capture_output=True, text=True, check=True
-                )
-                flagstat_text = flagstat_result.stdout
-            except subprocess.CalledProcessError as e:
-                st.error(f"❌ Failed to run samtools flagstat: {e.stderr}")
-                st.stop()
-            except Exception as e:
-                st.error(f"❌ Error processing file: {str(e)}")
-                st.stop()
-
-        # 🚀 For CRAM: Enhanced analysis with samtools stats when reference is provided
-        if is_cram:
-            if uploaded_reference:
-                st.success("🎉 CRAM Analysis with Reference Complete!")
-                
-                # Run samtools stats
-                with st.spinner("🧬 Running samtools stats (this may take a few minutes)..."):
-                    try:
-                        stats_file = os.path.join(tmpdir, "samtools_stats.txt")
-                        
-                        # Run samtools stats with reference
-                        result = subprocess.run([
-                            "samtools", "stats",
-                            "-r", reference_path,
-                            file_path
-                        ], capture_output=True, text=True)
-                        
-                        # Save stats to file
-                        with open(stats_file, 'w') as f:
-                            f.write(result.stdout)
-                            
-                        # Parse stats
-                        stats = parse_samtools_stats(stats_file)
-                        stats_plots = create_samtools_plots(stats)
-                        
-                    except Exception as e:
-                        st.error(f"❌ samtools stats failed with error: {str(e)}")
-                        stats = {}
-                        stats_plots = {}
-                        
-                # Display results in tabs
-                tab1, tab2 = st.tabs(["📊 Alignment Statistics", "📈 Visualizations"])
-                
-                with tab1:
-                    st.markdown("""
-                    <div style="background-color: rgba(0, 0, 0, 0.6); padding: 15px; border-radius: 10px;">
-                        <h3 style="color: white;">📊 CRAM File Alignment Statistics</h3>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                    # Parse flagstat metrics
-                    metrics_data = []
-                    for line in flagstat_text.splitlines():
-                        if line.strip():
-                            parts = line.split('+')
-                            if len(parts) == 2:
-                                count = int(parts[0].strip())
-                                desc = parts[1].split('(')[0].strip()
-                                metrics_data.append({"metric": desc, "count": count})
-
-                    # Create metric cards
-                    if metrics_data:
-                        cols = st.columns(3)
-                        for i, metric in enumerate(metrics_data):
-                            with cols[i % 3]:
-                                st.markdown(f"""
-                                <div class='metric-card glow'>
-                                    <h4 style='color: white; margin: 0; font-size: 0.9rem;'>{metric['metric']}</h4>
-                                    <h2 style='color: white; margin: 0.5rem 0 0 0;'>{metric['count']:,}</h2>
-                                </div>
-                                """, unsafe_allow_html=True)
-                                
-                    # Show samtools stats summary
-                    if 'SN' in stats:
-                        st.markdown("""
-                        <div style="background-color: rgba(0, 0, 0, 0.6); padding: 15px; border-radius: 10px; margin-top: 20px;">
-                        <h3 style="color: white;">📋 Samtools Stats Summary</h3>
-                        </div>
-                        """, unsafe_allow_html=True)
-
-                        # Convert the list of dicts into a DataFrame (if not already)
-                        all_stats_df = pd.DataFrame(stats['SN'])
-
-                        # Show the full dataframe
-                        st.dataframe(all_stats_df, use_container_width=True)
-                        
-                        # Download button for stats
-                        st.markdown("### 📥 Download Statistics")
-                        csv = all_stats_df.to_csv(index=False)
-                        st.download_button(
-                            label="📊 Download Stats (CSV)",
-                            data=csv,
-                            file_name="cram_stats_summary.csv",
-                            mime="text/csv"
-                        )
+            with tab:
+                st.markdown("""
+                <div style="background-color: rgba(0, 0, 0, 0.6); padding: 15px; border-radius: 10px;">
+                    <h3 style="color: white;">📊 CRAM File Alignment Statistics</h3>
+                </div>
+                """, unsafe_allow_html=True)
                 
-                with tab2:
-                    st.markdown("""
-                    <div style="background-color: rgba(0, 0, 0, 0.6); padding: 15px; border-radius: 10px;">
-                        <h3 style="color: white;">📈 Samtools Stats Visualizations</h3>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                    # Display all available plots
-                    for plot_name, fig in stats_plots.items():
-                        st.plotly_chart(fig, use_container_width=True)
-                        
-                        # Download buttons for each plot
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.download_button(
-                                label=f"📥 {plot_name} (HTML)",
-                                data=fig.to_html(),
-                                file_name=f"{plot_name}.html",
-                                mime="text/html"
-                            )
-                        with col2:
-                            st.download_button(
-                                label=f"📥 {plot_name} (PNG)",
-                                data=fig.to_image(format="png"),
-                                file_name=f"{plot_name}.png",
-                                mime="image/png"
-                            )
-                        with col3:
-                            st.download_button(
-                                label=f"📥 {plot_name} (PDF)",
-                                data=fig.to_image(format="pdf"),
-                                file_name=f"{plot_name}.pdf",
-                                mime="application/pdf"
-                            )
-                    
-                    st.markdown("---")
-                    st.markdown("### 📦 Download All Results")
-                    
-                    # Prepare files for zip
-                    files_to_zip = []
-                    
-                    # Add flagstat
-                    flagstat_path = os.path.join(tmpdir, "flagstat.txt")
-                    with open(flagstat_path, "w") as f:
-                        f.write(flagstat_text)
-                    files_to_zip.append({"path": flagstat_path, "arcname": "flagstat.txt"})
-                    
-                    # Add stats
-                    for stat_name, df in stats.items():
-                        stat_path = os.path.join(tmpdir, f"{stat_name}.csv")
-                        df.to_csv(stat_path, index=False)
-                        files_to_zip.append({"path": stat_path, "arcname": f"stats/{stat_name}.csv"})
-                    
-                    # Add plots in multiple formats
-                    for plot_name, fig in stats_plots.items():
-                        # HTML
-                        html_path = os.path.join(tmpdir, f"{plot_name}.html")
-                        fig.write_html(html_path)
-                        files_to_zip.append({"path": html_path, "arcname": f"plots/html/{plot_name}.html"})
-                        
-                        # PNG
-                        png_path = os.path.join(tmpdir, f"{plot_name}.png")
-                        fig.write_image(png_path)
-                        files_to_zip.append({"path": png_path, "arcname": f"plots/png/{plot_name}.png"})
-                        
-                        # PDF
-                        pdf_path = os.path.join(tmpdir, f"{plot_name}.pdf")
-                        fig.write_image(pdf_path, format="pdf")
-                        files_to_zip.append({"path": pdf_path, "arcname": f"plots/pdf/{plot_name}.pdf"})
-                    
-                    # Create zip file
-                    zip_path = os.path.join(tmpdir, "cram_analysis_results.zip")
-                    with zipfile.ZipFile(zip_path, 'w') as zipf:
-                        for file_info in files_to_zip:
-                            zipf.write(file_info['path'], file_info['arcname'])
-                    
-                    # Download button for zip
-                    with open(zip_path, "rb") as f:
-                        st.download_button(
-                            label="📦 Download All Results (ZIP)",
-                            data=f,
-                            file_name=f"cram_analysis_{datetime.now().strftime('%Y%m%d')}.zip",
-                            mime="application/zip"
-                        )
-
-            else:  # No reference provided for CRAM
-                st.success("🎉 Basic CRAM Analysis Complete!")
-                st.warning("⚠️ For full CRAM analysis including coverage metrics, please upload a reference genome")
-                
-                # Display results in a single tab
-                tab = st.tabs(["📊 Alignment Statistics"])[0]
+                metrics_data = [{"metric": metric, "count": count}
+                                for metric, count in parse_flagstat(flagstat_text)]
+
+                # Create metric cards
+                if metrics_data:
+                    cols = st.columns(3)
+                    for i, metric in enumerate(metrics_data):
+                        with cols[i % 3]:
+                            st.markdown(f"""
+                            <div class='metric-card glow'>
+                                <h4 style='color: white; margin: 0; font-size: 0.9rem;'>{metric['metric']}</h4>
+                                <h2 style='color: white; margin: 0.5rem 0 0 0;'>{metric['count']:,}</h2>
+                            </div>
+                            """, unsafe_allow_html=True)
                 
-                with tab:
-                    st.markdown("""
-                    <div style="background-color: rgba(0, 0, 0, 0.6); padding: 15px; border-radius: 10px;">
-                        <h3 style="color: white;">📊 CRAM File Alignment Statistics</h3>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                    # Parse flagstat metrics
-                    metrics_data = []
-                    for line in flagstat_text.splitlines():
-                        if line.strip():
-                            parts = line.split('+')
-                            if len(parts) == 2:
-                                count = int(parts[0].strip())
-                                desc = parts[1].split('(')[0].strip()
-                                metrics_data.append({"metric": desc, "count": count})
-
-                    # Create metric cards
-                    if metrics_data:
-                        cols = st.columns(3)
-                        for i, metric in enumerate(metrics_data):
-                            with cols[i % 3]:
-                                st.markdown(f"""
-                                <div class='metric-card glow'>
-                                    <h4 style='color: white; margin: 0; font-size: 0.9rem;'>{metric['metric']}</h4>
-                                    <h2 style='color: white; margin: 0.5rem 0 0 0;'>{metric['count']:,}</h2>
-                                </div>
-                                """, unsafe_allow_html=True)
-                    
-                    # Download button for flagstat
-                    st.markdown("### 📥 Download Results")
-                    st.download_button(
-                        label="📊 Download Flagstat Results (CSV)",
-                        data=pd.DataFrame(metrics_data).to_csv(index=False),
-                        file_name="cram_flagstat_results.csv",
-                        mime="text/csv"
-                    )
+                # Download button for flagstat
+                st.markdown("### 📥 Download Results")
+                st.download_button(
+                    label="📊 Download Flagstat Results (CSV)",
+                    data=pd.DataFrame(metrics_data).to_csv(index=False),
+                    file_name="cram_flagstat_results.csv",
+                    mime="text/csv"
+                )
 
-        # 🚀 For BAM: Full analysis
-        elif is_bam:
+        # 🚀 For BAM, and CRAM with its reference: Full analysis
+        else:
+            kind = "cram" if is_cram else "bam"
             try:
-                # First ensure BAM is indexed
-                with st.spinner("📇 Indexing BAM file..."):
-                    try:
-                        subprocess.run(["samtools", "index", file_path], check=True)
-                    except subprocess.CalledProcessError as e:
-                        st.error(f"❌ Failed to index BAM: {e.stderr}")
-                        st.stop()
-
-                # Qualimap analysis
-                with st.spinner("🧬 Running QualiMap (this may take several minutes)..."):
-                    out_dir = os.path.join(tmpdir, "qualimap_out")
-                    os.makedirs(out_dir, exist_ok=True)
-
-                    subprocess.run([
-                        "qualimap", "bamqc",
-                        "-bam", file_path,
-                        "-outdir", out_dir,
-                        "--java-mem-size=8G"
-                    ], check=True)     
-                
-                    qualimap_results = parse_all_qualimap_graphs(out_dir)
-                    plots = create_all_plots(qualimap_results)
-                    
-                # idxstats
-                with st.spinner("📈 Running samtools idxstats..."):
-                    idxstats_result = subprocess.run(
-                        ["samtools", "idxstats", file_path],
-                        capture_output=True, text=True, check=True
-                    )
-                    idxstat_text = idxstats_result.stdout
-                
-                # Samtools stats
-                with st.spinner("🧬 Running samtools stats (this may take a few minutes)..."):
-                    try:
-                        stats_file = os.path.join(tmpdir, "samtools_stats.txt")
-                        
-                        # Run samtools stats
-                        result = subprocess.run([
-                            "samtools", "stats",
-                            file_path
-                        ], capture_output=True, text=True)
-                        
-                        # Save stats to file
-                        with open(stats_file, 'w') as f:
-                            f.write(result.stdout)
-                            
-                        # Parse stats
-                        stats = parse_samtools_stats(stats_file)
-                        stats_plots = create_samtools_plots(stats)
-                        
-                    except Exception as e:
-                        st.error(f"❌ samtools stats failed with error: {str(e)}")
-                        stats = {}
-                        stats_plots = {}
-                        
+                qualimap_results = results['qualimap_results']
+                plots = create_all_plots(qualimap_results, x_ranges=zoom_ranges())
+                idxstat_text = results['idxstats_text']
+                stats = results['stats']
+                stats_plots = create_samtools_plots(stats)
+
                 # Display results in multiple tabs
-                st.success("🎉 BAM Analysis Complete!")
+                st.success(f"🎉 {kind.upper()} Analysis Complete!")
+                render_skipped_rows(results.get('qualimap_skipped_rows', {}))
                 tab1, tab2, tab3, tab4 = st.tabs([
                     "📊 Statistics", 
                     "🧬 Chromosomes", 
@@ -1019,15 +1359,8 @@ if uploaded_file:
                     </div>
                     """, unsafe_allow_html=True)
                     
-                    # Parse flagstat metrics
-                    metrics_data = []
-                    for line in flagstat_text.splitlines():
-                        if line.strip():
-                            parts = line.split('+')
-                            if len(parts) == 2:
-                                count = int(parts[0].strip())
-                                desc = parts[1].split('(')[0].strip()
-                                metrics_data.append({"metric": desc, "count": count})
+                    metrics_data = [{"metric": metric, "count": count}
+                                    for metric, count in parse_flagstat(flagstat_text)]
 
                     # Create metric cards
                     if metrics_data:
@@ -1058,7 +1391,7 @@ if uploaded_file:
                         st.download_button(
                             label="📊 Download Stats (CSV)",
                             data=csv,
-                            file_name="bam_stats_summary.csv",
+                            file_name=f"{kind}_stats_summary.csv",
                             mime="text/csv"
                         )
                 
@@ -1070,24 +1403,10 @@ if uploaded_file:
                     </h2>
                     """, unsafe_allow_html=True)
                     
-                    chr_data = []
-                    for line in idxstat_text.splitlines():
-                        if line.strip():
-                            parts = line.split('\t')
-                            if len(parts) >= 4:
-                                chr_data.append({
-                                    "Chromosome": parts[0],
-                                    "Length": int(parts[1]),
-                                    "Mapped": int(parts[2]),
-                                    "Unmapped": int(parts[3])
-                                })
+                    df = parse_idxstats(idxstat_text)
+                    chr_data = not df.empty
 
                     if chr_data:
-                        df = pd.DataFrame(chr_data)
-                        df['Total_Reads'] = df['Mapped'] + df['Unmapped']
-                        df['Coverage_Depth'] = df['Mapped'] / df['Length']
-                        df['Mapping_Rate'] = (df['Mapped'] / df['Total_Reads']) * 100
-
                         # Top chromosomes analysis
                         top_df = df.nlargest(10, 'Mapped')
 
@@ -1155,30 +1474,24 @@ if uploaded_file:
                     # Display all available plots
                     for plot_name, fig in plots.items():
                         st.plotly_chart(apply_plot_style(fig), use_container_width=True)
+                        if plot_name in ZOOMABLE_PLOTS:
+                            render_zoom_control(plot_name, qualimap_results[plot_name], fig)
                         
                         # Download buttons for each plot
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.download_button(
-                                label=f"📥 {plot_name} (HTML)",
-                                data=fig.to_html(),
-                                file_name=f"{plot_name}.html",
-                                mime="text/html"
-                            )
-                        with col2:
-                            st.download_button(
-                                label=f"📥 {plot_name} (PNG)",
-                                data=fig.to_image(format="png"),
-                                file_name=f"{plot_name}.png",
-                                mime="image/png"
-                            )
-                        with col3:
-                            st.download_button(
-                                label=f"📥 {plot_name} (PDF)",
-                                data=fig.to_image(format="pdf"),
-                                file_name=f"{plot_name}.pdf",
-                                mime="application/pdf"
-                            )
+                        render_plot_downloads(fig, plot_name, kind)
+
+                    if stats_plots:
+                        st.markdown("""
+                        <div style="background-color: rgba(0, 0, 0, 0.6); padding: 15px; border-radius: 10px; margin-top: 20px;">
+                            <h3 style="color: white;">📈 Samtools Stats Visualizations</h3>
+                        </div>
+                        """, unsafe_allow_html=True)
+                        if results.get('stats_shards'):
+                            st.info(f"🧩 Merged from {results['stats_shards']} contig shards: "
+                                    f"{SHARDED_STATS_CAVEAT}.")
+                        for plot_name, fig in stats_plots.items():
+                            st.plotly_chart(fig, use_container_width=True)
+                            render_plot_downloads(fig, plot_name, f"{kind}_stats")
 
                 # --- Tab 4: Summary Report ---
                 with tab4:
@@ -1236,9 +1549,9 @@ if uploaded_file:
                                 box-shadow: 0 4px 15px rgba(0, 0, 0, 0.2);'>
                         <h4 style='margin: 0; color: white;'>📅 Analysis Information</h4>
                         <p style='margin: 0.5rem 0 0 0; color: rgba(255, 255, 255, 0.9);'>
-                            <strong>File:</strong> {uploaded_file.name}<br>
+                            <strong>File:</strong> {input_name}<br>
                             <strong>Analysis Time:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}<br>
-                            <strong>Tools Used:</strong> Samtools, QualiMap, Plotly
+                            <strong>Tools Used:</strong> Samtools, {"" if is_cram or coverage_engine == 'native' else "QualiMap, "}Plotly
                         </p>
                     </div>
                     """, unsafe_allow_html=True)
@@ -1246,75 +1559,23 @@ if uploaded_file:
                     st.markdown("---")
                     st.markdown("### 📦 Download All Results")
                     
-                    # Prepare files for zip
-                    files_to_zip = []
-                    
-                    # Add flagstat
-                    flagstat_path = os.path.join(tmpdir, "flagstat.txt")
-                    with open(flagstat_path, "w") as f:
-                        f.write(flagstat_text)
-                    files_to_zip.append({"path": flagstat_path, "arcname": "flagstat.txt"})
-                    
-                    # Add idxstats
-                    if chr_data:
-                        idxstats_path = os.path.join(tmpdir, "chromosome_stats.csv")
-                        df.to_csv(idxstats_path, index=False)
-                        files_to_zip.append({"path": idxstats_path, "arcname": "chromosome_stats.csv"})
-                    
-                    # Add stats
-                    for stat_name, df in stats.items():
-                        stat_path = os.path.join(tmpdir, f"{stat_name}.csv")
-                        df.to_csv(stat_path, index=False)
-                        files_to_zip.append({"path": stat_path, "arcname": f"stats/{stat_name}.csv"})
-                    
-                    # Add qualimap plots in multiple formats
-                    for plot_name, fig in plots.items():
-                        # HTML
-                        html_path = os.path.join(tmpdir, f"{plot_name}.html")
-                        fig.write_html(html_path)
-                        files_to_zip.append({"path": html_path, "arcname": f"plots/html/{plot_name}.html"})
-                        
-                        # PNG
-                        png_path = os.path.join(tmpdir, f"{plot_name}.png")
-                        fig.write_image(png_path)
-                        files_to_zip.append({"path": png_path, "arcname": f"plots/png/{plot_name}.png"})
-                        
-                        # PDF
-                        pdf_path = os.path.join(tmpdir, f"{plot_name}.pdf")
-                        fig.write_image(pdf_path, format="pdf")
-                        files_to_zip.append({"path": pdf_path, "arcname": f"plots/pdf/{plot_name}.pdf"})
-                    
-                    # Add samtools stats plots
-                    for plot_name, fig in stats_plots.items():
-                        # HTML
-                        html_path = os.path.join(tmpdir, f"samtools_{plot_name}.html")
-                        fig.write_html(html_path)
-                        files_to_zip.append({"path": html_path, "arcname": f"plots/samtools/html/{plot_name}.html"})
-                        
-                        # PNG
-                        png_path = os.path.join(tmpdir, f"samtools_{plot_name}.png")
-                        fig.write_image(png_path)
-                        files_to_zip.append({"path": png_path, "arcname": f"plots/samtools/png/{plot_name}.png"})
-                        
-                        # PDF
-                        pdf_path = os.path.join(tmpdir, f"samtools_{plot_name}.pdf")
-                        fig.write_image(pdf_path, format="pdf")
-                        files_to_zip.append({"path": pdf_path, "arcname": f"plots/samtools/pdf/{plot_name}.pdf"})
-                    
-                    # Create zip file
-                    zip_path = os.path.join(tmpdir, "bam_analysis_results.zip")
-                    with zipfile.ZipFile(zip_path, 'w') as zipf:
-                        for file_info in files_to_zip:
-                            zipf.write(file_info['path'], file_info['arcname'])
-                    
-                    # Download button for zip
-                    with open(zip_path, "rb") as f:
-                        st.download_button(
-                            label="📦 Download All Results (ZIP)",
-                            data=f,
-                            file_name=f"bam_analysis_{datetime.now().strftime('%Y%m%d')}.zip",
-                            mime="application/zip"
-                        )
+                    # Images are rendered only when the archive is requested
+                    render_cache = get_render_cache()
+                    if st.button("📦 Prepare All Results (ZIP)", key=f"{kind}_zip_prepare"):
+                        zip_name = f"{kind}_analysis_{datetime.now().strftime('%Y%m%d')}.zip"
+                        with st.spinner("📦 Rendering images and packing results..."):
+                            entries = analysis_zip_entries(
+                                flagstat_text, stats, plots, render_cache,
+                                chromosome_stats=df if chr_data else None,
+                                samtools_plots=stats_plots
+                            )
+                            # With static serving the archive is written where the web server serves it
+                            zip_path = write_results_zip(
+                                export_path(zip_name) if st.get_option("server.enableStaticServing")
+                                else os.path.join(tmpdir, zip_name),
+                                entries
+                            )
+                        render_zip_download(zip_path, zip_name)
 
             except subprocess.CalledProcessError as e:
                 st.error(f"❌ Command execution failed: {e}")
@@ -1374,4 +1635,11 @@ else:
         </div>
         """, unsafe_allow_html=True)
 
+    if st.toggle("📚 Query past analyses", help="Search the results store across every analyzed sample"):
+        render_past_analyses(get_result_store())
 
+# Result cache counters and server load in the sidebar
+with cache_stats_placeholder.container():
+    render_cache_stats(get_result_cache())
+with server_load_placeholder.container():
+    render_server_load(GOVERNOR, get_job_queue(create=False))
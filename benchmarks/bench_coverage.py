@@ -0,0 +1,103 @@
+"""Benchmark the native coverage engine against QualiMap bamqc.
+
+Usage: python benchmarks/bench_coverage.py [--bam file.bam] [--pairs N] [--threads N]
+
+Builds a synthetic BAM (or uses --bam), then computes the coverage tables
+with QualiMap bamqc (when it is installed) and with each native depth
+reader, reporting wall time, peak memory and the mean coverage each one
+finds. Every engine runs in a fresh process; peak memory is the largest
+resident size of that process and its children, so QualiMap's JVM counts.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from coverage_engine import DEPTH_READERS, native_coverage, pysam  # noqa: E402
+from parsers import load_qualimap_raw_data  # noqa: E402
+from synthetic import write_synthetic_bam  # noqa: E402
+from tools import qualimap_bamqc, samtools_index  # noqa: E402
+
+
+def peak_rss_mb():
+    """Largest resident size so far of this process and of its waited-for children"""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def mean_coverage(frames):
+    """Genome-wide mean depth from a coverage histogram table"""
+    histogram = frames['coverage_histogram']
+    return (histogram['Coverage'] * histogram['Frequency']).sum() / histogram['Frequency'].sum()
+
+
+def run_qualimap(bam_path, workdir, threads):
+    """Coverage tables from QualiMap bamqc"""
+    out_dir = os.path.join(workdir, "qualimap_out")
+    qualimap_bamqc(bam_path, out_dir, threads=threads)
+    return load_qualimap_raw_data(out_dir)[0]
+
+
+def available_engines():
+    """Names of the engines that can run here"""
+    readers = [reader for reader in DEPTH_READERS if reader != 'pysam' or pysam is not None]
+    return ['qualimap'] + readers
+
+
+def measure_engine(engine, bam_path, threads):
+    """Run one engine in this process and print its timings as JSON"""
+    with tempfile.TemporaryDirectory() as workdir:
+        started = time.perf_counter()
+        if engine == 'qualimap':
+            frames = run_qualimap(bam_path, workdir, threads)
+        else:
+            frames = native_coverage(bam_path, workdir, threads=threads, reader=engine)
+        seconds = time.perf_counter() - started
+    print(json.dumps({'seconds': seconds, 'peak_mb': peak_rss_mb(), 'mean': mean_coverage(frames)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bam", help="Existing indexed BAM to benchmark instead of a synthetic one")
+    parser.add_argument("--pairs", type=int, default=1_000_000, help="Read pairs in the synthetic BAM")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--engine", choices=available_engines(), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.engine:
+        measure_engine(args.engine, args.bam, args.threads)
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bam_path = args.bam
+        if not bam_path:
+            bam_path = os.path.join(tmpdir, "synthetic.bam")
+            print(f"Writing synthetic BAM with {args.pairs:,} pairs...")
+            write_synthetic_bam(bam_path, args.pairs)
+            samtools_index(bam_path)
+
+        print(f"\n{'Engine':<20}{'Seconds':>10}{'Peak MB':>10}{'Mean depth':>12}")
+        for engine in available_engines():
+            name = engine if engine == 'qualimap' else f"native ({engine})"
+            run = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--engine", engine,
+                 "--bam", bam_path, "--threads", str(args.threads)],
+                capture_output=True, text=True
+            )
+            if run.returncode:
+                error = run.stderr.strip().splitlines()[-1] if run.stderr.strip() else "failed"
+                print(f"{name:<20}{'skipped':>10}  ({error})")
+                continue
+            result = json.loads(run.stdout.strip().splitlines()[-1])
+            print(f"{name:<20}{result['seconds']:>10.2f}{result['peak_mb']:>10.0f}{result['mean']:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
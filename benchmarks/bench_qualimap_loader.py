@@ -0,0 +1,166 @@
+"""Micro-benchmark: bulk QualiMap raw data loader vs the per-line one.
+
+Usage: python benchmarks/bench_qualimap_loader.py [--report-dir DIR] [--windows N] [--repeats N]
+
+Without --report-dir a raw_data_qualimapReport directory is generated with
+a genome-wide coverage_across_reference table of ``--windows`` rows (as
+written by ``qualimap bamqc -nw``) next to the usual histograms. The
+baseline is the original per-line parser, kept here for comparison.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parsers import QUALIMAP_RAW_DATA_DIR, load_qualimap_raw_data, load_qualimap_table  # noqa: E402
+
+
+def parse_all_qualimap_graphs_linewise(report_dir):
+    """Original per-line parser (baseline), minus its Streamlit messages"""
+    results = {}
+    raw_data_dir = os.path.join(report_dir, "raw_data_qualimapReport")
+
+    if not os.path.exists(raw_data_dir):
+        return results
+
+    file_parsers = {
+        'coverage_across_reference': lambda parts: {'Position': float(parts[0]), 'Coverage': float(parts[1])},
+        'coverage_histogram': lambda parts: {'Coverage': float(parts[0]), 'Frequency': float(parts[1])},
+        'duplication_rate_histogram': lambda parts: {'Duplication Rate': float(parts[0]), 'Count': float(parts[1])},
+        'genome_fraction_coverage': lambda parts: {'Coverage': float(parts[0]), 'Genome Fraction': float(parts[1])},
+        'homopolymer_indels': lambda parts: {'Type of indel': parts[0], 'Number of indels': int(parts[1])},
+        'insert_size_across_reference': lambda parts: {'Position': float(parts[0]), 'Insert Size': float(parts[1])},
+        'insert_size_histogram': lambda parts: {'Insert Size': float(parts[0]), 'Count': float(parts[1])},
+        'mapped_reads_gc-content_distribution': lambda parts: {'GC Content (%)': float(parts[0]), 'Sample': float(parts[1])},
+        'mapped_reads_nucleotide_content': lambda parts: {
+            'Position (bp)': float(parts[0]),
+            'A': float(parts[1]), 'C': float(parts[2]),
+            'G': float(parts[3]), 'T': float(parts[4]),
+            'N': float(parts[5])},
+        'mapping_quality_across_reference': lambda parts: {'Position': float(parts[0]), 'Mapping Quality': float(parts[1])},
+        'mapping_quality_histogram': lambda parts: {'Mapping Quality': float(parts[0]), 'Count': float(parts[1])}
+    }
+
+    for name, parser in file_parsers.items():
+        file_path = os.path.join(raw_data_dir, f"{name}.txt")
+        if os.path.exists(file_path):
+            data = []
+            with open(file_path, 'r') as f:
+                for line in f:
+                    if not line.startswith('#'):
+                        parts = line.strip().split()
+                        if len(parts) >= 2:
+                            try:
+                                data.append(parser(parts))
+                            except ValueError:
+                                continue
+            results[name] = pd.DataFrame(data)
+
+    return results
+
+
+def write_table(path, header, rows):
+    """Write a tab-separated raw data table with a '#' header line"""
+    with open(path, "w") as f:
+        f.write("#" + "\t".join(header) + "\n")
+        f.write("\n".join("\t".join(map(str, row)) for row in rows) + "\n")
+
+
+def write_report(report_dir, windows=1_000_000, seed=11):
+    """Generate a raw_data_qualimapReport directory for a whole-genome run"""
+    rng = random.Random(seed)
+    raw_data_dir = os.path.join(report_dir, QUALIMAP_RAW_DATA_DIR)
+    os.makedirs(raw_data_dir, exist_ok=True)
+    step = 3_100_000_000 // windows
+
+    def table(name, header, rows):
+        write_table(os.path.join(raw_data_dir, f"{name}.txt"), header, rows)
+
+    table("coverage_across_reference", ["Position (bp)", "Coverage", "Std"], (
+        (f"{i * step:.1f}", f"{rng.uniform(0, 60):.4f}", f"{rng.uniform(0, 20):.4f}")
+        for i in range(windows)
+    ))
+    table("mapping_quality_across_reference", ["Position (bp)", "Mapping quality"], (
+        (f"{i * step:.1f}", f"{rng.uniform(0, 60):.4f}") for i in range(windows)
+    ))
+    table("insert_size_across_reference", ["Position (bp)", "Insert size (bp)"], (
+        (f"{i * step:.1f}", f"{rng.uniform(200, 500):.4f}") for i in range(windows)
+    ))
+    table("coverage_histogram", ["Coverage", "Number of genomic locations"], (
+        (f"{depth:.1f}", f"{rng.randrange(10 ** 7):.1f}") for depth in range(5001)
+    ))
+    table("genome_fraction_coverage", ["Coverage (X)", "Coverage (%)"], (
+        (f"{depth:.1f}", f"{100 - depth / 51:.4f}") for depth in range(5001)
+    ))
+    table("insert_size_histogram", ["Insert size (bp)", "Insert size"], (
+        (f"{size:.1f}", f"{rng.randrange(10 ** 6):.1f}") for size in range(10001)
+    ))
+    table("mapped_reads_nucleotide_content", ["Position (bp)", "A", "C", "G", "T", "N"], (
+        (f"{cycle:.1f}", *(f"{rng.uniform(15, 35):.4f}" for _ in range(4)), "0.0")
+        for cycle in range(150)
+    ))
+    table("homopolymer_indels", ["Type of indel", "Number of indels"], (
+        (label, rng.randrange(10 ** 5)) for label in ("A", "C", "G", "T", "N", "Non-poly A")
+    ))
+    return report_dir
+
+
+def best_time(func, repeats):
+    """Best wall time of ``repeats`` calls"""
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--report-dir", help="QualiMap bamqc output directory to load instead of synthetic data")
+    parser.add_argument("--windows", type=int, default=1_000_000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        report_dir = args.report_dir or write_report(tmpdir, args.windows)
+        coverage_path = os.path.join(report_dir, QUALIMAP_RAW_DATA_DIR, "coverage_across_reference.txt")
+        print(f"coverage_across_reference: {os.path.getsize(coverage_path) / 1024 ** 2:,.1f} MB\n")
+
+        baseline = best_time(lambda: parse_all_qualimap_graphs_linewise(report_dir), args.repeats)
+        single = best_time(lambda: load_qualimap_table(coverage_path), args.repeats)
+        sequential = best_time(lambda: load_qualimap_raw_data(report_dir, max_workers=1), args.repeats)
+        concurrent = best_time(lambda: load_qualimap_raw_data(report_dir), args.repeats)
+
+        old = parse_all_qualimap_graphs_linewise(report_dir)
+        new, skipped, errors = load_qualimap_raw_data(report_dir)
+        assert not errors, errors
+
+        # Columns both loaders read must agree exactly. The old loader split
+        # on any whitespace, so it dropped labels like "Non-poly A".
+        for name, frame in old.items():
+            if name == 'homopolymer_indels':
+                continue
+            pd.testing.assert_frame_equal(
+                frame, new[name][list(frame.columns)], check_dtype=False
+            )
+
+        print(f"{'loader':<26}{'seconds':>10}")
+        print(f"{'per-line (all files)':<26}{baseline:>10.3f}")
+        print(f"{'bulk, coverage file only':<26}{single:>10.3f}")
+        print(f"{'bulk, 1 worker':<26}{sequential:>10.3f}")
+        print(f"{'bulk, concurrent':<26}{concurrent:>10.3f}")
+        print(f"\nColumns: {sum(f.shape[1] for f in old.values())} -> "
+              f"{sum(f.shape[1] for f in new.values())}, "
+              f"skipped rows: {sum(skipped.values())}")
+        print(f"Speedup: {baseline / concurrent:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Benchmark samtools throughput at different thread counts.
+
+Usage: python benchmarks/bench_samtools_threads.py [--pairs N] [--threads 1 4 8 16]
+
+Builds a synthetic BAM (or uses --bam) and times flagstat, index and stats
+with the same ``-@`` arguments the app passes, reporting MB/s of BAM read.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import write_synthetic_bam  # noqa: E402
+from tools import samtools_flagstat, samtools_index, samtools_stats  # noqa: E402
+
+
+def time_call(func, repeats):
+    """Best wall time of ``repeats`` calls"""
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bam", help="Existing BAM to benchmark instead of a synthetic one")
+    parser.add_argument("--pairs", type=int, default=1_000_000, help="Read pairs in the synthetic BAM")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bam_path = args.bam
+        if not bam_path:
+            print(f"Building synthetic BAM with {args.pairs:,} read pairs...")
+            bam_path = write_synthetic_bam(os.path.join(tmpdir, "synthetic.bam"), args.pairs)
+        size_mb = os.path.getsize(bam_path) / 1024 ** 2
+        stats_file = os.path.join(tmpdir, "stats.txt")
+        print(f"BAM size: {size_mb:,.1f} MB\n")
+
+        tools = {
+            'flagstat': lambda threads: samtools_flagstat(bam_path, threads),
+            'index': lambda threads: samtools_index(bam_path, threads),
+            'stats': lambda threads: samtools_stats(bam_path, stats_file, threads=threads),
+        }
+
+        print(f"{'tool':<10}{'threads':>8}{'seconds':>10}{'MB/s':>10}{'speedup':>9}")
+        for name, run in tools.items():
+            baseline = None
+            for threads in args.threads:
+                seconds = time_call(lambda: run(threads), args.repeats)
+                baseline = baseline or seconds
+                print(f"{name:<10}{threads:>8}{seconds:>10.2f}{size_mb / seconds:>10.1f}"
+                      f"{baseline / seconds:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
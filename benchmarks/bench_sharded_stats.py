@@ -0,0 +1,98 @@
+"""Benchmark sharded samtools stats against a single whole-file run.
+
+Usage: python benchmarks/bench_sharded_stats.py [--bam file.bam] [--pairs N] [--contigs N] [--shards 1,2,4,8]
+
+Builds a synthetic BAM with equal contigs (or uses an indexed --bam), runs
+samtools stats over the whole file, then as contig shards merged back
+together, reporting wall time, speedup and whether the merged report
+matches the whole-file one: exactly for the counts, to print precision
+for the per-cycle base content.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis import add_stats_shards, collect_flagstat, collect_stats_shards  # noqa: E402
+from parsers import parse_samtools_stats_text  # noqa: E402
+from scheduler import Scheduler  # noqa: E402
+from sharding import BASE_CONTENT_WEIGHTS  # noqa: E402
+from synthetic import write_synthetic_bam  # noqa: E402
+from tools import samtools_index, samtools_stats  # noqa: E402
+
+
+def sharded_stats(bam_path, workdir, shards):
+    """Parsed samtools stats of the file run as ``shards`` contig shards"""
+    scheduler = Scheduler(max_cpus=shards)
+    add_stats_shards(scheduler, bam_path, workdir, shards, indexed=True)
+    steps = scheduler.run()
+    results = {'errors': [], 'flagstat_text': collect_flagstat(steps)}
+    collect_stats_shards(results, steps)
+    if results['errors']:
+        raise RuntimeError(results['errors'][0])
+    return results['stats']
+
+
+def differences(whole, merged):
+    """Sections whose merged values differ from the whole-file run, with the largest difference"""
+    found = {}
+    for tag, frame in whole.items():
+        if tag == 'GCD':
+            continue
+        other = merged.get(tag)
+        if other is None or other.shape != frame.shape or list(other.columns) != list(frame.columns):
+            found[tag] = "shape"
+            continue
+        numeric = frame.select_dtypes('number').columns
+        largest = float(np.abs(other[numeric].to_numpy(dtype=np.float64) -
+                               frame[numeric].to_numpy(dtype=np.float64)).max()) if len(numeric) else 0.0
+        text_equal = frame.drop(columns=numeric).equals(other.drop(columns=numeric))
+        tolerance = 0.01 + 1e-9 if tag in BASE_CONTENT_WEIGHTS else 0
+        if largest > tolerance or not text_equal:
+            found[tag] = largest
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bam", help="Existing indexed BAM to benchmark instead of a synthetic one")
+    parser.add_argument("--pairs", type=int, default=1_000_000, help="Read pairs in the synthetic BAM")
+    parser.add_argument("--contigs", type=int, default=8, help="Equal contigs of the synthetic BAM")
+    parser.add_argument("--shards", default="1,2,4,8", help="Comma-separated shard counts to run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bam_path = args.bam
+        if not bam_path:
+            bam_path = os.path.join(tmpdir, "synthetic.bam")
+            contigs = tuple((f"chr{i + 1}", 2_000_000) for i in range(args.contigs))
+            print(f"Writing synthetic BAM with {args.pairs:,} pairs over {args.contigs} contigs...")
+            write_synthetic_bam(bam_path, args.pairs, contigs=contigs)
+            samtools_index(bam_path)
+
+        started = time.perf_counter()
+        whole = parse_samtools_stats_text(samtools_stats(bam_path, os.path.join(tmpdir, "whole.txt")))
+        baseline = time.perf_counter() - started
+
+        print(f"\n{'Run':<16}{'Seconds':>10}{'Speedup':>10}  Merge")
+        print(f"{'whole file':<16}{baseline:>10.2f}{1:>10.2f}")
+        for shards in (int(value) for value in args.shards.split(",")):
+            workdir = os.path.join(tmpdir, f"shards_{shards}")
+            os.makedirs(workdir)
+            started = time.perf_counter()
+            merged = sharded_stats(bam_path, workdir, shards)
+            seconds = time.perf_counter() - started
+            found = differences(whole, merged)
+            verdict = "identical" if not found else "differs: " + ", ".join(
+                f"{tag} ({value if isinstance(value, str) else f'{value:g}'})" for tag, value in found.items()
+            )
+            print(f"{f'{shards} shards':<16}{seconds:>10.2f}{baseline / seconds:>10.2f}  {verdict}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Benchmark the single-pass flagstat + stats scan against separate tool runs.
+
+Usage: python benchmarks/bench_single_pass.py [--bam file.bam] [--pairs N] [--repeats N]
+
+Builds a synthetic BAM (or uses --bam), then runs samtools flagstat and
+samtools stats one after the other, each reading the file, and the
+single-pass scan that tees one read of the file into both. Reports wall
+time, the file bytes read by each way and whether the outputs match.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import write_synthetic_bam  # noqa: E402
+from tools import samtools_flagstat, samtools_scan, samtools_stats  # noqa: E402
+
+
+def report_lines(stats_text):
+    """samtools stats lines without the comments, which name the input"""
+    return [line for line in stats_text.splitlines() if not line.startswith('#')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bam", help="Existing BAM to benchmark instead of a synthetic one")
+    parser.add_argument("--pairs", type=int, default=1_000_000, help="Read pairs in the synthetic BAM")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bam_path = args.bam
+        if not bam_path:
+            print(f"Building synthetic BAM with {args.pairs:,} read pairs...")
+            bam_path = write_synthetic_bam(os.path.join(tmpdir, "synthetic.bam"), args.pairs)
+        size = os.path.getsize(bam_path)
+        stats_file = os.path.join(tmpdir, "stats.txt")
+        flagstat_file = os.path.join(tmpdir, "flagstat.txt")
+        print(f"BAM size: {size / 1024 ** 2:,.1f} MB\n")
+
+        separate = scan = float("inf")
+        for _ in range(args.repeats):
+            started = time.perf_counter()
+            flagstat_text = samtools_flagstat(bam_path)
+            stats_text = samtools_stats(bam_path, stats_file)
+            separate = min(separate, time.perf_counter() - started)
+
+            fed = []
+            started = time.perf_counter()
+            scan_stats, scan_flagstat = samtools_scan(bam_path, stats_file, flagstat_file, on_bytes=fed.append)
+            scan = min(scan, time.perf_counter() - started)
+
+        match = scan_flagstat == flagstat_text and report_lines(scan_stats) == report_lines(stats_text)
+        print(f"{'Run':<22}{'Seconds':>10}{'MB read':>10}")
+        print(f"{'flagstat, then stats':<22}{separate:>10.2f}{2 * size / 1024 ** 2:>10.1f}")
+        print(f"{'single pass':<22}{scan:>10.2f}{sum(fed) / 1024 ** 2:>10.1f}")
+        print(f"\nOutputs {'identical' if match else 'DIFFER'}; {separate / scan:.2f}x faster")
+
+
+if __name__ == "__main__":
+    main()
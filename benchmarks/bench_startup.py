@@ -0,0 +1,69 @@
+"""Startup benchmark: time until the landing page has been rendered.
+
+Usage: python benchmarks/bench_startup.py [--app app.py] [--repeats N]
+
+Each measurement runs the Streamlit script headless with
+``streamlit.testing.v1.AppTest`` in a fresh Python process:
+
+- cold session: first script run in a new server process (imports included)
+- new session:  another session in the same, already warm process
+- rerun:        the same session running the script again
+
+Pass ``--app`` with an older copy of app.py (e.g. from ``git show``) to
+compare; run it from the repository root so its imports resolve.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MEASURE = r"""
+import json, sys, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+
+def timed_run(app_test):
+    t = time.perf_counter()
+    app_test.run()
+    if app_test.exception:
+        raise SystemExit(f"app raised: {app_test.exception[0].message}")
+    return time.perf_counter() - t
+
+first = AppTest.from_file(sys.argv[1], default_timeout=120)
+cold = timed_run(first)
+rerun = timed_run(first)
+session = timed_run(AppTest.from_file(sys.argv[1], default_timeout=120))
+print(json.dumps({"streamlit_import": imported - started, "cold": cold,
+                  "session": session, "rerun": rerun}))
+"""
+
+
+def measure(app_path, cwd):
+    """Timings of one fresh process, in seconds"""
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE, app_path], cwd=cwd,
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--app", default=os.path.join(root, "app.py"))
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [measure(os.path.abspath(args.app), root) for _ in range(args.repeats)]
+    print(f"App: {args.app} ({args.repeats} fresh processes, median seconds)\n")
+    print(f"{'streamlit import':<20}{statistics.median(r['streamlit_import'] for r in runs):>10.3f}")
+    print(f"{'cold session':<20}{statistics.median(r['cold'] for r in runs):>10.3f}")
+    print(f"{'new session':<20}{statistics.median(r['session'] for r in runs):>10.3f}")
+    print(f"{'rerun':<20}{statistics.median(r['rerun'] for r in runs):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""Micro-benchmark: vectorized samtools stats parser vs the line-by-line one.
+
+Usage: python benchmarks/bench_stats_parser.py [--stats samtools_stats.txt] [--repeats N]
+
+Without --stats a report shaped like one from a 30x whole-genome BAM is
+generated (150-cycle quality matrices, 8000 insert sizes, 1000 coverage
+bins, GC-depth table). The baseline is the original line-by-line parser,
+kept here verbatim for comparison.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parsers import parse_samtools_stats  # noqa: E402
+
+
+def parse_samtools_stats_linewise(stats_file):
+    """Original line-by-line parser (baseline)"""
+    stats = {}
+    current_section = None
+    data_lines = []
+    headers = []
+    
+    def safe_int_convert(value):
+        """Safely convert value to integer, handling special cases"""
+        try:
+            return int(value)
+        except ValueError:
+            # Handle ranges like "[1-1]" by taking the first number
+            if value.startswith('[') and '-' in value and value.endswith(']'):
+                return int(value.split('-')[0].strip('['))
+            return 0  # Default value if conversion fails
+    
+    def safe_float_convert(value):
+        """Safely convert value to float"""
+        try:
+            return float(value)
+        except ValueError:
+            return 0.0  # Default value if conversion fails
+    
+    with open(stats_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#'):
+                continue
+            if line.startswith('SN'):
+                # Summary numbers section
+                line = line.split('#')[0].strip()
+                parts = line.split('\t')
+                if len(parts) >= 3:
+                    if 'SN' not in stats:
+                        stats['SN'] = []
+                    stats['SN'].append({
+                        'Metric': parts[1].strip(':'),
+                        'Value': parts[2].strip()
+                    })
+            elif line.startswith('FFQ'):
+                # First fragment qualities
+                parts = line.split('\t')
+                if len(parts) >= 3:
+                    if 'FFQ' not in stats:
+                        stats['FFQ'] = []
+                    stats['FFQ'].append({
+                        'Cycle': safe_int_convert(parts[1]),
+                        'Quality': safe_float_convert(parts[2])
+                    })
+            elif line.startswith('LFQ'):
+                # Last fragment qualities
+                parts = line.split('\t')
+                if len(parts) >= 3:
+                    if 'LFQ' not in stats:
+                        stats['LFQ'] = []
+                    stats['LFQ'].append({
+                        'Cycle': safe_int_convert(parts[1]),
+                        'Quality': safe_float_convert(parts[2])
+                    })
+            elif line.startswith('GCF'):
+                # GC content of first fragments
+                parts = line.split('\t')
+                if len(parts) >= 3:
+                    if 'GCF' not in stats:
+                        stats['GCF'] = []
+                    stats['GCF'].append({
+                        'GC%': safe_float_convert(parts[1]),
+                        'Count': safe_int_convert(parts[2])
+                    })
+            elif line.startswith('GCL'):
+                # GC content of last fragments
+                parts = line.split('\t')
+                if len(parts) >= 3:
+                    if 'GCL' not in stats:
+                        stats['GCL'] = []
+                    stats['GCL'].append({
+                        'GC%': safe_float_convert(parts[1]),
+                        'Count': safe_int_convert(parts[2])
+                    })
+            elif line.startswith('IS'):
+                # Insert sizes
+                parts = line.split('\t')
+                if len(parts) >= 3:
+                    if 'IS' not in stats:
+                        stats['IS'] = []
+                    stats['IS'].append({
+                        'Insert Size': safe_int_convert(parts[1]),
+                        'Count': safe_int_convert(parts[2])
+                    })
+            elif line.startswith('RL'):
+                # Read lengths
+                parts = line.split('\t')
+                if len(parts) >= 3:
+                    if 'RL' not in stats:
+                        stats['RL'] = []
+                    stats['RL'].append({
+                        'Length': safe_int_convert(parts[1]),
+                        'Count': safe_int_convert(parts[2])
+                    })
+            elif line.startswith('COV'):
+                # Coverage distribution
+                parts = line.split('\t')
+                if len(parts) >= 3:
+                    if 'COV' not in stats:
+                        stats['COV'] = []
+                    stats['COV'].append({
+                        'Coverage': safe_int_convert(parts[1]),
+                        'Count': safe_int_convert(parts[2])
+                    })
+    
+    # Convert lists to DataFrames
+    for key in stats:
+        stats[key] = pd.DataFrame(stats[key])
+    
+    return stats
+
+
+def write_wgs_like_stats(path, cycles=150, max_quality=41, seed=7):
+    """Write a samtools stats report with the section sizes of a WGS run"""
+    rng = random.Random(seed)
+    lines = ["# This file was produced by samtools stats (synthetic benchmark data)"]
+    lines.append("CHK\t1a2b3c4d\t5e6f7a8b\t9c0d1e2f")
+    summary = [
+        ("raw total sequences", 800_000_000), ("filtered sequences", 0),
+        ("reads mapped", 795_000_000), ("reads mapped and paired", 790_000_000),
+        ("reads properly paired", 780_000_000), ("average length", 150),
+        ("average quality", 35.2), ("insert size average", 412.5),
+        ("insert size standard deviation", 98.1),
+    ]
+    for metric, value in summary:
+        lines.append(f"SN\t{metric}:\t{value}\t# synthetic")
+    for tag in ("FFQ", "LFQ"):
+        for cycle in range(1, cycles + 1):
+            counts = "\t".join(str(rng.randrange(10 ** 7)) for _ in range(max_quality + 1))
+            lines.append(f"{tag}\t{cycle}\t{counts}")
+    for tag in ("GCF", "GCL"):
+        for step in range(200):
+            lines.append(f"{tag}\t{step * 0.5:.2f}\t{rng.randrange(10 ** 8)}")
+    for tag, ncols in (("GCC", 6), ("GCT", 4), ("FBC", 6), ("LBC", 6)):
+        for cycle in range(1, cycles + 1):
+            values = "\t".join(f"{rng.uniform(0, 50):.2f}" for _ in range(ncols))
+            lines.append(f"{tag}\t{cycle}\t{values}")
+    for size in range(8001):
+        counts = [rng.randrange(10 ** 6) for _ in range(4)]
+        lines.append(f"IS\t{size}\t{sum(counts)}\t" + "\t".join(map(str, counts[:3])))
+    lines.append(f"RL\t150\t{800_000_000}")
+    for quality in range(61):
+        lines.append(f"MAPQ\t{quality}\t{rng.randrange(10 ** 8)}")
+    for length in range(1, 60):
+        lines.append(f"ID\t{length}\t{rng.randrange(10 ** 6)}\t{rng.randrange(10 ** 6)}")
+    for cycle in range(1, cycles + 1):
+        lines.append(f"IC\t{cycle}\t" + "\t".join(str(rng.randrange(10 ** 5)) for _ in range(4)))
+    for depth in range(1, 1001):
+        lines.append(f"COV\t[{depth}-{depth}]\t{depth}\t{rng.randrange(10 ** 8)}")
+    lines.append(f"COV\t[1000<]\t1000\t{rng.randrange(10 ** 6)}")
+    for i in range(2500):
+        values = "\t".join(f"{rng.uniform(0, 60):.3f}" for _ in range(6))
+        lines.append(f"GCD\t{i * 0.04:.1f}\t{values}")
+
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def best_time(func, repeats):
+    """Best wall time of ``repeats`` calls"""
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stats", help="samtools stats output to parse instead of synthetic data")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        stats_path = args.stats or write_wgs_like_stats(os.path.join(tmpdir, "stats.txt"))
+        with open(stats_path) as f:
+            n_lines = sum(1 for _ in f)
+        print(f"Stats file: {os.path.getsize(stats_path) / 1024:,.0f} KB, {n_lines:,} lines\n")
+
+        baseline = best_time(lambda: parse_samtools_stats_linewise(stats_path), args.repeats)
+        vectorized = best_time(lambda: parse_samtools_stats(stats_path), args.repeats)
+
+        old, new = parse_samtools_stats_linewise(stats_path), parse_samtools_stats(stats_path)
+        old_columns = sum(frame.shape[1] for frame in old.values())
+        new_columns = sum(frame.shape[1] for frame in new.values())
+
+        # Columns both parsers read the same way must agree exactly
+        for tag, columns in (("GCF", ["GC%", "Count"]), ("IS", ["Insert Size", "Count"]),
+                             ("RL", ["Length", "Count"])):
+            if tag in old:
+                pd.testing.assert_frame_equal(
+                    old[tag][columns].reset_index(drop=True), new[tag][columns],
+                    check_dtype=False
+                )
+
+        print(f"{'parser':<14}{'seconds':>10}{'sections':>10}{'columns':>10}")
+        print(f"{'line-by-line':<14}{baseline:>10.4f}{len(old):>10}{old_columns:>10}")
+        print(f"{'vectorized':<14}{vectorized:>10.4f}{len(new):>10}{new_columns:>10}")
+        print(f"\nSpeedup: {baseline / vectorized:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
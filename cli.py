@@ -0,0 +1,265 @@
+"""Headless command line interface: ``bamcram-analyzer run <file> --out <dir>``.
+
+Runs the same pipeline as the app, without Streamlit, and writes the same
+results ZIP. ``bamcram-analyzer query`` searches the results store across
+every sample analyzed so far, and ``bamcram-analyzer references`` manages
+the reference genomes CRAM files are resolved against.
+
+Heavy modules are imported only when the requested outputs need them:
+plotly only when plots are exported, kaleido only for PNG/PDF, so calls
+that just want tables start quickly.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+
+def parse_formats(value):
+    """Parse ``--formats``: a comma-separated subset of html,png,pdf, or 'none'"""
+    from exports import EXPORT_FORMATS
+
+    if value.strip().lower() == 'none':
+        return ()
+    formats = tuple(fmt.strip().lower() for fmt in value.split(',') if fmt.strip())
+    unknown = [fmt for fmt in formats if fmt not in EXPORT_FORMATS]
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f"unknown format(s): {', '.join(unknown)} (choose from {', '.join(EXPORT_FORMATS)} or none)"
+        )
+    return formats
+
+
+def build_parser():
+    """Argument parser of the ``bamcram-analyzer`` command"""
+    parser = argparse.ArgumentParser(
+        prog="bamcram-analyzer", description="BAM/CRAM quality control without the web UI"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Analyze one BAM/CRAM file and write the results ZIP")
+    run.add_argument("file", help="BAM or CRAM file to analyze")
+    run.add_argument("--out", required=True, help="Directory to write the results ZIP into")
+    run.add_argument("--reference", help="Reference FASTA (needed for samtools stats and coverage on CRAM); "
+                                         "a registered reference's name, or omit to find it from the CRAM header")
+    run.add_argument("--regions", help="Only analyze these regions: chr, chr:start-end, "
+                                       "separated by spaces or semicolons")
+    run.add_argument("--bed", help="Only analyze the regions of this BED file (combined with --regions)")
+    run.add_argument("--coverage-engine", choices=("qualimap", "native"), default=None,
+                     help="BAM coverage from QualiMap (full report) or the native engine "
+                          "(coverage plots only, no JVM; default: BAMCRAM_COVERAGE_ENGINE or qualimap)")
+    run.add_argument("--threads", type=int, default=None,
+                     help="Thread budget shared by the tools (default: BAMCRAM_THREADS or all cores)")
+    run.add_argument("--shards", type=int, default=None,
+                     help="Split samtools stats and native coverage into this many contig shards "
+                          "run in parallel (default: BAMCRAM_STATS_SHARDS or 1, no sharding)")
+    run.add_argument("--formats", type=parse_formats, default="html,png,pdf",
+                     help="Plot formats to export: comma-separated html,png,pdf, or 'none' (default: all)")
+    run.add_argument("--no-cache", action="store_true",
+                     help="Re-run the tools: ignore the result cache and store, and do not update either")
+    run.add_argument("-v", "--verbose", action="store_true", help="Print step progress to stderr")
+
+    query = commands.add_parser("query", help="List stored samples whose metric matches a condition")
+    query.add_argument("metric", nargs="?",
+                       help="samtools stats SN or flagstat metric, e.g. "
+                            "'percentage of properly paired reads (%%)'; omit to list the metrics")
+    query.add_argument("op", nargs="?", choices=("<", "<=", ">", ">=", "==", "!="))
+    query.add_argument("value", nargs="?", type=float)
+
+    references = commands.add_parser("references", help="List, add or remove registered reference genomes")
+    references.add_argument("action", nargs="?", choices=("list", "add", "remove"), default="list")
+    references.add_argument("name", nargs="?", help="Name of the reference, e.g. GRCh38")
+    references.add_argument("fasta", nargs="?", help="FASTA file to register (for add)")
+    return parser
+
+
+def print_step_changes(seen):
+    """Scheduler callback printing each step's state changes to stderr"""
+    def on_update(steps):
+        for step in steps:
+            if seen.get(step.name) != step.state:
+                seen[step.name] = step.state
+                print(f"[{step.label}] {step.state}", file=sys.stderr)
+    return on_update
+
+
+def run_command(args):
+    """Run the ``run`` subcommand and return the process exit code"""
+    from analysis import AnalysisError, analysis_cache_key, analyze_sample, is_cram_path
+    from exports import IMAGE_FORMATS, analysis_zip_entries, write_results_zip
+    from inputs import local_file_fingerprint, prepare_local_input
+    from references import ReferenceRegistry
+    from regions import load_regions, regions_key
+    from result_cache import ResultCache
+    from result_store import ResultStore
+    from scheduler import DEFAULT_THREADS
+    from tools import COVERAGE_ENGINE, STATS_SHARDS
+
+    started = time.monotonic()
+    registry = ReferenceRegistry()
+    registry.install()
+    if args.reference in registry.names():
+        args.reference = registry.fasta_path(args.reference)
+    for path in filter(None, (args.file, args.reference, args.bed)):
+        if not os.path.isfile(path):
+            print(f"bamcram-analyzer: no such file: {path}", file=sys.stderr)
+            return 2
+    bed_text = ""
+    if args.bed:
+        with open(args.bed) as f:
+            bed_text = f.read()
+    try:
+        regions = load_regions(args.regions or "", bed_text)
+    except ValueError as e:
+        print(f"bamcram-analyzer: {e}", file=sys.stderr)
+        return 2
+    is_cram = is_cram_path(args.file)
+    reference = args.reference if is_cram else None
+    if is_cram and reference is None:
+        from tools import samtools_header
+
+        name = registry.resolve(samtools_header(args.file))
+        if name:
+            reference = registry.fasta_path(name)
+            if args.verbose:
+                print(f"Using registered reference {name}", file=sys.stderr)
+    formats = args.formats
+    coverage_engine = args.coverage_engine or COVERAGE_ENGINE
+    shards = args.shards or STATS_SHARDS
+
+    cache = None if args.no_cache else ResultCache()
+    cache_key = analysis_cache_key(
+        is_cram, local_file_fingerprint(args.file),
+        local_file_fingerprint(reference) if reference else "",
+        regions_key(regions) if regions else "", coverage_engine, shards
+    )
+    store = ResultStore()
+    results = cache.get(cache_key) if cache else None
+    if results is None and cache:
+        results = store.load(cache_key)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if results is None:
+            file_path, index_ready = prepare_local_input(args.file, workdir)
+            reference_path, reference_indexed = (
+                prepare_local_input(reference, workdir) if reference else (None, False)
+            )
+            try:
+                results = analyze_sample(
+                    file_path, workdir, reference_path, index_ready=index_ready,
+                    reference_indexed=reference_indexed, threads=args.threads or DEFAULT_THREADS,
+                    on_update=print_step_changes({}) if args.verbose else None, regions=regions,
+                    coverage_engine=coverage_engine, shards=shards
+                )
+            except AnalysisError as e:
+                print(f"bamcram-analyzer: {e}", file=sys.stderr)
+                return 1
+            for message in results['warnings'] + results['errors']:
+                print(f"bamcram-analyzer: warning: {message}", file=sys.stderr)
+            if not results['errors']:
+                if cache:
+                    cache.put(cache_key, results)
+                    store.save(cache_key, os.path.basename(args.file), "cram" if is_cram else "bam", results)
+        elif args.verbose:
+            print("Loaded cached results - no tools were re-run", file=sys.stderr)
+
+    stats = results.get('stats', {})
+    plots, samtools_plots, render_cache = {}, {}, None
+    if formats:
+        from plots import create_all_plots, create_samtools_plots
+
+        samtools_plots = create_samtools_plots(stats) if stats else {}
+        if results.get('qualimap_results'):
+            plots = create_all_plots(results['qualimap_results'])
+        if any(fmt in IMAGE_FORMATS for fmt in formats):
+            from exports import RenderCache
+            render_cache = RenderCache()
+
+    chromosome_stats = None
+    if results.get('idxstats_text'):
+        from parsers import parse_idxstats
+        chromosome_stats = parse_idxstats(results['idxstats_text'])
+        if chromosome_stats.empty:
+            chromosome_stats = None
+
+    # Same layout as the app: coverage plots under plots/ and the samtools
+    # ones under plots/samtools/; without coverage (CRAM with no reference)
+    # the samtools plots take plots/
+    if not plots:
+        plots, samtools_plots = samtools_plots, {}
+    entries = analysis_zip_entries(
+        results['flagstat_text'], stats, plots, render_cache,
+        chromosome_stats=chromosome_stats, samtools_plots=samtools_plots, formats=formats
+    )
+    os.makedirs(args.out, exist_ok=True)
+    zip_name = "cram_analysis_results.zip" if is_cram else "bam_analysis_results.zip"
+    zip_path = write_results_zip(os.path.join(args.out, zip_name), entries)
+
+    print(zip_path)
+    if args.verbose:
+        print(f"Done in {time.monotonic() - started:.1f} s", file=sys.stderr)
+    return 0
+
+
+def query_command(args):
+    """Run the ``query`` subcommand: print matching samples as TSV"""
+    from result_store import ResultStore
+
+    store = ResultStore()
+    if not store.available:
+        print("bamcram-analyzer: the results store needs pyarrow", file=sys.stderr)
+        return 2
+    if args.metric is None:
+        print("\n".join(store.metrics()))
+        return 0
+    if args.op is None or args.value is None:
+        print("bamcram-analyzer: query needs a metric, an operator and a value", file=sys.stderr)
+        return 2
+    matches = store.query(args.metric, args.op, args.value)
+    sys.stdout.write(matches.to_csv(sep="\t", index=False))
+    return 0
+
+
+def references_command(args):
+    """Run the ``references`` subcommand: list, register or unregister references"""
+    from references import ReferenceRegistry
+
+    registry = ReferenceRegistry()
+    if args.action == "list":
+        for name in registry.names():
+            manifest = registry.manifest(name)
+            print(f"{name}\t{len(manifest['sequences'])} sequences\t{manifest['size'] / 1024 ** 3:.2f} GB")
+        return 0
+    if not args.name or (args.action == "add" and not args.fasta):
+        print(f"bamcram-analyzer: references {args.action} needs a name"
+              f"{' and a FASTA file' if args.action == 'add' else ''}", file=sys.stderr)
+        return 2
+    if args.action == "remove":
+        registry.remove(args.name)
+        return 0
+    if not os.path.isfile(args.fasta):
+        print(f"bamcram-analyzer: no such file: {args.fasta}", file=sys.stderr)
+        return 2
+    try:
+        print(registry.add(args.name, args.fasta))
+    except ValueError as e:
+        print(f"bamcram-analyzer: {e}", file=sys.stderr)
+        return 2
+    return 0
+
+
+def main(argv=None):
+    """Entry point of the ``bamcram-analyzer`` console script"""
+    args = build_parser().parse_args(argv)
+    if args.command == "run":
+        return run_command(args)
+    if args.command == "query":
+        return query_command(args)
+    if args.command == "references":
+        return references_command(args)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""Batch analysis of a cohort of BAM/CRAM files.
+
+Samples run on a bounded pool of workers, each with its own slice of the
+thread budget and its own scheduler. Every sample is cached under the same
+key as a single-file analysis, so re-running a cohort with one extra sample
+only analyzes that sample. The cross-sample tables are built from the
+samtools stats sections, which BAM files and CRAM files with a reference
+both have.
+"""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from analysis import analyze_sample, is_cram_path
+from downsample import downsample_frame
+from inputs import prepare_local_input
+from scheduler import DEFAULT_THREADS, DONE, FAILED, PENDING, RUNNING, max_parallel_samples
+from tools import COVERAGE_ENGINE, samtools_faidx
+
+# samtools stats SN metrics shown per sample, with their column names
+COHORT_SN_METRICS = {
+    'raw total sequences': 'Total Reads',
+    'reads mapped': 'Mapped Reads',
+    'reads duplicated': 'Duplicated Reads',
+    'reads MQ0': 'MQ0 Reads',
+    'bases mapped (cigar)': 'Bases Mapped (CIGAR)',
+    'error rate': 'Error Rate',
+    'average length': 'Average Length',
+    'average quality': 'Average Quality',
+    'insert size average': 'Insert Size Mean',
+    'insert size standard deviation': 'Insert Size SD',
+}
+
+
+
+class Sample:
+    """One file of a cohort and the outcome of its analysis"""
+
+    def __init__(self, name, path, cache_key, local=False):
+        self.name = name
+        self.path = path
+        self.cache_key = cache_key
+        self.local = local
+        self.state = PENDING
+        self.results = None
+        self.error = None
+        self.from_cache = False
+        self.started = None
+        self.finished = None
+
+    @property
+    def wall_time(self):
+        """Seconds spent analyzing this sample so far"""
+        if self.started is None:
+            return None
+        return (self.finished or time.monotonic()) - self.started
+
+    def __repr__(self):
+        return f"Sample({self.name!r}, state={self.state!r})"
+
+
+def unique_sample_names(paths):
+    """Sample names from file names, numbered when two files share a name"""
+    names = []
+    seen = {}
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        seen[name] = seen.get(name, 0) + 1
+        names.append(name if seen[name] == 1 else f"{name}_{seen[name]}")
+    return names
+
+
+def _analyze(sample, workdir, reference_path, threads, regions=None, coverage_engine=COVERAGE_ENGINE):
+    """Run one sample in its own working directory"""
+    os.makedirs(workdir, exist_ok=True)
+    file_path, index_ready = sample.path, False
+    if sample.local:
+        file_path, index_ready = prepare_local_input(sample.path, workdir)
+    return analyze_sample(
+        file_path, workdir, reference_path if is_cram_path(file_path) else None,
+        index_ready=index_ready, reference_indexed=True, threads=threads, regions=regions,
+        coverage_engine=coverage_engine
+    )
+
+
+def run_cohort(samples, cache, workdir, reference_path=None, reference_indexed=False,
+               threads=DEFAULT_THREADS, max_workers=None, on_update=None, poll_interval=0.5,
+               regions=None, coverage_engine=COVERAGE_ENGINE, store=None):
+    """Analyze every sample that is not cached yet and return the samples.
+
+    At most ``max_workers`` samples run at once and the thread budget is
+    split evenly between them. ``regions`` restricts every sample to the
+    same target regions and ``coverage_engine`` picks how BAM coverage is
+    computed; the samples' cache keys must include both. ``on_update(samples)`` is called from the
+    calling thread whenever a sample changes state and every
+    ``poll_interval`` seconds while samples are running. With a
+    ``ResultStore`` as ``store``, samples missing from the cache are
+    reopened from it, and new analyses are saved to it.
+    """
+    def notify():
+        if on_update:
+            on_update(samples)
+
+    todo = []
+    for sample in samples:
+        cached = cache.get(sample.cache_key)
+        if cached is None and store is not None:
+            cached = store.load(sample.cache_key)
+        if cached is not None:
+            sample.results, sample.state, sample.from_cache = cached, DONE, True
+        else:
+            todo.append(sample)
+    notify()
+    if not todo:
+        return samples
+
+    # Index a shared reference once instead of racing from every CRAM sample
+    if reference_path and not reference_indexed and any(is_cram_path(s.path) for s in todo):
+        samtools_faidx(reference_path)
+
+    workers = max(1, min(max_workers or max_parallel_samples(), len(todo)))
+    sample_threads = max(1, threads // workers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sample") as pool:
+        running = {
+            pool.submit(_analyze, sample, os.path.join(workdir, f"sample_{index:04d}"),
+                        reference_path, sample_threads, regions, coverage_engine): sample
+            for index, sample in enumerate(samples) if sample.state == PENDING
+        }
+        while running:
+            # Samples queued behind the pool stay pending until a worker picks them up
+            for future, sample in running.items():
+                if sample.state == PENDING and future.running():
+                    sample.state = RUNNING
+                    sample.started = time.monotonic()
+            notify()
+
+            done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                sample = running.pop(future)
+                sample.finished = time.monotonic()
+                try:
+                    sample.results = future.result()
+                    sample.state = DONE
+                    # Only keep complete analyses so failures are retried next time
+                    if not sample.results['errors']:
+                        cache.put(sample.cache_key, sample.results)
+                        if store is not None:
+                            store.save(sample.cache_key, sample.name,
+                                       "cram" if is_cram_path(sample.path) else "bam", sample.results)
+                except Exception as e:
+                    sample.error = e
+                    sample.state = FAILED
+
+    notify()
+    return samples
+
+
+def summary_numbers(results):
+    """SN metrics of one sample as a name -> number dictionary"""
+    frame = (results or {}).get('stats', {}).get('SN')
+    if frame is None or frame.empty:
+        return {}
+    values = pd.to_numeric(frame['Value'], errors='coerce')
+    return dict(zip(frame['Metric'], values))
+
+
+def cohort_summary(samples):
+    """One row per sample with its status and key samtools stats metrics"""
+    rows = []
+    for sample in samples:
+        numbers = summary_numbers(sample.results)
+        row = {'Sample': sample.name, 'Status': sample.state}
+        for metric, column in COHORT_SN_METRICS.items():
+            row[column] = numbers.get(metric)
+        total = numbers.get('raw total sequences')
+        if total:
+            row['% Mapped'] = 100 * numbers.get('reads mapped', 0) / total
+            row['% Duplicated'] = 100 * numbers.get('reads duplicated', 0) / total
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def cohort_curves(samples, section, x, y, max_points=None):
+    """Long table of one stats section across samples, for overlaid plots.
+
+    With ``max_points`` each sample's curve is downsampled to that many
+    points, so large cohorts still plot quickly.
+    """
+    frames = []
+    for sample in samples:
+        frame = (sample.results or {}).get('stats', {}).get(section)
+        if frame is None or frame.empty or x not in frame or y not in frame:
+            continue
+        frame = frame[[x, y]]
+        if max_points:
+            frame = downsample_frame(frame, x, y, max_points)
+        frames.append(frame.assign(Sample=sample.name))
+    if not frames:
+        return pd.DataFrame(columns=[x, y, 'Sample'])
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,213 @@
+"""Native coverage engine: QualiMap's coverage tables without the JVM.
+
+Per-base depths are streamed from ``samtools depth -a`` (or computed from
+the reads with pysam, when it is installed) and folded chunk by chunk into
+NumPy accumulators: coverage summed per window across the genome, and a
+histogram of depths. The tables come out with the names and columns of the
+QualiMap raw data files, so ``create_all_plots`` draws them unchanged;
+only the coverage plots are produced.
+"""
+import subprocess
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+from parsers import parse_header_contigs
+from regions import clamp_regions, write_regions
+from tools import samtools_depth_command, samtools_header
+
+# Where the native engine gets per-base depths from; pysam skips the text round trip
+DEPTH_READERS = ('samtools', 'pysam')
+DEFAULT_DEPTH_READER = 'pysam' if pysam is not None else 'samtools'
+
+# QualiMap bamqc defaults: 400 windows, genome fraction reported up to 50X
+COVERAGE_WINDOWS = 400
+GENOME_FRACTION_MAX_COVERAGE = 50
+
+# Rows of samtools depth output parsed at a time
+DEPTH_CHUNK_ROWS = 2_000_000
+
+# Bases per pysam fetch; bounds the size of the per-chunk depth array
+PYSAM_CHUNK_BASES = 1_000_000
+
+# Reads samtools depth skips by default: unmapped, secondary, QC-failed, duplicate
+DEPTH_EXCLUDED_FLAGS = 0x4 | 0x100 | 0x200 | 0x400
+
+
+class CoverageAccumulator:
+    """Windowed coverage and a depth histogram, built from chunks of per-base depths.
+
+    Positions are placed on the contigs laid end to end, as QualiMap does,
+    and split into ``n_windows`` equal windows. Only the positions that are
+    added count, so a region-restricted run covers just its regions.
+    """
+
+    def __init__(self, contigs, n_windows=COVERAGE_WINDOWS):
+        self.contig_offsets = {}
+        offset = 0
+        for name, length in contigs:
+            self.contig_offsets[name] = offset
+            offset += length
+        self.genome_length = offset
+        self.n_windows = max(1, min(n_windows, offset))
+        self.window_bases = np.zeros(self.n_windows, dtype=np.int64)
+        self.window_depth = np.zeros(self.n_windows)
+        self.window_depth_sq = np.zeros(self.n_windows)
+        self.histogram = np.zeros(1, dtype=np.int64)
+
+    def add(self, genome_positions, depths):
+        """Add depths at 0-based positions on the concatenated contigs"""
+        if not len(depths):
+            return
+        windows = genome_positions * self.n_windows // self.genome_length
+        values = depths.astype(np.float64)
+        self.window_bases += np.bincount(windows, minlength=self.n_windows)
+        self.window_depth += np.bincount(windows, weights=values, minlength=self.n_windows)
+        self.window_depth_sq += np.bincount(windows, weights=values * values, minlength=self.n_windows)
+
+        counts = np.bincount(depths)
+        if len(counts) > len(self.histogram):
+            self.histogram = np.pad(self.histogram, (0, len(counts) - len(self.histogram)))
+        self.histogram[:len(counts)] += counts
+
+    def add_contig(self, contig, start, depths):
+        """Add the depths of consecutive bases starting at 0-based ``start`` of a contig"""
+        offset = self.contig_offsets[contig] + start
+        self.add(np.arange(offset, offset + len(depths), dtype=np.int64), depths)
+
+    def merge(self, other):
+        """Add the positions of another accumulator over the same contigs and windows"""
+        self.window_bases += other.window_bases
+        self.window_depth += other.window_depth
+        self.window_depth_sq += other.window_depth_sq
+        if len(other.histogram) > len(self.histogram):
+            self.histogram = np.pad(self.histogram, (0, len(other.histogram) - len(self.histogram)))
+        self.histogram[:len(other.histogram)] += other.histogram
+
+    @property
+    def mean_coverage(self):
+        """Mean depth over every added position"""
+        bases = self.window_bases.sum()
+        return self.window_depth.sum() / bases if bases else 0.0
+
+    def frames(self):
+        """QualiMap-shaped coverage tables, keyed like the raw data files"""
+        covered = self.window_bases > 0
+        bases = self.window_bases[covered]
+        mean = self.window_depth[covered] / bases
+        variance = np.maximum(self.window_depth_sq[covered] / bases - mean * mean, 0)
+        window_starts = np.arange(self.n_windows) * (self.genome_length / self.n_windows)
+
+        depths = np.flatnonzero(self.histogram)
+        total = self.histogram.sum()
+        # Share of positions with at least X coverage, for X = 0..50
+        histogram = np.pad(self.histogram, (0, max(0, GENOME_FRACTION_MAX_COVERAGE + 1 - len(self.histogram))))
+        at_least = histogram[::-1].cumsum()[::-1][:GENOME_FRACTION_MAX_COVERAGE + 1]
+
+        return {
+            'coverage_across_reference': pd.DataFrame({
+                'Position': window_starts[covered], 'Coverage': mean, 'Std': np.sqrt(variance)
+            }),
+            'coverage_histogram': pd.DataFrame({
+                'Coverage': depths, 'Frequency': self.histogram[depths]
+            }),
+            'genome_fraction_coverage': pd.DataFrame({
+                'Coverage': np.arange(len(at_least)),
+                'Genome Fraction': 100 * at_least / total if total else np.zeros(len(at_least))
+            }),
+        }
+
+
+def read_samtools_depth(accumulator, file_path, bed_path=None, reference_path=None, threads=1):
+    """Stream ``samtools depth`` output into the accumulator"""
+    command = samtools_depth_command(file_path, bed_path, reference_path, threads)
+    offsets = accumulator.contig_offsets
+    # stderr goes to a file: a pipe read only after stdout is drained could fill up and stall samtools
+    with tempfile.TemporaryFile() as stderr_file:
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file) as process:
+            try:
+                chunks = pd.read_csv(
+                    process.stdout, sep='\t', header=None, usecols=[0, 1, 2],
+                    names=['Contig', 'Position', 'Depth'],
+                    dtype={'Contig': 'category', 'Position': np.int64, 'Depth': np.int64},
+                    chunksize=DEPTH_CHUNK_ROWS
+                )
+                for chunk in chunks:
+                    contigs = chunk['Contig'].cat
+                    contig_offsets = np.array([offsets[name] for name in contigs.categories], dtype=np.int64)
+                    positions = contig_offsets[contigs.codes.to_numpy()] + chunk['Position'].to_numpy() - 1
+                    accumulator.add(positions, chunk['Depth'].to_numpy())
+            except pd.errors.EmptyDataError:
+                pass
+        if process.returncode:
+            stderr_file.seek(0)
+            raise subprocess.CalledProcessError(process.returncode, command,
+                                                stderr=stderr_file.read().decode(errors="replace"))
+
+
+def pysam_chunk_depth(alignments, contig, start, end):
+    """Depth of each base in ``[start, end)`` (0-based) from the aligned blocks of the reads"""
+    block_starts, block_ends = [], []
+    for read in alignments.fetch(contig, start, end):
+        if read.flag & DEPTH_EXCLUDED_FLAGS:
+            continue
+        for block_start, block_end in read.get_blocks():
+            block_starts.append(block_start)
+            block_ends.append(block_end)
+    size = end - start
+    # +1 at each block start, -1 past each block end; the running sum is the depth
+    starts = np.clip(np.array(block_starts, dtype=np.int64) - start, 0, size)
+    ends = np.clip(np.array(block_ends, dtype=np.int64) - start, 0, size)
+    changes = np.bincount(starts, minlength=size + 1) - np.bincount(ends, minlength=size + 1)
+    return np.cumsum(changes[:size])
+
+
+def read_pysam_depth(accumulator, file_path, spans, reference_path=None, threads=1):
+    """Compute depths with pysam over 1-based inclusive ``(contig, start, end)`` spans"""
+    with pysam.AlignmentFile(file_path, reference_filename=reference_path, threads=threads) as alignments:
+        for contig, start, end in spans:
+            for chunk_start in range(start - 1, end, PYSAM_CHUNK_BASES):
+                chunk_end = min(chunk_start + PYSAM_CHUNK_BASES, end)
+                depths = pysam_chunk_depth(alignments, contig, chunk_start, chunk_end)
+                accumulator.add_contig(contig, chunk_start, depths)
+
+
+def accumulate_coverage(file_path, workdir, regions=None, reference_path=None, threads=1,
+                        reader=DEFAULT_DEPTH_READER, n_windows=COVERAGE_WINDOWS, name="coverage_regions"):
+    """``CoverageAccumulator`` filled from an indexed BAM/CRAM file.
+
+    ``reader`` picks samtools depth or pysam; ``regions`` limits the
+    positions counted, written as ``name`` for samtools depth.
+    """
+    if reader not in DEPTH_READERS:
+        raise ValueError(f"Unknown depth reader: {reader}")
+    if reader == 'pysam' and pysam is None:
+        raise RuntimeError("The pysam depth reader needs pysam, which is not installed")
+
+    contigs = parse_header_contigs(samtools_header(file_path))
+    accumulator = CoverageAccumulator(contigs, n_windows)
+    spans = clamp_regions(regions, contigs) if regions else [(name, 1, length) for name, length in contigs]
+
+    if reader == 'pysam':
+        read_pysam_depth(accumulator, file_path, spans, reference_path, threads)
+    else:
+        bed_path = write_regions(spans, workdir, name=name)[1] if regions else None
+        read_samtools_depth(accumulator, file_path, bed_path, reference_path, threads)
+    return accumulator
+
+
+def native_coverage(file_path, workdir, regions=None, reference_path=None, threads=1,
+                    reader=DEFAULT_DEPTH_READER, n_windows=COVERAGE_WINDOWS):
+    """Compute QualiMap's coverage tables for an indexed BAM/CRAM file.
+
+    ``reader`` picks samtools depth or pysam; ``regions`` limits the
+    positions counted. Returns the tables keyed like QualiMap's raw data.
+    """
+    return accumulate_coverage(file_path, workdir, regions, reference_path, threads, reader,
+                               n_windows).frames()
@@ -0,0 +1,88 @@
+"""Downsampling of long series before they are plotted.
+
+Genome-wide tables can hold hundreds of thousands of windows, far more
+points than a chart is wide. Reducing them to a point budget before the
+figure is built keeps the JSON sent to the browser small. Min/max bucketing
+keeps the extremes of every bucket, so coverage spikes and dropouts stay
+visible; LTTB (Largest-Triangle-Three-Buckets) keeps the visual shape.
+"""
+import os
+
+import numpy as np
+
+# Points per downsampled trace; the zoomed-in view is re-queried at this budget
+PLOT_MAX_POINTS = int(os.environ.get("BAMCRAM_PLOT_MAX_POINTS", 4000))
+
+DOWNSAMPLE_METHODS = ('minmax', 'lttb')
+
+
+def minmax_indices(y, max_points):
+    """Indices of the minimum and maximum of ``y`` in ``max_points // 2`` buckets"""
+    n = len(y)
+    if n <= max_points:
+        return np.arange(n)
+    n_buckets = max(1, max_points // 2)
+    size = -(-n // n_buckets)
+    n_buckets = -(-n // size)
+
+    # Pad to whole buckets so argmin/argmax run on a 2-D view
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = y
+    buckets = padded.reshape(n_buckets, size)
+    offsets = np.arange(n_buckets) * size
+    lows = offsets + np.nanargmin(buckets, axis=1)
+    highs = offsets + np.nanargmax(buckets, axis=1)
+
+    # Keep the first and last point so the x extent is unchanged
+    return np.unique(np.concatenate(([0], lows, highs, [n - 1])))
+
+
+def lttb_indices(x, y, max_points):
+    """Indices chosen by Largest-Triangle-Three-Buckets for ``max_points`` points"""
+    n = len(y)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    previous = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        # The next bucket's average is the third corner of the triangle
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[end:next_end].mean() if next_end > end else x[-1]
+        next_y = y[end:next_end].mean() if next_end > end else y[-1]
+
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+
+def downsample_frame(frame, x, y, max_points=PLOT_MAX_POINTS, method='minmax', x_range=None):
+    """Return at most ~``max_points`` rows of ``frame`` for plotting ``y`` over ``x``.
+
+    ``x_range`` restricts the frame to ``[start, end]`` first, so a zoomed
+    view is drawn from full-resolution data at the same point budget. All
+    columns of the selected rows are kept.
+    """
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    frame = frame.dropna(subset=[x, y])
+    if x_range is not None:
+        positions = frame[x].to_numpy()
+        frame = frame[(positions >= x_range[0]) & (positions <= x_range[1])]
+    if len(frame) <= max_points:
+        return frame
+
+    xs = frame[x].to_numpy(dtype=np.float64)
+    ys = frame[y].to_numpy(dtype=np.float64)
+    if method == 'lttb':
+        indices = lttb_indices(xs, ys, max_points)
+    else:
+        indices = minmax_indices(ys, max_points)
+    return frame.iloc[indices]
@@ -0,0 +1,248 @@
+"""Exports of analysis results: rendered figures and the results archive.
+
+Kaleido takes seconds per image, so images are never rendered while the
+page is built. Renders are keyed by the figure's content hash and format,
+run on a background worker and kept in memory, so a figure is rendered at
+most once no matter how often Streamlit reruns the script.
+
+The results ZIP is described as a list of ``(arcname, producer)`` entries.
+Producers run concurrently and their output is written straight into the
+archive on disk, compressed or stored depending on the file type. With
+Streamlit's static file serving enabled, the archive is written under
+``EXPORTS_DIR`` and downloaded from there, read from disk in chunks by the
+web server; a download button would hold the whole archive in memory.
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+try:
+    # plotly imports its JSON engine lazily, which races when figures are
+    # serialized from several export threads at once
+    import orjson  # noqa: F401
+except ImportError:
+    pass
+
+IMAGE_FORMATS = ('png', 'pdf')
+
+# Every format a plot is exported in; HTML needs no renderer
+EXPORT_FORMATS = ('html',) + IMAGE_FORMATS
+
+IMAGE_MIME_TYPES = {
+    'png': 'image/png',
+    'pdf': 'application/pdf',
+    'svg': 'image/svg+xml',
+}
+
+# Text compresses well; PNG and PDF are already compressed, so store them
+ZIP_COMPRESSION = {
+    '.csv': zipfile.ZIP_DEFLATED,
+    '.html': zipfile.ZIP_DEFLATED,
+    '.txt': zipfile.ZIP_DEFLATED,
+    '.json': zipfile.ZIP_DEFLATED,
+    '.png': zipfile.ZIP_STORED,
+    '.pdf': zipfile.ZIP_STORED,
+}
+ZIP_COMPRESS_LEVEL = 6
+ZIP_MAX_WORKERS = 4
+
+# Streamlit serves the app's static/ folder (server.enableStaticServing) under
+# app/static/, up to 200 MB per file; archives go in random subdirectories
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+EXPORTS_DIR = os.path.join(STATIC_DIR, "exports")
+STATIC_FILE_MAX_BYTES = 200 * 1024 ** 2
+
+# Served archives older than this are removed when the next one is written
+EXPORT_RETENTION_SECONDS = int(os.environ.get("BAMCRAM_EXPORT_RETENTION_HOURS", 24)) * 3600
+
+
+def figure_digest(fig):
+    """Content hash of a Plotly figure (data and layout)"""
+    return hashlib.sha256(fig.to_json().encode()).hexdigest()
+
+
+class RenderCache:
+    """In-memory cache of rendered figure images with a background worker.
+
+    Kaleido drives a single renderer process that is not thread-safe, so all
+    renders go through one worker thread. ``prefetch`` queues renders without
+    waiting; ``render`` waits for (or starts) a render and returns the bytes.
+    """
+
+    def __init__(self, max_entries=256, max_workers=1):
+        self.max_entries = max_entries
+        self._images = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render")
+        self.renders = 0
+
+    def _render(self, key, fig, fmt):
+        """Render one image on the worker and store it"""
+        try:
+            image = fig.to_image(format=fmt)
+        except Exception:
+            # A failed render is forgotten so the next request retries it
+            with self._lock:
+                self._pending.pop(key, None)
+            raise
+        with self._lock:
+            self.renders += 1
+            self._images[key] = image
+            self._pending.pop(key, None)
+            while len(self._images) > self.max_entries:
+                self._images.popitem(last=False)
+        return image
+
+    def _submit(self, fig, fmt):
+        """Return ``(image, None)`` if cached, else ``(None, future)``"""
+        key = (figure_digest(fig), fmt)
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return self._images[key], None
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = self._pool.submit(self._render, key, fig, fmt)
+        return None, future
+
+    def get(self, fig, fmt):
+        """Return the rendered image if it is ready, without rendering it"""
+        key = (figure_digest(fig), fmt)
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+        return image
+
+    def prefetch(self, figures, formats=IMAGE_FORMATS):
+        """Queue background renders for every figure and format"""
+        for fig in figures:
+            for fmt in formats:
+                self._submit(fig, fmt)
+
+    def render(self, fig, fmt):
+        """Return the rendered image, waiting for or starting its render"""
+        image, future = self._submit(fig, fmt)
+        return image if image is not None else future.result()
+
+    def stats(self):
+        """Number of cached images, queued renders and renders so far"""
+        with self._lock:
+            return {
+                'images': len(self._images),
+                'pending': len(self._pending),
+                'renders': self.renders,
+            }
+
+
+def zip_compression(arcname):
+    """Compression method for an archive entry, chosen by file extension"""
+    return ZIP_COMPRESSION.get(os.path.splitext(arcname)[1].lower(), zipfile.ZIP_DEFLATED)
+
+
+def write_results_zip(zip_path, entries, max_workers=ZIP_MAX_WORKERS,
+                      compresslevel=ZIP_COMPRESS_LEVEL):
+    """Produce archive entries concurrently and stream them into ``zip_path``.
+
+    ``entries`` is a list of ``(arcname, producer)`` pairs; each producer is
+    called with no arguments and returns ``str`` or ``bytes``. Entries are
+    written in list order as soon as they are ready, and at most
+    ``2 * max_workers`` produced entries are held in memory at a time, so
+    nothing is staged in temporary files and the archive itself never sits
+    in memory. Returns ``zip_path``.
+    """
+    entries = iter(entries)
+    window = deque()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="export") as pool, \
+            zipfile.ZipFile(zip_path, 'w') as zipf:
+        def fill():
+            while len(window) < 2 * max_workers:
+                try:
+                    arcname, producer = next(entries)
+                except StopIteration:
+                    return
+                window.append((arcname, pool.submit(producer)))
+
+        fill()
+        while window:
+            arcname, future = window.popleft()
+            data = future.result()
+            if isinstance(data, str):
+                data = data.encode()
+            compress_type = zip_compression(arcname)
+            zipf.writestr(
+                arcname, data, compress_type=compress_type,
+                compresslevel=compresslevel if compress_type == zipfile.ZIP_DEFLATED else None
+            )
+            fill()
+    return zip_path
+
+
+def prune_exports(exports_dir=EXPORTS_DIR, max_age=EXPORT_RETENTION_SECONDS):
+    """Remove served archives older than ``max_age`` seconds"""
+    cutoff = time.time() - max_age
+    try:
+        entries = list(os.scandir(exports_dir))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            expired = entry.stat().st_mtime < cutoff
+        except FileNotFoundError:
+            continue
+        if expired:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def export_path(file_name, exports_dir=EXPORTS_DIR):
+    """A new path for an archive to serve, in a directory named by an unguessable token"""
+    prune_exports(exports_dir)
+    directory = os.path.join(exports_dir, uuid.uuid4().hex)
+    os.makedirs(directory)
+    return os.path.join(directory, file_name)
+
+
+def export_url(path, static_dir=STATIC_DIR):
+    """URL of a file under the static folder, relative to the app page"""
+    return "app/static/" + os.path.relpath(path, static_dir).replace(os.sep, "/")
+
+
+def figure_entries(figures, prefix, render_cache, formats=EXPORT_FORMATS):
+    """Archive entries for figures as ``{prefix}/{format}/{name}.{format}``"""
+    entries = []
+    for name, fig in figures.items():
+        for fmt in formats:
+            if fmt == 'html':
+                producer = fig.to_html
+            else:
+                producer = partial(render_cache.render, fig, fmt)
+            entries.append((f"{prefix}/{fmt}/{name}.{fmt}", producer))
+    return entries
+
+
+def analysis_zip_entries(flagstat_text, stats, plots, render_cache,
+                         chromosome_stats=None, samtools_plots=None, formats=EXPORT_FORMATS):
+    """Archive entries for one analysis, in the layout of the results ZIP.
+
+    ``plots`` go under ``plots/``; for BAM files the QualiMap plots are
+    passed as ``plots`` and the samtools stats plots as ``samtools_plots``
+    (under ``plots/samtools/``). ``render_cache`` may be None when
+    ``formats`` has no image formats.
+    """
+    entries = [("flagstat.txt", lambda: flagstat_text)]
+    if chromosome_stats is not None:
+        entries.append(("chromosome_stats.csv", partial(chromosome_stats.to_csv, index=False)))
+    for name, frame in stats.items():
+        entries.append((f"stats/{name}.csv", partial(frame.to_csv, index=False)))
+    entries += figure_entries(plots, "plots", render_cache, formats)
+    if samtools_plots:
+        entries += figure_entries(samtools_plots, "plots/samtools", render_cache, formats)
+    return entries
@@ -0,0 +1,165 @@
+"""Getting alignment and reference files onto local disk for the tools.
+
+Uploads are streamed to disk through a single reusable buffer, so memory
+use stays at one chunk no matter how large the file is. The copy can hash
+the data on the way through, which yields the content-hash cache key
+without a second pass over the file.
+
+Files that already live on the server (``BAMCRAM_LOCAL_ROOTS``) are passed
+to the tools in place, together with their existing indexes.
+"""
+import glob
+import hashlib
+import os
+import time
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+ALIGNMENT_EXTENSIONS = ('.bam', '.cram')
+FASTA_EXTENSIONS = ('.fa', '.fna', '.fasta')
+
+# Directories whose files may be analyzed in place; empty disables the mode
+LOCAL_ROOTS = [
+    os.path.realpath(root)
+    for root in os.environ.get("BAMCRAM_LOCAL_ROOTS", "").split(os.pathsep) if root
+]
+
+
+class CopyResult:
+    """Outcome of streaming a file-like object to disk"""
+
+    def __init__(self, path, bytes_copied, seconds, digest=None):
+        self.path = path
+        self.bytes_copied = bytes_copied
+        self.seconds = seconds
+        self.digest = digest
+
+    @property
+    def throughput_mb_s(self):
+        """Copy throughput in MB/s"""
+        return self.bytes_copied / 1024 ** 2 / max(self.seconds, 1e-9)
+
+
+def copy_upload(uploaded, dest_path, chunk_size=COPY_CHUNK_SIZE, compute_hash=False,
+                on_progress=None, progress_interval=0.25):
+    """Stream a file-like object (e.g. a Streamlit ``UploadedFile``) to disk.
+
+    Only one ``chunk_size`` buffer is allocated and reused for the whole copy.
+    With ``compute_hash`` the SHA-256 digest of the data is computed during
+    the copy. ``on_progress(bytes_copied)`` is called at most every
+    ``progress_interval`` seconds and once at the end.
+    """
+    hasher = hashlib.sha256() if compute_hash else None
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    copied = 0
+    started = last_report = time.monotonic()
+
+    uploaded.seek(0)
+    with open(dest_path, "wb") as out:
+        while True:
+            if hasattr(uploaded, "readinto"):
+                size = uploaded.readinto(buffer)
+                chunk = view[:size]
+            else:
+                chunk = uploaded.read(chunk_size)
+                size = len(chunk)
+            if not size:
+                break
+            out.write(chunk)
+            if hasher:
+                hasher.update(chunk)
+            copied += size
+
+            now = time.monotonic()
+            if on_progress and now - last_report >= progress_interval:
+                on_progress(copied)
+                last_report = now
+    uploaded.seek(0)
+
+    if on_progress:
+        on_progress(copied)
+    return CopyResult(
+        dest_path, copied, time.monotonic() - started,
+        hasher.hexdigest() if hasher else None
+    )
+
+
+def upload_size(uploaded):
+    """Size in bytes of an uploaded file-like object"""
+    size = getattr(uploaded, "size", None)
+    if size is None:
+        position = uploaded.tell()
+        size = uploaded.seek(0, os.SEEK_END)
+        uploaded.seek(position)
+    return size
+
+
+def index_candidates(path):
+    """Possible index files for an alignment or FASTA file, in preference order"""
+    base, ext = os.path.splitext(path)
+    ext = ext.lower()
+    if ext == '.bam':
+        return [path + '.bai', base + '.bai', path + '.csi']
+    if ext == '.cram':
+        return [path + '.crai', base + '.crai']
+    return [path + '.fai']
+
+
+def find_index(path):
+    """Return an existing index at least as new as ``path``, or None"""
+    data_mtime = os.stat(path).st_mtime
+    for candidate in index_candidates(path):
+        try:
+            if os.stat(candidate).st_mtime >= data_mtime:
+                return candidate
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def is_under_roots(path, roots=None):
+    """Check that ``path`` resolves to a location inside one of the roots"""
+    real_path = os.path.realpath(path)
+    for root in LOCAL_ROOTS if roots is None else roots:
+        if os.path.commonpath([real_path, root]) == root:
+            return True
+    return False
+
+
+def resolve_local_paths(pattern, extensions=ALIGNMENT_EXTENSIONS, roots=None):
+    """Expand a server path or glob into matching files under the allowed roots"""
+    matches = glob.glob(os.path.expanduser(pattern.strip()), recursive=True)
+    return sorted(
+        path for path in matches
+        if os.path.isfile(path)
+        and path.lower().endswith(extensions)
+        and is_under_roots(path, roots)
+    )
+
+
+def local_file_fingerprint(path):
+    """Cheap cache identity for a server-side file: location, size and mtime.
+
+    Hashing the content of a 50 GB file on shared storage would cost as much
+    I/O as the analysis itself, so server files are keyed by metadata.
+    """
+    info = os.stat(path)
+    return hashlib.sha256(
+        f"{os.path.realpath(path)}:{info.st_size}:{info.st_mtime_ns}".encode()
+    ).hexdigest()
+
+
+def prepare_local_input(path, workdir):
+    """Make a server-side file usable by the tools without copying it.
+
+    Returns ``(path_for_tools, index_ready)``. With a fresh index next to the
+    file the original path is used as-is. Otherwise the file is symlinked
+    into ``workdir`` so the missing index can be built there, leaving the
+    (possibly read-only) shared storage untouched.
+    """
+    if find_index(path):
+        return path, True
+    link_path = os.path.join(workdir, os.path.basename(path))
+    os.symlink(os.path.realpath(path), link_path)
+    return link_path, False
@@ -0,0 +1,308 @@
+"""Background job queue: analyses that outlive the browser session.
+
+An analysis submitted as a ``Job`` runs on a bounded, process-wide worker
+pool instead of the Streamlit script thread, in a working directory of its
+own under ``JOBS_DIR``. Closing the tab or losing the websocket only stops
+the page that was watching; the job keeps running, and any session can
+attach to it again by its ID (the app keeps it in the ``?job=`` URL
+parameter). Job state is persisted to ``job.json`` on every change and the
+results to ``results.pkl``, so finished jobs can still be opened after a
+server restart; jobs that were running when the server stopped are marked
+as interrupted.
+
+Admission control: at most ``MAX_QUEUED_JOBS`` jobs wait for a worker;
+beyond that ``create`` raises ``QueueFull`` so the app can turn users away
+instead of piling up work. Waiting jobs know their position in the queue,
+and ``metrics`` reports queue waits and run times.
+"""
+import json
+import os
+import pickle
+import shutil
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from result_cache import CACHE_DIR
+from scheduler import DONE, FAILED, PENDING, RUNNING, max_parallel_samples
+
+JOBS_DIR = os.environ.get("BAMCRAM_JOBS_DIR", os.path.join(CACHE_DIR, "jobs"))
+JOB_WORKERS = int(os.environ.get("BAMCRAM_JOB_WORKERS", 0)) or max_parallel_samples()
+
+# Jobs allowed to wait for a worker before new submissions are refused
+MAX_QUEUED_JOBS = int(os.environ.get("BAMCRAM_MAX_QUEUED_JOBS", 20))
+
+# Finished jobs older than this are removed when the queue starts
+JOB_RETENTION_SECONDS = int(os.environ.get("BAMCRAM_JOB_RETENTION_DAYS", 7)) * 24 * 3600
+
+# State of a job that was running when the server stopped
+INTERRUPTED = "interrupted"
+
+JOB_FINISHED_STATES = (DONE, FAILED, INTERRUPTED)
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at its limit"""
+
+
+class Job:
+    """One submitted analysis: its inputs' description, state, steps and results.
+
+    ``info`` holds whatever the submitter needs to show the results later
+    (file name, format, options); it must be JSON serializable.
+    """
+
+    def __init__(self, job_id, job_dir, name, cache_key="", info=None):
+        self.id = job_id
+        self.dir = job_dir
+        self.name = name
+        self.cache_key = cache_key
+        self.info = info or {}
+        self.state = PENDING
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.steps = []
+        self.step_table = []
+        self._results = None
+
+    @property
+    def workdir(self):
+        """Scratch directory of the job's tools, removed once it finishes"""
+        return os.path.join(self.dir, "work")
+
+    @property
+    def is_finished(self):
+        return self.state in JOB_FINISHED_STATES
+
+    @property
+    def results(self):
+        """Results of a finished job, read back from disk if needed"""
+        if self._results is None and self.state == DONE:
+            with open(os.path.join(self.dir, "results.pkl"), "rb") as f:
+                self._results = pickle.load(f)
+        return self._results
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'name': self.name, 'cache_key': self.cache_key, 'info': self.info,
+            'state': self.state, 'error': self.error, 'created': self.created,
+            'started': self.started, 'finished': self.finished, 'steps': self.step_table,
+        }
+
+    @classmethod
+    def from_dict(cls, job_dir, data):
+        job = cls(data['id'], job_dir, data['name'], data.get('cache_key', ""), data.get('info'))
+        job.state = data['state']
+        job.error = data.get('error')
+        job.created = data.get('created', job.created)
+        job.started = data.get('started')
+        job.finished = data.get('finished')
+        job.step_table = data.get('steps', [])
+        return job
+
+    def __repr__(self):
+        return f"Job({self.id!r}, {self.name!r}, state={self.state!r})"
+
+
+class JobQueue:
+    """Process-wide pool running jobs in the background, with state on disk"""
+
+    def __init__(self, jobs_dir=JOBS_DIR, max_workers=JOB_WORKERS, max_queued=MAX_QUEUED_JOBS):
+        self.jobs_dir = jobs_dir
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Pick up the jobs of earlier server processes"""
+        now = time.time()
+        for job_id in os.listdir(self.jobs_dir):
+            job_dir = os.path.join(self.jobs_dir, job_id)
+            try:
+                with open(os.path.join(job_dir, "job.json")) as f:
+                    job = Job.from_dict(job_dir, json.load(f))
+            except (OSError, ValueError, KeyError):
+                continue
+            if not job.is_finished:
+                job.state = INTERRUPTED
+                job.error = "The server stopped while this job was running"
+                job.finished = now
+                self._save(job)
+                shutil.rmtree(job.workdir, ignore_errors=True)
+            if now - job.finished > JOB_RETENTION_SECONDS:
+                shutil.rmtree(job_dir, ignore_errors=True)
+                continue
+            self.jobs[job.id] = job
+
+    def _save(self, job):
+        """Persist a job's state atomically"""
+        tmp_path = os.path.join(job.dir, "job.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(job.to_dict(), f)
+        os.replace(tmp_path, os.path.join(job.dir, "job.json"))
+
+    def create(self, name, cache_key="", info=None):
+        """A new pending job with its directories, for the caller to stage inputs into.
+
+        The caller must ``start`` the job, or ``discard`` it if staging fails
+        (``create_staged`` does both creation and staging).
+        Raises ``QueueFull`` when ``max_queued`` jobs are already waiting.
+        """
+        job_id = uuid.uuid4().hex[:12]
+        job = Job(job_id, os.path.join(self.jobs_dir, job_id), name, cache_key, info)
+        with self._lock:
+            if self.max_queued and self._queued() >= self.max_queued:
+                raise QueueFull(f"{self.max_queued} analyses are already waiting; try again later")
+            self.jobs[job_id] = job
+        os.makedirs(job.workdir)
+        self._save(job)
+        return job
+
+    def create_staged(self, name, stage, cache_key="", info=None):
+        """A new pending job with ``stage(job)`` run to copy its inputs in.
+
+        Returns the job and what ``stage`` returned. If staging fails or is
+        interrupted the job is discarded, so it holds no queue slot.
+        """
+        job = self.create(name, cache_key, info)
+        try:
+            return job, stage(job)
+        except BaseException:
+            self.discard(job)
+            raise
+
+    def discard(self, job):
+        """Forget a job that was created but never started, with its directory.
+
+        For jobs whose inputs could not be staged: they would otherwise stay
+        pending, hold a queue slot and be attached to by ``find_active``.
+        """
+        with self._lock:
+            if self.jobs.get(job.id) is job and job.state == PENDING:
+                del self.jobs[job.id]
+        shutil.rmtree(job.dir, ignore_errors=True)
+
+    def start(self, job, func):
+        """Queue ``func(job)``; its return value becomes the job's results.
+
+        ``func`` runs on a worker thread and should report scheduler
+        progress through ``job.on_update`` (see ``step_callback``).
+        """
+        self._pool.submit(self._run, job, func)
+        return job
+
+    def _run(self, job, func):
+        job.state, job.started = RUNNING, time.time()
+        self._save(job)
+        try:
+            results = func(job)
+            with open(os.path.join(job.dir, "results.pkl"), "wb") as f:
+                pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+            job._results = results
+            job.state = DONE
+        except Exception as e:
+            job.error = str(e)
+            job.state = FAILED
+        finally:
+            job.finished = time.time()
+            job.step_table = step_table(job.steps)
+            self._save(job)
+            shutil.rmtree(job.workdir, ignore_errors=True)
+
+    def step_callback(self, job):
+        """Scheduler ``on_update`` keeping the job's live steps and persisting state changes"""
+        def on_update(steps):
+            job.steps = steps
+            table = step_table(steps)
+            if [row['state'] for row in table] != [row['state'] for row in job.step_table]:
+                job.step_table = table
+                self._save(job)
+        return on_update
+
+    def get(self, job_id):
+        """The job with this ID, or None"""
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def find_active(self, cache_key):
+        """A pending or running job computing ``cache_key``, to attach to instead of resubmitting"""
+        with self._lock:
+            for job in self.jobs.values():
+                if job.cache_key == cache_key and job.state in (PENDING, RUNNING):
+                    return job
+        return None
+
+    def _queued(self):
+        return sum(job.state == PENDING for job in self.jobs.values())
+
+    def queued(self):
+        """Number of jobs waiting for a worker"""
+        with self._lock:
+            return self._queued()
+
+    def position(self, job):
+        """1-based place of a pending job in the queue, or None once it has started"""
+        with self._lock:
+            if job.state != PENDING:
+                return None
+            return 1 + sum(other.state == PENDING and other.created < job.created
+                           for other in self.jobs.values())
+
+    def metrics(self):
+        """Queue depth, running jobs, outcomes, and queue wait and run time in seconds.
+
+        Waits and run times are the mean, median and maximum over the jobs
+        that have started or finished.
+        """
+        with self._lock:
+            jobs = list(self.jobs.values())
+        waits = [job.started - job.created for job in jobs if job.started is not None]
+        run_times = [job.finished - job.started for job in jobs
+                     if job.started is not None and job.finished is not None]
+        metrics = {
+            'queued': sum(job.state == PENDING for job in jobs),
+            'running': sum(job.state == RUNNING for job in jobs),
+            'done': sum(job.state == DONE for job in jobs),
+            'failed': sum(job.state in (FAILED, INTERRUPTED) for job in jobs),
+            'workers': self.max_workers,
+            'max_queued': self.max_queued,
+        }
+        for name, values in (('wait', waits), ('run', run_times)):
+            metrics[f'{name}_mean'] = float(statistics.mean(values)) if values else None
+            metrics[f'{name}_median'] = float(statistics.median(values)) if values else None
+            metrics[f'{name}_max'] = float(max(values)) if values else None
+        return metrics
+
+
+_shared_queue = None
+_shared_queue_lock = threading.Lock()
+
+
+def shared_queue(create=True):
+    """The process-wide job queue, created on first use.
+
+    With ``create=False`` returns None until some page has created it, so
+    pages that only report on the queue do not start one.
+    """
+    global _shared_queue
+    with _shared_queue_lock:
+        if _shared_queue is None and create:
+            _shared_queue = JobQueue()
+        return _shared_queue
+
+
+def step_table(steps):
+    """JSON-friendly snapshot of scheduler steps"""
+    return [
+        {'label': step.label, 'state': step.state,
+         'wall_time': round(step.wall_time, 1) if step.wall_time is not None else None}
+        for step in steps
+    ]
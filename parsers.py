@@ -0,0 +1,435 @@
+"""Parsers for samtools and QualiMap text outputs.
+
+Everything here returns plain pandas DataFrames and never touches the
+Streamlit UI, so it can run on scheduler worker threads.
+"""
+import csv
+import io
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Column names of each samtools stats section, as documented in the report's
+# own comment lines. FFQ/LFQ are handled separately (one column per quality).
+STATS_SECTION_COLUMNS = {
+    'CHK': ['Read Names CRC32', 'Sequences CRC32', 'Qualities CRC32'],
+    'GCF': ['GC%', 'Count'],
+    'GCL': ['GC%', 'Count'],
+    'GCC': ['Cycle', 'A%', 'C%', 'G%', 'T%', 'N%', 'O%'],
+    'GCT': ['Cycle', 'A%', 'C%', 'G%', 'T%'],
+    'FBC': ['Cycle', 'A%', 'C%', 'G%', 'T%', 'N%', 'O%'],
+    'LBC': ['Cycle', 'A%', 'C%', 'G%', 'T%', 'N%', 'O%'],
+    'FTC': ['A', 'C', 'G', 'T', 'N'],
+    'LTC': ['A', 'C', 'G', 'T', 'N'],
+    'IS': ['Insert Size', 'Count', 'Inward', 'Outward', 'Other'],
+    'RL': ['Length', 'Count'],
+    'FRL': ['Length', 'Count'],
+    'LRL': ['Length', 'Count'],
+    'MAPQ': ['Mapping Quality', 'Count'],
+    'ID': ['Length', 'Insertions', 'Deletions'],
+    'IC': ['Cycle', 'Insertions (fwd)', 'Insertions (rev)', 'Deletions (fwd)', 'Deletions (rev)'],
+    'COV': ['Range', 'Coverage', 'Count'],
+    'GCD': ['GC%', 'Unique Sequence Percentile', '10th Percentile', '25th Percentile',
+            '50th Percentile', '75th Percentile', '90th Percentile'],
+}
+
+# Columns holding fractional values; every other numeric column is an integer
+STATS_FLOAT_COLUMNS = {
+    'GC%', 'A%', 'C%', 'G%', 'T%', 'N%', 'O%', 'Unique Sequence Percentile',
+    '10th Percentile', '25th Percentile', '50th Percentile', '75th Percentile',
+    '90th Percentile',
+}
+
+# A run of consecutive lines sharing the same section tag
+_STATS_SECTION_BLOCK = re.compile(r"^([A-Z]+)\t.*(?:\n\1\t.*)*", re.MULTILINE)
+
+
+def split_stats_sections(text):
+    """Group the lines of a samtools stats report by section tag in one pass"""
+    sections = {}
+    for match in _STATS_SECTION_BLOCK.finditer(text):
+        sections.setdefault(match.group(1), []).extend(match.group(0).split("\n"))
+    return sections
+
+
+def stats_column_names(tag, ncols):
+    """Column names for a stats section with ``ncols`` value columns"""
+    if tag in ('FFQ', 'LFQ'):
+        return ['Cycle'] + [f'Q{quality}' for quality in range(ncols - 1)]
+    names = STATS_SECTION_COLUMNS.get(tag, [])[:ncols]
+    return names + [f'Column {i}' for i in range(len(names) + 1, ncols + 1)]
+
+
+def _typed_frame(names, matrix):
+    """Build a DataFrame from a value matrix, with integer count columns"""
+    if matrix.dtype == np.int64:
+        # Homogeneous integer matrix: one block, no per-column copies
+        return pd.DataFrame(matrix, columns=names, copy=False)
+    data = {}
+    for i, name in enumerate(names):
+        if name in STATS_FLOAT_COLUMNS:
+            data[name] = matrix[:, i]
+        else:
+            data[name] = matrix[:, i].astype(np.int64)
+    return pd.DataFrame(data)
+
+
+def _parse_numeric_section(tag, lines):
+    """Read a numeric section with NumPy's C text reader into typed columns"""
+    ncols = lines[0].count("\t")
+    names = stats_column_names(tag, ncols)
+    dtype = np.float64 if STATS_FLOAT_COLUMNS.intersection(names) else np.int64
+    try:
+        matrix = np.loadtxt(
+            lines, delimiter="\t", usecols=range(1, ncols + 1), dtype=dtype, ndmin=2
+        )
+    except ValueError:
+        # Ragged rows or unexpected values: fall back to the CSV reader
+        return _read_section_csv(tag, lines)
+    return _typed_frame(names, matrix)
+
+
+def _read_section_csv(tag, lines):
+    """Parse a section with the pandas CSV reader, tolerating ragged rows"""
+    ncols = max(line.count("\t") for line in lines)
+    frame = pd.read_csv(
+        io.StringIO("\n".join(lines)), sep="\t", header=None, names=range(ncols + 1),
+        quoting=csv.QUOTE_NONE
+    ).iloc[:, 1:]
+    frame.columns = stats_column_names(tag, ncols)
+    return frame.apply(pd.to_numeric, errors='coerce')
+
+
+def _parse_summary_numbers(lines):
+    """Parse the SN section into Metric/Value rows (values kept as text)"""
+    rows = []
+    for line in lines:
+        parts = line.split('#')[0].strip().split('\t')
+        if len(parts) >= 3:
+            rows.append((parts[1].strip(':'), parts[2].strip()))
+    return pd.DataFrame(rows, columns=['Metric', 'Value'])
+
+
+def _parse_checksums(lines):
+    """Parse the CHK section, keeping the CRC32 values as hex strings"""
+    rows = [line.split('\t')[1:4] for line in lines]
+    return pd.DataFrame(rows, columns=STATS_SECTION_COLUMNS['CHK'])
+
+
+def _parse_coverage(lines):
+    """Parse the COV section: text range labels plus integer depth/count"""
+    values = np.loadtxt(lines, delimiter="\t", usecols=(2, 3), dtype=np.int64, ndmin=2)
+    return pd.DataFrame({
+        'Range': [line.split('\t', 2)[1] for line in lines],
+        'Coverage': values[:, 0],
+        'Count': values[:, 1],
+    })
+
+
+def add_mean_quality(frame):
+    """Add a mean 'Quality' column to an FFQ/LFQ per-cycle quality histogram"""
+    quality_columns = [name for name in frame.columns if name.startswith('Q')]
+    counts = frame[quality_columns].to_numpy(dtype=np.float64)
+    qualities = np.arange(len(quality_columns), dtype=np.float64)
+    totals = counts.sum(axis=1)
+    weighted = counts @ qualities
+    mean = np.divide(weighted, totals, out=np.zeros_like(weighted), where=totals > 0)
+    frame.insert(1, 'Quality', mean)
+    return frame
+
+
+_STATS_TEXT_PARSERS = {
+    'SN': _parse_summary_numbers,
+    'CHK': _parse_checksums,
+    'COV': _parse_coverage,
+}
+
+
+def parse_stats_section(tag, lines):
+    """Parse the lines of one samtools stats section into a DataFrame"""
+    if tag in _STATS_TEXT_PARSERS:
+        frame = _STATS_TEXT_PARSERS[tag](lines)
+    else:
+        frame = _parse_numeric_section(tag, lines)
+    if tag in ('FFQ', 'LFQ'):
+        frame = add_mean_quality(frame)
+    return frame
+
+
+def parse_samtools_stats_text(text):
+    """Parse samtools stats output text into a dictionary of DataFrames.
+
+    Every section is kept with all of its columns. Numeric sections are
+    read straight into typed NumPy columns; FFQ/LFQ keep one count column
+    per quality value plus a derived mean 'Quality' per cycle.
+    """
+    return {tag: parse_stats_section(tag, lines) for tag, lines in split_stats_sections(text).items()}
+
+
+class StatsStreamParser:
+    """Parse samtools stats output line by line, as it streams from the tool.
+
+    A section is parsed as soon as the next one starts, and handed to
+    ``on_section(tag, frame)``; ``finish()`` returns every section, the
+    same as ``parse_samtools_stats_text`` on the whole text.
+    """
+
+    def __init__(self, on_section=None):
+        self.on_section = on_section
+        self.lines = {}
+        self.stats = {}
+        self.tag = None
+
+    def feed(self, line):
+        """Take one output line (with or without its newline)"""
+        line = line.rstrip("\r\n")
+        if not line or line.startswith('#'):
+            return
+        tag = line.split('\t', 1)[0]
+        if tag != self.tag:
+            self._complete()
+            self.tag = tag
+        self.lines.setdefault(tag, []).append(line)
+
+    def _complete(self):
+        if self.tag is None:
+            return
+        frame = parse_stats_section(self.tag, self.lines[self.tag])
+        self.stats[self.tag] = frame
+        if self.on_section:
+            self.on_section(self.tag, frame)
+
+    def finish(self):
+        """Parse the last section and return all sections"""
+        self._complete()
+        self.tag = None
+        return self.stats
+
+
+def parse_samtools_stats(stats_file):
+    """Parse a samtools stats output file into a dictionary of DataFrames"""
+    with open(stats_file, 'r') as f:
+        return parse_samtools_stats_text(f.read())
+
+
+# Column names of the QualiMap bamqc raw data tables. Columns beyond these
+# (e.g. the std-dev of coverage_across_reference) are named from the file's
+# own header line.
+QUALIMAP_RAW_DATA_DIR = "raw_data_qualimapReport"
+
+QUALIMAP_COLUMNS = {
+    'coverage_across_reference': ['Position', 'Coverage'],
+    'coverage_histogram': ['Coverage', 'Frequency'],
+    'duplication_rate_histogram': ['Duplication Rate', 'Count'],
+    'genome_fraction_coverage': ['Coverage', 'Genome Fraction'],
+    'homopolymer_indels': ['Type of indel', 'Number of indels'],
+    'insert_size_across_reference': ['Position', 'Insert Size'],
+    'insert_size_histogram': ['Insert Size', 'Count'],
+    'mapped_reads_gc-content_distribution': ['GC Content (%)', 'Sample'],
+    'mapped_reads_nucleotide_content': ['Position (bp)', 'A', 'C', 'G', 'T', 'N'],
+    'mapping_quality_across_reference': ['Position', 'Mapping Quality'],
+    'mapping_quality_histogram': ['Mapping Quality', 'Count'],
+}
+
+# Columns holding labels rather than numbers
+QUALIMAP_TEXT_COLUMNS = {'Type of indel'}
+
+# "<QC-passed> + <QC-failed> <metric> (<percentages>)" lines of samtools flagstat
+_FLAGSTAT_LINE = re.compile(
+    r'^(?P<passed>\d+) \+ (?P<failed>\d+) (?P<metric>.+?)(?: \((?:[\d.]+%|N/A|QC-passed).*\))?$'
+)
+
+# Progress line QualiMap bamqc logs while it walks the genome windows
+_QUALIMAP_PROGRESS_LINE = re.compile(r"Processed (\d+) out of (\d+) windows")
+
+# Bytes that start a line which is not a data row: comment and blank lines
+_NON_DATA_LINE_STARTS = np.frombuffer(b"#\n\r", dtype=np.uint8)
+
+
+def qualimap_raw_data_dir(report_dir):
+    """Directory holding the raw data tables of a QualiMap bamqc report"""
+    return os.path.join(report_dir, QUALIMAP_RAW_DATA_DIR)
+
+
+def qualimap_column_names(name, header, ncols):
+    """Column names for a raw data table with ``ncols`` columns"""
+    known = QUALIMAP_COLUMNS.get(name, [])[:ncols]
+    header_names = [column.strip() for column in header.lstrip('#').split('\t')] if header else []
+    names = known + header_names[len(known):ncols]
+    return names + [f'Column {i}' for i in range(len(names) + 1, ncols + 1)]
+
+
+def data_line_starts(raw):
+    """Offsets of the lines of ``raw`` bytes that hold data, found with NumPy"""
+    data = np.frombuffer(raw, dtype=np.uint8)
+    starts = np.concatenate(([0], np.flatnonzero(data == ord('\n')) + 1))
+    starts = starts[starts < len(data)]
+    return starts[~np.isin(data[starts], _NON_DATA_LINE_STARTS)]
+
+
+def load_qualimap_table(path, name=None):
+    """Read one QualiMap raw data file into a typed DataFrame.
+
+    Returns ``(frame, skipped_rows)``. All columns are kept; rows with too
+    many fields or non-numeric values in a numeric column are dropped and
+    counted instead of silently disappearing.
+    """
+    name = name or os.path.splitext(os.path.basename(path))[0]
+    with open(path, 'rb') as f:
+        raw = f.read()
+
+    header = next((line for line in raw.split(b'\n', 5)[:5] if line.startswith(b'#')), None)
+    header = header.decode().rstrip('\r') if header else None
+    ncols = header.count('\t') + 1 if header else 0
+    starts = data_line_starts(raw)
+    if not len(starts):
+        return pd.DataFrame(columns=qualimap_column_names(name, header, ncols)), 0
+
+    end = raw.find(b'\n', starts[0])
+    first_row = raw[starts[0]:end if end >= 0 else None]
+    ncols = max(ncols, first_row.count(b'\t') + 1)
+    names = qualimap_column_names(name, header, ncols)
+    frame = pd.read_csv(
+        io.BytesIO(raw), sep='\t', comment='#', header=None, names=names,
+        quoting=csv.QUOTE_NONE, on_bad_lines='skip'
+    )
+
+    # Columns the report always fills must be valid; extra columns may be blank
+    required = QUALIMAP_COLUMNS.get(name, names[:2])
+    coerced = [
+        column for column in names
+        if column not in QUALIMAP_TEXT_COLUMNS and frame[column].dtype == object
+    ]
+    for column in coerced:
+        frame[column] = pd.to_numeric(frame[column], errors='coerce')
+    frame = frame.dropna(subset=[column for column in names if column in required])
+    frame = frame.reset_index(drop=True)
+
+    # Bad values forced a float column; restore integers once they are gone
+    for column in coerced:
+        values = frame[column]
+        if values.notna().all() and (values % 1 == 0).all():
+            frame[column] = values.astype(np.int64)
+    return frame, len(starts) - len(frame)
+
+
+def load_qualimap_raw_data(report_dir, max_workers=None):
+    """Load every raw data table of a QualiMap bamqc report concurrently.
+
+    Returns ``(frames, skipped_rows, errors)``, each keyed by table name
+    (the file name without ``.txt``). A missing raw data directory yields
+    empty dictionaries.
+    """
+    raw_data_dir = qualimap_raw_data_dir(report_dir)
+    if not os.path.isdir(raw_data_dir):
+        return {}, {}, {}
+    paths = {
+        os.path.splitext(entry)[0]: os.path.join(raw_data_dir, entry)
+        for entry in sorted(os.listdir(raw_data_dir)) if entry.endswith('.txt')
+    }
+
+    frames, skipped, errors = {}, {}, {}
+    workers = min(max_workers or len(paths), len(paths)) or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {name: pool.submit(load_qualimap_table, path, name) for name, path in paths.items()}
+        for name, future in futures.items():
+            try:
+                frames[name], skipped[name] = future.result()
+            except Exception as e:
+                errors[name] = e
+    return frames, skipped, errors
+
+
+def parse_qualimap_progress(line):
+    """``(windows done, total windows)`` from a QualiMap log line, or None"""
+    match = _QUALIMAP_PROGRESS_LINE.search(line)
+    if match:
+        return int(match[1]), int(match[2])
+    return None
+
+
+def parse_idxstats(text):
+    """Parse samtools idxstats output into per-chromosome read counts"""
+    rows = []
+    for line in text.splitlines():
+        if line.strip():
+            parts = line.split('\t')
+            if len(parts) >= 4:
+                rows.append((parts[0], int(parts[1]), int(parts[2]), int(parts[3])))
+    df = pd.DataFrame(rows, columns=['Chromosome', 'Length', 'Mapped', 'Unmapped'])
+    df['Total_Reads'] = df['Mapped'] + df['Unmapped']
+    df['Coverage_Depth'] = df['Mapped'] / df['Length']
+    df['Mapping_Rate'] = (df['Mapped'] / df['Total_Reads']) * 100
+    return df
+
+
+def parse_header_contigs(header_text):
+    """Reference sequences of a SAM header as a list of ``(name, length)``"""
+    contigs = []
+    for line in header_text.splitlines():
+        if line.startswith('@SQ'):
+            fields = dict(field.split(':', 1) for field in line.split('\t')[1:] if ':' in field)
+            if 'SN' in fields and 'LN' in fields:
+                contigs.append((fields['SN'], int(fields['LN'])))
+    return contigs
+
+
+def parse_header_md5s(header_text):
+    """``M5`` checksums of the reference sequences of a SAM header, by sequence name"""
+    md5s = {}
+    for line in header_text.splitlines():
+        if line.startswith('@SQ'):
+            fields = dict(field.split(':', 1) for field in line.split('\t')[1:] if ':' in field)
+            if 'SN' in fields and 'M5' in fields:
+                md5s[fields['SN']] = fields['M5'].lower()
+    return md5s
+
+
+def parse_header_records(header_text, record_type):
+    """Fields of every ``@<record_type>`` line of a SAM header, as a list of dicts"""
+    records = []
+    prefix = f"@{record_type}\t"
+    for line in header_text.splitlines():
+        if line.startswith(prefix):
+            records.append(dict(field.split(':', 1) for field in line.split('\t')[1:] if ':' in field))
+    return records
+
+
+def program_chain(programs):
+    """``@PG`` records in the order they ran, following ``PP`` links from the first programs.
+
+    Files merged from several pipelines have several first programs; their
+    chains follow each other.
+    """
+    ids = {program.get('ID') for program in programs}
+    followers = {}
+    for program in programs:
+        followers.setdefault(program.get('PP') if program.get('PP') in ids else None, []).append(program)
+    chain, seen = [], set()
+    pending = list(reversed(followers.get(None, [])))
+    while pending:
+        program = pending.pop()
+        if program.get('ID') in seen:
+            continue
+        seen.add(program.get('ID'))
+        chain.append(program)
+        pending.extend(reversed(followers.get(program.get('ID'), [])))
+    # Programs on a PP cycle are never reached from a first program
+    return chain + [program for program in programs if program.get('ID') not in seen]
+
+
+def parse_flagstat(text, qc_failed=False):
+    """Parse samtools flagstat output into (metric, QC-passed count) pairs.
+
+    With ``qc_failed`` the counts include the QC-failed reads.
+    """
+    metrics = []
+    for line in text.splitlines():
+        match = _FLAGSTAT_LINE.match(line.strip())
+        if match:
+            count = int(match['passed']) + (int(match['failed']) if qc_failed else 0)
+            metrics.append((match['metric'], count))
+    return metrics
@@ -0,0 +1,236 @@
+"""Plotly figures for QualiMap and samtools stats results.
+
+Figures are built from the parsed DataFrames only, so they can be created
+by the app, by batch runs and by the command line alike.
+"""
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from downsample import downsample_frame, PLOT_MAX_POINTS
+
+# Genome-wide QualiMap plots that are downsampled and can be zoomed
+ZOOMABLE_PLOTS = (
+    'coverage_across_reference',
+    'insert_size_across_reference',
+    'mapping_quality_across_reference',
+)
+
+
+def create_all_plots(qualimap_results, max_points=PLOT_MAX_POINTS, x_ranges=None):
+    """Create plots from QualiMap results.
+
+    Genome-wide line plots are downsampled to ``max_points`` before the
+    figure is built; ``x_ranges`` maps plot names to a zoomed-in range.
+    """
+    plots = {}
+    x_ranges = x_ranges or {}
+    plot_configs = {
+        'coverage_across_reference': {
+            'type': 'line', 'x': 'Position', 'y': 'Coverage', 'downsample': True,
+            'title': "Coverage Across Reference", 'color': '#00CC96'
+        },
+        'coverage_histogram': {
+            'type': 'line', 'x': 'Coverage', 'y': 'Frequency', 'log_y': True,
+            'title': "Coverage Distribution", 'color': '#00CC96'
+        },
+        'duplication_rate_histogram': {
+            'type': 'bar', 'x': 'Duplication Rate', 'y': 'Count',
+            'title': "Duplication Rate Distribution"
+        },
+        'genome_fraction_coverage': {
+            'type': 'line', 'x': 'Coverage', 'y': 'Genome Fraction',
+            'title': "Genome Fraction Coverage", 'color': '#B6E880'
+        },
+        'homopolymer_indels': {
+            'type': 'bar', 'x': 'Type of indel', 'y': 'Number of indels',
+            'title': "Homopolymer Indels", 'color': 'Type of indel'
+        },
+        'insert_size_across_reference': {
+            'type': 'line', 'x': 'Position', 'y': 'Insert Size', 'downsample': True,
+            'title': "Insert Size Across Reference", 'color': '#636EFA'
+        },
+        'insert_size_histogram': {
+            'type': 'bar', 'x': 'Insert Size', 'y': 'Count',
+            'title': "Insert Size Distribution"
+        },
+        'mapped_reads_gc-content_distribution': {
+            'type': 'line', 'x': 'GC Content (%)', 'y': 'Sample',
+            'title': "GC Content Distribution", 'color': '#AB63FA'
+        },
+        'mapped_reads_nucleotide_content': {
+            'type': 'stacked', 'x': 'Position (bp)',
+            'cols': ['A', 'C', 'G', 'T', 'N'],
+            'title': "Nucleotide Content", 
+            'colors': ['#636EFA', '#00CC96', '#AB63FA', '#EF553B', '#FFA15A']
+        },
+        'mapping_quality_across_reference': {
+            'type': 'line', 'x': 'Position', 'y': 'Mapping Quality', 'downsample': True,
+            'title': "Mapping Quality Across Reference", 'color': '#EF553B'
+        },
+        'mapping_quality_histogram': {
+            'type': 'bar', 'x': 'Mapping Quality', 'y': 'Count',
+            'title': "Mapping Quality Distribution"
+        }
+    }
+    
+    for name, config in plot_configs.items():
+        if name in qualimap_results and not qualimap_results[name].empty:
+            df = qualimap_results[name]
+            if config.get('downsample'):
+                df = downsample_frame(df, config['x'], config['y'], max_points,
+                                      x_range=x_ranges.get(name))
+            if config['type'] == 'line':
+                fig = px.line(df, x=config['x'], y=config['y'], title=config['title'])
+                fig.update_traces(line=dict(width=2, color=config.get('color')))
+            elif config['type'] == 'bar':
+                fig = px.bar(df, x=config['x'], y=config['y'], title=config['title'],
+                            color=config.get('color', config['x']))
+            elif config['type'] == 'stacked':
+                fig = go.Figure()
+                for col, color in zip(config['cols'], config['colors']):
+                    fig.add_trace(go.Scatter(
+                        x=df[config['x']], y=df[col], name=col,
+                        line=dict(color=color), stackgroup='one'))
+                fig.update_layout(title=config['title'])
+            
+            plots[name] = apply_plot_style(fig)
+    
+    return plots
+
+
+def create_samtools_plots(stats):
+    """Create plots from samtools stats"""
+    plots = {}
+    
+    # Summary metrics
+    if 'SN' in stats:
+        df = stats['SN']
+        # Filter for key metrics
+        key_metrics = ['raw total sequences', 'reads mapped', 'reads mapped and paired', 
+                      'reads properly paired', 'average length', 'average quality',
+                      'insert size average', 'insert size standard deviation',
+                      'inward oriented pairs', 'outward oriented pairs',
+                      'pairs with other orientation', 'pairs on different chromosomes']
+        
+        filtered_df = df[df['Metric'].isin(key_metrics)].copy()
+        
+        # Convert values to numeric where possible
+        filtered_df['Value'] = pd.to_numeric(filtered_df['Value'], errors='coerce')
+        filtered_df = filtered_df.dropna(subset=['Value'])
+        
+        if not filtered_df.empty:
+            # Quick-look estimates carry a 95% interval, drawn as error bars
+            if 'CI High' in filtered_df:
+                fig = px.bar(filtered_df, x='Metric', y='Value',
+                             error_y=filtered_df['CI High'] - filtered_df['Value'],
+                             title="Key Alignment Metrics (estimates, 95% CI)")
+            else:
+                fig = px.bar(filtered_df, x='Metric', y='Value', title="Key Alignment Metrics")
+            plots['summary_metrics'] = apply_plot_style(fig)
+    
+    # First and last fragment qualities
+    if 'FFQ' in stats and 'LFQ' in stats:
+        ffq = stats['FFQ']
+        lfq = stats['LFQ']
+        
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(
+            x=ffq['Cycle'], y=ffq['Quality'],
+            name='First Fragment',
+            line=dict(color='#636EFA')
+        ))
+        fig.add_trace(go.Scatter(
+            x=lfq['Cycle'], y=lfq['Quality'],
+            name='Last Fragment',
+            line=dict(color='#EF553B')
+        ))
+        fig.update_layout(
+            title='Read Quality by Cycle',
+            xaxis_title='Cycle',
+            yaxis_title='Quality Score'
+        )
+        plots['read_quality'] = apply_plot_style(fig)
+    
+    # GC content
+    if 'GCF' in stats and 'GCL' in stats:
+        gcf = stats['GCF']
+        gcl = stats['GCL']
+        
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(
+            x=gcf['GC%'], y=gcf['Count'],
+            name='First Fragment',
+            line=dict(color='#00CC96')
+        ))
+        fig.add_trace(go.Scatter(
+            x=gcl['GC%'], y=gcl['Count'],
+            name='Last Fragment',
+            line=dict(color='#AB63FA')
+        ))
+        fig.update_layout(
+            title='GC Content Distribution',
+            xaxis_title='GC %',
+            yaxis_title='Count'
+        )
+        plots['gc_content'] = apply_plot_style(fig)
+    
+    # Insert size
+    if 'IS' in stats:
+        df = stats['IS']
+        fig = px.line(df, x='Insert Size', y='Count', title="Insert Size Distribution")
+        plots['insert_size'] = apply_plot_style(fig)
+    
+    # Read length
+    if 'RL' in stats:
+        df = stats['RL']
+        fig = px.line(df, x='Length', y='Count', title="Read Length Distribution")
+        plots['read_length'] = apply_plot_style(fig)
+    
+    # Coverage
+    if 'COV' in stats:
+        df = stats['COV']
+        fig = px.area(
+            df, x='Coverage', y='Count', title="Coverage Distribution (Area Plot)", line_shape='spline'
+        )
+        plots['coverage'] = apply_plot_style(fig)
+    
+    return plots
+
+
+def apply_plot_style(fig):
+    """Apply consistent styling with bold dark fonts for white background apps"""
+    fig.update_layout(
+        paper_bgcolor='white',  # White background for paper
+        plot_bgcolor='rgba(240,240,240,0.9)',  # Light gray plot area
+        font=dict(
+            color='#222222',          # Very dark gray text (almost black)
+            family='Arial Black',     # Bold font family
+            size=14
+        ),
+        xaxis=dict(
+            gridcolor='rgba(0,0,0,0.1)',  # Light grid lines
+            title_font=dict(size=14, color='#222222', family='Arial Black'),
+            tickfont=dict(size=13, color='#222222', family='Arial Black')
+        ),
+        yaxis=dict(
+            gridcolor='rgba(0,0,0,0.1)',
+            title_font=dict(size=14, color='#222222', family='Arial Black'),
+            tickfont=dict(size=13, color='#222222', family='Arial Black')
+        ),
+        hovermode='x unified',
+        margin=dict(l=50, r=50, b=50, t=70)
+    )
+    return fig
+
+
+def save_plotly_figure(fig, path, format='html'):
+    """Save plotly figure in multiple formats"""
+    if format == 'html':
+        fig.write_html(path)
+    elif format == 'png':
+        fig.write_image(path)
+    elif format == 'svg':
+        fig.write_image(path, format='svg')
+    elif format == 'pdf':
+        fig.write_image(path, format='pdf')
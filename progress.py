@@ -0,0 +1,131 @@
+"""Live progress of long-running tools, for the step table and partial plots.
+
+samtools stats reports nothing until it has read the whole file, so the
+file is fed to it through a pipe and the bytes written so far measure its
+progress. Bytes are spread over the contigs in proportion to their reads
+(idxstats, when an index exists) or to their lengths (header), which
+gives the reads processed and the current contig. QualiMap reports the
+windows it has processed on its own output. Tool output is parsed while
+it streams in, so finished stats sections are available before the tool
+exits.
+
+A ``ToolProgress`` is written by one scheduler worker thread and read by
+the UI thread; every access goes through its lock.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from parsers import parse_header_contigs, parse_idxstats
+from tools import samtools_header, samtools_idxstats
+
+
+def contig_layout(file_path, indexed=False):
+    """``(names, weights, total_reads)`` used to map progress onto contigs.
+
+    With an index the weights are the reads per contig, unplaced unmapped
+    reads last, and ``total_reads`` is known; otherwise the weights are the
+    contig lengths from the header and ``total_reads`` is None.
+    """
+    if indexed:
+        chromosome_stats = parse_idxstats(samtools_idxstats(file_path))
+        counts = chromosome_stats['Total_Reads']
+        return list(chromosome_stats['Chromosome']), counts.to_numpy(dtype=np.float64), int(counts.sum())
+    contigs = parse_header_contigs(samtools_header(file_path))
+    return [name for name, _ in contigs], np.array([length for _, length in contigs], dtype=np.float64), None
+
+
+def format_duration(seconds):
+    """Short human-readable duration, e.g. '45 s', '3 min' or '1.5 h'"""
+    if seconds < 90:
+        return f"{seconds:.0f} s"
+    if seconds < 5400:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+
+def file_progress(file_path):
+    """Progress measured in bytes of ``file_path`` fed to a tool"""
+    return ToolProgress(total=os.path.getsize(file_path))
+
+
+class ToolProgress:
+    """Progress of one running tool: work done, current contig, ETA and parsed sections"""
+
+    def __init__(self, total=None, unit="bytes"):
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self.started = None
+        self.contigs = None
+        self.cumulative = None
+        self.total_reads = None
+        self.sections = {}
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def set_contigs(self, names, weights, total_reads=None):
+        """Lay the contigs out along the work, in file order"""
+        with self._lock:
+            self.contigs = list(names)
+            cumulative = np.cumsum(weights)
+            self.cumulative = cumulative / cumulative[-1] if len(cumulative) and cumulative[-1] else None
+            self.total_reads = total_reads
+
+    def advance(self, amount):
+        """Record ``amount`` more units of work done"""
+        with self._lock:
+            if self.started is None:
+                self.started = time.monotonic()
+            self.done += amount
+
+    def set_done(self, done, total=None):
+        """Record the work done so far (and the total, once the tool reports it)"""
+        with self._lock:
+            if self.started is None:
+                self.started = time.monotonic()
+            self.done = done
+            if total:
+                self.total = total
+
+    def add_section(self, tag, frame):
+        """Store a section parsed from the output while the tool runs"""
+        with self._lock:
+            self.sections[tag] = frame
+            self.version += 1
+
+    def snapshot(self):
+        """``(version, sections)`` parsed so far, safe to use from another thread"""
+        with self._lock:
+            return self.version, dict(self.sections)
+
+    def fraction(self):
+        """Fraction of the work done, or None if the total is unknown"""
+        with self._lock:
+            return self._fraction()
+
+    def _fraction(self):
+        if not self.total:
+            return None
+        return min(1.0, self.done / self.total)
+
+    def describe(self):
+        """One line for the step table: percent, reads, contig and ETA"""
+        with self._lock:
+            fraction = self._fraction()
+            if fraction is None:
+                return f"{self.done:,} {self.unit}" if self.done else ""
+            parts = [f"{fraction:.0%}"]
+            if self.total_reads is not None:
+                parts.append(f"≈{fraction * self.total_reads:,.0f} reads")
+            elif self.unit != "bytes":
+                parts.append(f"{self.done:,}/{self.total:,} {self.unit}")
+            if self.cumulative is not None and fraction < 1:
+                index = int(np.searchsorted(self.cumulative, fraction, side='right'))
+                parts.append(self.contigs[min(index, len(self.contigs) - 1)])
+            if self.started is not None and 0 < fraction < 1:
+                elapsed = time.monotonic() - self.started
+                parts.append(f"ETA {format_duration(elapsed * (1 - fraction) / fraction)}")
+            return " · ".join(parts)
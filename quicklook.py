@@ -0,0 +1,213 @@
+"""Quick look: estimated flagstat and samtools stats numbers in seconds.
+
+``samtools view -s`` would still decompress every block of the file, so
+the sample is taken through the index instead: evenly spread windows
+across the genome. The windows are dealt into interleaved groups and every
+group runs through flagstat and samtools stats on its own. Each group
+extrapolates the counts to the whole genome; the mean over the groups is
+the estimate and their spread gives its standard error (the random-groups
+variance estimator), so every number comes with a confidence interval.
+Reads that are unmapped and have no position are never sampled.
+"""
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from analysis import require_step
+from parsers import parse_flagstat, parse_header_contigs, parse_samtools_stats_text
+from regions import region_string, write_regions
+from result_cache import get_tool_versions, make_cache_key
+from scheduler import DEFAULT_THREADS, DONE, Scheduler
+from tools import samtools_faidx, samtools_flagstat, samtools_header, samtools_index, samtools_stats
+
+# Windows read per quick look, their size, and the groups they are dealt into
+QUICK_LOOK_WINDOWS = int(os.environ.get("BAMCRAM_QUICK_LOOK_WINDOWS", 256))
+QUICK_LOOK_WINDOW_BASES = 100_000
+QUICK_LOOK_GROUPS = 8
+
+# SN metrics that are counts and scale with the sampled fraction; the
+# others (averages, rates, maxima) are estimated as they are
+SN_COUNT_PREFIXES = (
+    'raw total sequences', 'filtered sequences', 'sequences', '1st fragments', 'last fragments',
+    'reads ', 'non-primary alignments', 'supplementary alignments', 'total length',
+    'total first fragment length', 'total last fragment length', 'bases ',
+    'inward oriented pairs', 'outward oriented pairs', 'pairs with other orientation',
+    'pairs on different chromosomes',
+)
+
+# Two-sided 95% Student t quantiles where the expansion below is too far off
+T_CRITICAL_95 = {1: 12.7062, 2: 4.3027, 3: 3.1824, 4: 2.7764, 5: 2.5706, 6: 2.4469, 7: 2.3646}
+
+
+def t_critical_95(df):
+    """Two-sided 95% Student t quantile (tabulated, then Cornish-Fisher: within 0.25% for df >= 8)"""
+    if df in T_CRITICAL_95:
+        return T_CRITICAL_95[df]
+    z = 1.959964
+    return z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+
+
+def sample_windows(contigs, n_windows=QUICK_LOOK_WINDOWS, window_bases=QUICK_LOOK_WINDOW_BASES):
+    """Evenly spread 1-based ``(contig, start, end)`` windows over the contigs laid end to end"""
+    genome_length = sum(length for _, length in contigs)
+    if genome_length <= n_windows * window_bases:
+        return [(name, 1, length) for name, length in contigs if length]
+
+    windows = []
+    contig_starts = np.cumsum([0] + [length for _, length in contigs])
+    for i in range(n_windows):
+        center = int((i + 0.5) * genome_length / n_windows)
+        index = int(np.searchsorted(contig_starts, center, side='right')) - 1
+        name, length = contigs[index]
+        position = center - contig_starts[index]
+        start = max(1, position - window_bases // 2)
+        end = min(length, start + window_bases - 1)
+        windows.append((name, int(start), int(end)))
+    return windows
+
+
+def group_windows(windows, groups=QUICK_LOOK_GROUPS):
+    """Deal windows into interleaved groups, so each group spans the whole genome"""
+    groups = max(1, min(groups, len(windows)))
+    return [windows[i::groups] for i in range(groups)]
+
+
+def windows_length(windows):
+    """Bases covered by non-overlapping windows"""
+    return sum(end - start + 1 for _, start, end in windows)
+
+
+def quick_look_cache_key(is_cram, alignment_key, reference_key=""):
+    """Result cache key of a quick look, separate from the full analysis"""
+    return make_cache_key(
+        "quick", "cram" if is_cram else "bam", alignment_key, reference_key,
+        QUICK_LOOK_WINDOWS, QUICK_LOOK_WINDOW_BASES, QUICK_LOOK_GROUPS, *get_tool_versions()
+    )
+
+
+def group_stats_step(file_path, workdir, windows, reference_path=None, name="stats"):
+    """samtools stats over a list of windows, read through the index"""
+    stats_file = os.path.join(workdir, f"quick_{name}.txt")
+    stats_text = samtools_stats(file_path, stats_file, reference_path,
+                                regions=[region_string(window) for window in windows])
+    return stats_text, parse_samtools_stats_text(stats_text)
+
+
+def plan_quick_look(file_path, workdir, reference_path=None, index_ready=False,
+                    reference_indexed=False, threads=DEFAULT_THREADS, n_windows=QUICK_LOOK_WINDOWS,
+                    window_bases=QUICK_LOOK_WINDOW_BASES):
+    """Scheduler sampling the file, plus the genome length and group layout.
+
+    Returns ``(scheduler, genome_length, groups)``. Every group gets a
+    flagstat and a stats step; one more stats step over all windows feeds
+    the distribution plots.
+    """
+    contigs = parse_header_contigs(samtools_header(file_path))
+    genome_length = sum(length for _, length in contigs)
+    windows = sample_windows(contigs, n_windows, window_bases)
+    groups = group_windows(windows)
+
+    scheduler = Scheduler(max_cpus=threads)
+    deps = []
+    if not index_ready:
+        scheduler.add("index", lambda: samtools_index(file_path, threads), cpus=threads,
+                      label="samtools index")
+        deps.append("index")
+    if reference_path and not reference_indexed:
+        scheduler.add("faidx", lambda: samtools_faidx(reference_path), label="samtools faidx")
+        deps.append("faidx")
+
+    for index, group in enumerate(groups):
+        _, bed_path = write_regions(group, workdir, name=f"quick_group_{index}")
+        scheduler.add(f"flagstat_{index}",
+                      lambda bed_path=bed_path: samtools_flagstat(file_path, 1, bed_path, reference_path),
+                      deps=deps, label=f"samtools flagstat (sample {index + 1}/{len(groups)})")
+        scheduler.add(f"stats_{index}",
+                      lambda group=group, index=index: group_stats_step(
+                          file_path, workdir, group, reference_path, f"group_{index}"),
+                      deps=deps, label=f"samtools stats (sample {index + 1}/{len(groups)})")
+    scheduler.add("stats", lambda: group_stats_step(file_path, workdir, windows, reference_path),
+                  deps=deps, label="samtools stats (all samples)")
+    return scheduler, genome_length, groups
+
+
+def group_estimates(table):
+    """Estimate, standard error and 95% interval per row of a metric x group table"""
+    values = table.to_numpy(dtype=np.float64)
+    n_groups = values.shape[1]
+    estimate = values.mean(axis=1)
+    if n_groups > 1:
+        stderr = values.std(axis=1, ddof=1) / math.sqrt(n_groups)
+        margin = t_critical_95(n_groups - 1) * stderr
+    else:
+        stderr = margin = np.full(len(values), np.nan)
+    return pd.DataFrame({
+        'Metric': table.index, 'Value': estimate, 'Std. Error': stderr,
+        'CI Low': estimate - margin, 'CI High': estimate + margin,
+    })
+
+
+def is_count_metric(metric):
+    """Whether an SN metric is a count that scales with the sampled fraction"""
+    return metric.startswith(SN_COUNT_PREFIXES)
+
+
+def collect_quick_look(steps, genome_length, groups):
+    """Results of a finished quick look: estimates plus the sampled stats for plots"""
+    results = {'errors': [], 'warnings': []}
+    if 'index' in steps:
+        require_step(steps['index'], "❌ Failed to index the file")
+
+    flagstat_columns, sn_columns = {}, {}
+    for index, group in enumerate(groups):
+        flagstat_text = require_step(steps[f"flagstat_{index}"], "❌ Failed to run samtools flagstat")
+        sn = None
+        if steps[f"stats_{index}"].state == DONE:
+            sn = steps[f"stats_{index}"].result[1].get('SN')
+        values = pd.Series(dtype=np.float64)
+        if sn is not None and not sn.empty:
+            values = pd.Series(pd.to_numeric(sn['Value'], errors='coerce').to_numpy(), index=sn['Metric'])
+
+        # A window also catches the reads that start up to a read length
+        # before it, so its effective length is window + read length - 1
+        read_length = values.get('average length', 0)
+        read_length = 0 if pd.isna(read_length) else read_length
+        scale = genome_length / sum(end - start + read_length for _, start, end in group)
+
+        flagstat_columns[index] = pd.Series(
+            {metric: count * scale for metric, count in parse_flagstat(flagstat_text)}
+        )
+        if len(values):
+            sn_columns[index] = values * np.where(values.index.map(is_count_metric), scale, 1.0)
+
+    sampled = windows_length([window for group in groups for window in group])
+    quick_look = {
+        'fraction': sampled / genome_length if genome_length else 1.0,
+        'windows': sum(len(group) for group in groups),
+        'groups': len(groups),
+        'flagstat': group_estimates(pd.DataFrame(flagstat_columns)),
+    }
+
+    if steps['stats'].state == DONE:
+        results['stats_text'], results['stats'] = steps['stats'].result
+        if sn_columns:
+            sn_table = pd.DataFrame(sn_columns).dropna(how='all')
+            results['stats']['SN'] = group_estimates(sn_table)
+    else:
+        results['errors'].append("samtools stats failed on the sample")
+        results['stats'] = {}
+    results['quick_look'] = quick_look
+    return results
+
+
+def quick_look(file_path, workdir, reference_path=None, index_ready=False, reference_indexed=False,
+               threads=DEFAULT_THREADS, on_update=None, n_windows=QUICK_LOOK_WINDOWS,
+               window_bases=QUICK_LOOK_WINDOW_BASES):
+    """Run a quick look at one BAM/CRAM file and return its estimates"""
+    scheduler, genome_length, groups = plan_quick_look(
+        file_path, workdir, reference_path, index_ready, reference_indexed, threads,
+        n_windows, window_bases
+    )
+    return collect_quick_look(scheduler.run(on_update=on_update), genome_length, groups)
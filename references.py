@@ -0,0 +1,191 @@
+"""Server-side registry of reference genomes, stored and indexed once.
+
+A reference FASTA is registered once under a name: it is kept in
+``REFERENCES_DIR`` next to its ``.fai`` index, with a manifest of its
+sequences' names, lengths and MD5s (the ``M5`` tags of CRAM ``@SQ`` header
+lines). Each sequence is also written to an MD5-keyed cache in htslib's
+``REF_CACHE`` layout, and ``install`` points samtools' ``REF_PATH`` and
+``REF_CACHE`` at it, so CRAM files decode from local sequences instead of
+an upload or a download from the EBI reference server.
+
+A CRAM's reference is resolved from its header: the registered reference
+holding every ``M5`` of its ``@SQ`` lines or, for headers without ``M5``
+tags, every contig name and length.
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from hashlib import md5
+
+from tools import samtools_faidx
+
+REFERENCES_DIR = os.environ.get(
+    "BAMCRAM_REFERENCES_DIR",
+    os.path.join(os.path.expanduser("~"), ".local", "share", "bamcram_analyzer", "references")
+)
+
+# htslib's path template for MD5-keyed sequences: 2 characters, 2 more, the rest
+REF_CACHE_TEMPLATE = "%2s/%2s/%s"
+
+# Where htslib downloads missing sequences from when REF_PATH is not set
+EBI_REF_PATH = "http://www.ebi.ac.uk/ena/cram/md5/%s"
+
+REFERENCE_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+# Sequence bytes as the M5 tag hashes them: upper case, whitespace removed
+_UPPER_CASE = bytes.maketrans(b"abcdefghijklmnopqrstuvwxyz", b"ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+_WHITESPACE = b" \t\r\n\v\f"
+
+
+class ReferenceRegistry:
+    """Named reference genomes with their .fai index, manifest and MD5 sequence cache"""
+
+    def __init__(self, references_dir=REFERENCES_DIR):
+        self.references_dir = references_dir
+        self.fasta_dir = os.path.join(references_dir, "fasta")
+        self.cache_dir = os.path.join(references_dir, "md5")
+        os.makedirs(self.fasta_dir, exist_ok=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def fasta_path(self, name):
+        return os.path.join(self.fasta_dir, f"{name}.fa")
+
+    def _manifest_path(self, name):
+        return os.path.join(self.fasta_dir, f"{name}.json")
+
+    def names(self):
+        """Registered references, sorted by name"""
+        return sorted(
+            entry[:-len(".json")] for entry in os.listdir(self.fasta_dir)
+            if entry.endswith(".json") and not entry.startswith(".")
+        )
+
+    def manifest(self, name):
+        """Sequences and registration details of a reference, or None if it is not registered"""
+        try:
+            with open(self._manifest_path(name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _cache_file(self, checksum):
+        return os.path.join(self.cache_dir, checksum[:2], checksum[2:4], checksum[4:])
+
+    def _cache_sequences(self, fasta_path):
+        """Write every sequence to the MD5 cache; returns ``[(name, length, md5), ...]``"""
+        sequences = []
+        name = out = digest = None
+        length = 0
+
+        def finish():
+            if out is None:
+                return
+            out.close()
+            checksum = digest.hexdigest()
+            cache_file = self._cache_file(checksum)
+            if os.path.exists(cache_file):
+                os.remove(out.name)
+            else:
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                os.replace(out.name, cache_file)
+            sequences.append((name, length, checksum))
+
+        with open(fasta_path, "rb") as fasta:
+            for line in fasta:
+                if line.startswith(b">"):
+                    finish()
+                    name = line[1:].split(None, 1)[0].decode()
+                    out = tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix=".", delete=False)
+                    digest, length = md5(), 0
+                    continue
+                if out is None:
+                    continue
+                bases = line.translate(_UPPER_CASE, _WHITESPACE)
+                digest.update(bases)
+                out.write(bases)
+                length += len(bases)
+            finish()
+        return sequences
+
+    def add(self, name, fasta_path, move=False):
+        """Register a FASTA under ``name`` and return its stored path.
+
+        The file is copied (or moved, for staged uploads) into the registry,
+        indexed and its sequences cached by MD5; an existing reference of the
+        same name is replaced.
+        """
+        if not REFERENCE_NAME.match(name):
+            raise ValueError(f"Invalid reference name '{name}': use letters, digits, '.', '_' and '-'")
+        stored_path = self.fasta_path(name)
+        fd, tmp_path = tempfile.mkstemp(dir=self.fasta_dir, prefix=".", suffix=".fa")
+        os.close(fd)
+        try:
+            if move:
+                shutil.move(fasta_path, tmp_path)
+            else:
+                shutil.copyfile(fasta_path, tmp_path)
+            sequences = self._cache_sequences(tmp_path)
+            if not sequences:
+                raise ValueError(f"No sequences found in {os.path.basename(fasta_path)}")
+            os.replace(tmp_path, stored_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        samtools_faidx(stored_path)
+
+        manifest = {
+            'name': name, 'source': os.path.basename(fasta_path), 'added': time.time(),
+            'size': os.path.getsize(stored_path), 'sequences': sequences,
+        }
+        tmp_manifest = self._manifest_path(f".{name}")
+        with open(tmp_manifest, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_manifest, self._manifest_path(name))
+        return stored_path
+
+    def remove(self, name):
+        """Unregister a reference; its cached sequences stay for other references sharing them"""
+        for path in (self._manifest_path(name), self.fasta_path(name), self.fasta_path(name) + ".fai"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def resolve(self, header_text):
+        """Name of the registered reference an alignment header was made against, or None"""
+        # parsers pulls in pandas, which listing references on the landing page does not need
+        from parsers import parse_header_contigs, parse_header_md5s
+
+        md5s = set(parse_header_md5s(header_text).values())
+        contigs = set(parse_header_contigs(header_text))
+        if not md5s and not contigs:
+            return None
+        for name in self.names():
+            manifest = self.manifest(name)
+            if manifest is None:
+                continue
+            sequences = manifest['sequences']
+            if md5s and md5s <= {checksum for _, _, checksum in sequences}:
+                return name
+            if not md5s and contigs <= {(seq_name, length) for seq_name, length, _ in sequences}:
+                return name
+        return None
+
+    def environment(self, environ=None):
+        """``REF_PATH`` and ``REF_CACHE`` values that let htslib find registered sequences.
+
+        The registry cache goes first on an existing ``REF_PATH``; without
+        one, htslib's default download location stays as the fallback.
+        """
+        environ = os.environ if environ is None else environ
+        local = os.path.join(self.cache_dir, REF_CACHE_TEMPLATE)
+        ref_path = environ.get("REF_PATH") or EBI_REF_PATH
+        if local not in ref_path.split(":"):
+            ref_path = f"{local}:{ref_path}"
+        return {'REF_PATH': ref_path, 'REF_CACHE': environ.get("REF_CACHE") or local}
+
+    def install(self):
+        """Point the samtools processes started from now on at the registry's sequences"""
+        os.environ.update(self.environment())
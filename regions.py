@@ -0,0 +1,137 @@
+"""Target regions: restricting an analysis to a gene panel or a few contigs.
+
+Regions come from a ``chr:start-end`` list or a BED file and are kept as
+merged ``(contig, start, end)`` tuples with 1-based, inclusive coordinates,
+the convention of samtools region strings. The tools read them through the
+alignment index, so only the BGZF/CRAM blocks overlapping the regions are
+decoded instead of the whole file.
+"""
+import hashlib
+import os
+import re
+
+# End used for whole-contig regions such as "chr1"; samtools clamps it to the contig
+CONTIG_END = 2 ** 31 - 1
+
+# Above this many regions samtools stats gets its reads through a region view
+# instead of region arguments, which would overflow the command line
+MAX_REGION_ARGS = 1000
+
+_REGION_PATTERN = re.compile(r'^(?P<contig>[^\s:]+)(?::(?P<start>[\d,]+)(?:-(?P<end>[\d,]+))?)?$')
+_REGION_SEPARATORS = re.compile(r'[\s;]+')
+_BED_HEADER_PREFIXES = ('#', 'track', 'browser')
+
+
+def parse_region(text):
+    """Parse ``chr``, ``chr:pos`` or ``chr:start-end`` into a region tuple"""
+    match = _REGION_PATTERN.match(text.strip())
+    if not match:
+        raise ValueError(f"Invalid region '{text}': expected chr, chr:start or chr:start-end")
+    contig = match['contig']
+    start = int(match['start'].replace(',', '')) if match['start'] else 1
+    if match['end']:
+        end = int(match['end'].replace(',', ''))
+    else:
+        end = start if match['start'] else CONTIG_END
+    if start < 1 or end < start:
+        raise ValueError(f"Invalid region '{text}': start must be >= 1 and <= end")
+    return contig, start, end
+
+
+def parse_region_list(text):
+    """Parse regions separated by whitespace, newlines or semicolons"""
+    return [parse_region(item) for item in _REGION_SEPARATORS.split(text) if item]
+
+
+def parse_bed(text):
+    """Parse BED lines (0-based, half-open) into 1-based inclusive regions"""
+    regions = []
+    for line_number, line in enumerate(text.splitlines(), 1):
+        if not line.strip() or line.startswith(_BED_HEADER_PREFIXES):
+            continue
+        fields = line.split('\t') if '\t' in line else line.split()
+        try:
+            contig, start, end = fields[0], int(fields[1]), int(fields[2])
+        except (IndexError, ValueError):
+            raise ValueError(f"Invalid BED line {line_number}: {line.strip()}") from None
+        if start < 0 or end <= start:
+            raise ValueError(f"Invalid BED line {line_number}: start must be >= 0 and < end")
+        regions.append((contig, start + 1, end))
+    return regions
+
+
+def merge_regions(regions):
+    """Sort regions and merge the ones that overlap or touch.
+
+    Contigs keep the order in which they first appear. Merging keeps reads
+    spanning two listed regions from being counted twice.
+    """
+    contig_order = {}
+    for contig, _, _ in regions:
+        contig_order.setdefault(contig, len(contig_order))
+
+    merged = []
+    for contig, start, end in sorted(regions, key=lambda r: (contig_order[r[0]], r[1], r[2])):
+        if merged and merged[-1][0] == contig and start <= merged[-1][2] + 1:
+            merged[-1] = (contig, merged[-1][1], max(merged[-1][2], end))
+        else:
+            merged.append((contig, start, end))
+    return merged
+
+
+def load_regions(region_text="", bed_text=""):
+    """Merged regions from a region list and/or BED text; empty if neither is given"""
+    regions = []
+    if region_text and region_text.strip():
+        regions += parse_region_list(region_text)
+    if bed_text and bed_text.strip():
+        regions += parse_bed(bed_text)
+    return merge_regions(regions)
+
+
+def region_string(region):
+    """samtools region argument of a region tuple"""
+    contig, start, end = region
+    if start == 1 and end == CONTIG_END:
+        return contig
+    return f"{contig}:{start}-{end}"
+
+
+def regions_length(regions):
+    """Total number of bases in merged regions, or None if a whole contig is included"""
+    if any(end == CONTIG_END for _, _, end in regions):
+        return None
+    return sum(end - start + 1 for _, start, end in regions)
+
+
+def regions_key(regions):
+    """Cache key part identifying a set of merged regions"""
+    canonical = "\n".join(region_string(region) for region in regions)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def clamp_regions(regions, contigs):
+    """Regions cut to the contig lengths of a header, dropping unknown contigs"""
+    lengths = dict(contigs)
+    clamped = []
+    for contig, start, end in regions:
+        length = lengths.get(contig)
+        if length and start <= length:
+            clamped.append((contig, start, min(end, length)))
+    return clamped
+
+
+def write_regions(regions, workdir, name="regions"):
+    """Write the region files the tools read and return ``(targets_path, bed_path)``.
+
+    The targets file is the 1-based, inclusive ``chr start end`` list of
+    ``samtools stats -t``; the BED file (0-based, six columns) feeds
+    ``samtools view -L`` and QualiMap's ``-gff``.
+    """
+    targets_path = os.path.join(workdir, f"{name}.targets.txt")
+    bed_path = os.path.join(workdir, f"{name}.bed")
+    with open(targets_path, 'w') as targets, open(bed_path, 'w') as bed:
+        for index, (contig, start, end) in enumerate(regions, 1):
+            targets.write(f"{contig}\t{start}\t{end}\n")
+            bed.write(f"{contig}\t{start - 1}\t{end}\tregion_{index}\t0\t+\n")
+    return targets_path, bed_path
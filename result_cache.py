@@ -0,0 +1,182 @@
+"""Persistent, content-addressed cache for BAM/CRAM analysis results.
+
+Entries are keyed by a hash of the input file contents, the reference
+contents and the versions of the tools that produced them, so a Streamlit
+rerun (or a re-upload of the same file) never re-runs samtools/QualiMap.
+"""
+import hashlib
+import os
+import pickle
+import re
+import subprocess
+import tempfile
+import threading
+from functools import lru_cache
+
+CACHE_DIR = os.environ.get(
+    "BAMCRAM_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "bamcram_analyzer")
+)
+CACHE_MAX_BYTES = int(os.environ.get("BAMCRAM_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+
+# Bump when the layout of cached result dicts changes
+CACHE_SCHEMA_VERSION = 3
+
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Commands used to identify each external tool's version
+TOOL_VERSION_COMMANDS = {
+    'samtools': ["samtools", "--version"],
+    'qualimap': ["qualimap", "--help"],
+}
+
+
+def hash_stream(stream, chunk_size=HASH_CHUNK_SIZE):
+    """Return the SHA-256 hex digest of a binary stream, read in chunks"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_file(path, chunk_size=HASH_CHUNK_SIZE):
+    """Return the SHA-256 hex digest of a file on disk"""
+    with open(path, "rb") as f:
+        return hash_stream(f, chunk_size)
+
+
+@lru_cache(maxsize=None)
+def get_tool_version(tool):
+    """Return a version string for an external tool (cached per process)"""
+    try:
+        result = subprocess.run(
+            TOOL_VERSION_COMMANDS.get(tool, [tool, "--version"]),
+            capture_output=True, text=True, timeout=60
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return f"{tool} unavailable"
+    for line in (result.stdout + result.stderr).splitlines():
+        if re.search(r"\d+\.\d+", line):
+            return line.strip()
+    return f"{tool} unknown"
+
+
+def get_tool_versions(tools=("samtools", "qualimap")):
+    """Return the version strings of several tools as a tuple"""
+    return tuple(get_tool_version(tool) for tool in tools)
+
+
+def make_cache_key(*parts):
+    """Combine content hashes, versions and options into one cache key"""
+    digest = hashlib.sha256(f"schema={CACHE_SCHEMA_VERSION}".encode())
+    for part in parts:
+        digest.update(b"\0")
+        digest.update(str(part).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Size-bounded on-disk LRU cache of pickled analysis results.
+
+    Each entry is a single ``<key>.pkl`` file. Reading an entry refreshes its
+    modification time, and the least recently used entries are evicted once
+    the directory grows past ``max_bytes``.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def get(self, key):
+        """Return the cached value for ``key`` or None on a miss"""
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            value = None
+        except Exception:
+            # Truncated or incompatible entry: drop it and recompute
+            self._remove(path)
+            value = None
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store ``value`` under ``key`` and evict old entries if needed"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._entry_path(key))
+        except Exception:
+            self._remove(tmp_path)
+            raise
+        self.evict(keep=key)
+
+    def __contains__(self, key):
+        return os.path.exists(self._entry_path(key))
+
+    def _entries(self):
+        """Return (mtime, size, path) for every entry, oldest first"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st_info = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st_info.st_mtime, st_info.st_size, path))
+        entries.sort()
+        return entries
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until under the size budget"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        keep_path = self._entry_path(keep) if keep else None
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        """Remove every cached entry"""
+        for _, _, path in self._entries():
+            self._remove(path)
+
+    def stats(self):
+        """Return hit/miss counters and current disk usage"""
+        entries = self._entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(entries),
+            'size_bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,203 @@
+"""Columnar store of analysis results: Parquet tables partitioned by sample.
+
+The result cache keeps pickles for a while and evicts them; this store
+keeps every completed analysis as typed tables that reopen through a
+memory map without re-parsing any tool output, and that can be queried
+across samples. Each table is a hive-partitioned Parquet dataset::
+
+    <store>/<table>/sample=<cache key>/part-0.parquet
+
+with the tables ``samples`` (name, kind, save time), ``summary`` (every
+samtools stats SN and flagstat number, numeric, for queries),
+``stats_<SECTION>`` (each samtools stats section), ``qualimap_<table>``,
+``idxstats`` and ``texts`` (raw tool output and result metadata). A
+sample's ``samples`` row is written last, so half-written samples are
+never listed. Queries filter the partitions with pyarrow.dataset and read
+only the columns they need.
+
+pyarrow is optional: without it ``ResultStore.available`` is False and
+nothing is stored.
+"""
+import json
+import operator
+import os
+import tempfile
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = ds = pq = None
+
+from parsers import parse_flagstat, parse_idxstats
+
+STORE_DIR = os.environ.get(
+    "BAMCRAM_STORE_DIR",
+    os.path.join(os.path.expanduser("~"), ".local", "share", "bamcram_analyzer", "results")
+)
+
+PART_FILE = "part-0.parquet"
+
+# Comparisons accepted by ``ResultStore.query``
+QUERY_OPERATORS = {
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+    '==': operator.eq, '!=': operator.ne,
+}
+
+# Raw texts stored alongside the tables, restored under the same result keys
+TEXT_KEYS = ('flagstat_text', 'stats_text', 'idxstats_text')
+
+
+def summary_table(results):
+    """Every SN and flagstat number of a result as Metric/Value/Source rows"""
+    frames = []
+    sn = results.get('stats', {}).get('SN')
+    if sn is not None and not sn.empty:
+        frames.append(pd.DataFrame({
+            'Metric': sn['Metric'],
+            'Value': pd.to_numeric(sn['Value'], errors='coerce'),
+            'Source': 'stats',
+        }))
+    if results.get('flagstat_text'):
+        flagstat = parse_flagstat(results['flagstat_text'])
+        frames.append(pd.DataFrame({
+            'Metric': [metric for metric, _ in flagstat],
+            'Value': [float(count) for _, count in flagstat],
+            'Source': 'flagstat',
+        }))
+    if not frames:
+        return pd.DataFrame({'Metric': [], 'Value': [], 'Source': []})
+    return pd.concat(frames, ignore_index=True)
+
+
+def result_tables(name, kind, results):
+    """Split a results dictionary into the store's tables"""
+    tables = {
+        'samples': pd.DataFrame({'Name': [name], 'Kind': [kind], 'Saved': [pd.Timestamp.now()]}),
+        'summary': summary_table(results),
+    }
+    for tag, frame in results.get('stats', {}).items():
+        tables[f"stats_{tag}"] = frame
+    for table_name, frame in (results.get('qualimap_results') or {}).items():
+        tables[f"qualimap_{table_name}"] = frame
+    if results.get('idxstats_text'):
+        tables['idxstats'] = parse_idxstats(results['idxstats_text'])
+
+    meta = {
+        key: results[key]
+        for key in ('errors', 'warnings', 'regions', 'qualimap_skipped_rows', 'stats_shards')
+        if key in results
+    }
+    texts = [(key, results[key]) for key in TEXT_KEYS if results.get(key)]
+    texts.append(('meta', json.dumps(meta)))
+    tables['texts'] = pd.DataFrame(texts, columns=['Key', 'Text'])
+    return tables
+
+
+class ResultStore:
+    """Per-sample Parquet tables of completed analyses, keyed by result cache key"""
+
+    available = pa is not None
+
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+        if self.available:
+            os.makedirs(self.store_dir, exist_ok=True)
+
+    def _part_path(self, table, key):
+        return os.path.join(self.store_dir, table, f"sample={key}", PART_FILE)
+
+    def _write(self, table, key, frame, schema=None):
+        """Write one table partition atomically"""
+        path = self._part_path(table, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Dot files are invisible to dataset scans until they are renamed
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+        os.close(fd)
+        try:
+            pq.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False), tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def save(self, key, name, kind, results):
+        """Store a completed analysis; ``kind`` is 'bam' or 'cram'"""
+        if not self.available:
+            return
+        tables = result_tables(name, kind, results)
+        samples = tables.pop('samples')
+        summary_schema = pa.schema([('Metric', pa.string()), ('Value', pa.float64()),
+                                    ('Source', pa.string())])
+        for table, frame in tables.items():
+            self._write(table, key, frame, summary_schema if table == 'summary' else None)
+        self._write('samples', key, samples)
+
+    def __contains__(self, key):
+        return self.available and os.path.exists(self._part_path('samples', key))
+
+    def _read(self, table, key):
+        return pq.read_table(self._part_path(table, key), memory_map=True).to_pandas()
+
+    def load(self, key):
+        """Reopen a stored analysis as a results dictionary, or None if it is not stored"""
+        if key not in self:
+            return None
+        results = {'stats': {}, 'qualimap_results': {}}
+        for table in os.listdir(self.store_dir):
+            if not os.path.exists(self._part_path(table, key)):
+                continue
+            if table.startswith('stats_'):
+                results['stats'][table[len('stats_'):]] = self._read(table, key)
+            elif table.startswith('qualimap_'):
+                results['qualimap_results'][table[len('qualimap_'):]] = self._read(table, key)
+
+        texts = self._read('texts', key)
+        texts = dict(zip(texts['Key'], texts['Text']))
+        results.update(json.loads(texts.pop('meta', '{}')))
+        results.update(texts)
+        if 'regions' in results:
+            results['regions'] = [tuple(region) for region in results['regions']]
+        if not results['qualimap_results']:
+            del results['qualimap_results']
+        return results
+
+    def _dataset(self, table):
+        partitioning = ds.partitioning(pa.schema([('sample', pa.string())]), flavor='hive')
+        return ds.dataset(os.path.join(self.store_dir, table), format='parquet',
+                          partitioning=partitioning)
+
+    def samples(self):
+        """Stored samples, newest first, with their cache key in 'Sample'"""
+        if not self.available or not os.path.isdir(os.path.join(self.store_dir, 'samples')):
+            return pd.DataFrame(columns=['Sample', 'Name', 'Kind', 'Saved'])
+        frame = self._dataset('samples').to_table().to_pandas().rename(columns={'sample': 'Sample'})
+        return frame[['Sample', 'Name', 'Kind', 'Saved']].sort_values('Saved', ascending=False,
+                                                                        ignore_index=True)
+
+    def metrics(self):
+        """Metric names that can be queried, in first-seen order"""
+        if not self.available or not os.path.isdir(os.path.join(self.store_dir, 'summary')):
+            return []
+        return list(pd.unique(self._dataset('summary').to_table(columns=['Metric'])['Metric'].to_pandas()))
+
+    def query(self, metric, op, value):
+        """Samples whose ``metric`` compares to ``value`` (e.g. '<', 90), read column by column.
+
+        Returns Name, Sample, Value and Source rows; only the Metric and
+        Value columns of the summary tables are scanned.
+        """
+        if op not in QUERY_OPERATORS:
+            raise ValueError(f"Unknown operator '{op}': expected one of {', '.join(QUERY_OPERATORS)}")
+        samples = self.samples()
+        if samples.empty:
+            return pd.DataFrame(columns=['Name', 'Sample', 'Value', 'Source'])
+        condition = (ds.field('Metric') == metric) & QUERY_OPERATORS[op](ds.field('Value'), value)
+        matches = self._dataset('summary').to_table(
+            columns=['sample', 'Value', 'Source'], filter=condition
+        ).to_pandas().rename(columns={'sample': 'Sample'})
+        # Only samples whose 'samples' row exists are complete
+        return samples[['Sample', 'Name']].merge(matches, on='Sample')[['Name', 'Sample', 'Value', 'Source']]
@@ -0,0 +1,377 @@
+"""Dependency-aware scheduler for running analysis tools concurrently.
+
+Each tool invocation is a ``Step`` with a list of dependencies and a CPU /
+memory request. Steps whose dependencies have finished are started on a
+thread pool as long as the total CPU and memory budgets allow it, so
+independent tools (flagstat, stats, index -> QualiMap) overlap instead of
+running back to back. The tools are external processes, so threads are
+enough to keep every core busy.
+
+Every scheduler in the process also draws from one ``ResourceGovernor``,
+so concurrent sessions, jobs and cohort samples together stay within the
+machine's (or container's) CPUs and memory and a maximum number of JVMs.
+"""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from tools import QUALIMAP_JAVA_MEM, java_mem_to_mb
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+FINISHED_STATES = (DONE, FAILED, SKIPPED)
+
+
+# Container limits (cgroup v2, then v1); the machine's totals do not apply inside one
+CGROUP_MEMORY_LIMITS = ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes")
+CGROUP_CPU_LIMIT = "/sys/fs/cgroup/cpu.max"
+
+# Share of the memory limit handed to tools; the rest is left to the app itself
+MEMORY_BUDGET_SHARE = 0.9
+
+
+def read_limit(path):
+    """First field of a cgroup limit file as an int, or None if absent or unlimited"""
+    try:
+        with open(path) as f:
+            fields = f.read().split()
+        return int(fields[0]) if fields and fields[0].isdigit() else None
+    except OSError:
+        return None
+
+
+def total_memory_mb():
+    """Return the memory available to this process in MB, or None if unknown.
+
+    That is the physical memory, or the container's limit when it is lower.
+    """
+    try:
+        physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 1024 ** 2
+    except (AttributeError, ValueError, OSError):
+        physical = None
+    limits = [limit // 1024 ** 2 for limit in map(read_limit, CGROUP_MEMORY_LIMITS) if limit]
+    limits = [limit for limit in limits if physical is None or limit < physical]
+    return min(limits) if limits else physical
+
+
+def total_cpus():
+    """CPUs this process may use: the affinity mask, capped by a container CPU quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open(CGROUP_CPU_LIMIT) as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def default_memory_budget_mb():
+    """Memory budget of the tools when BAMCRAM_MAX_MEMORY_MB is not set"""
+    total = total_memory_mb()
+    return int(total * MEMORY_BUDGET_SHARE) if total else None
+
+
+MAX_CPUS = int(os.environ.get("BAMCRAM_MAX_CPUS", 0)) or total_cpus()
+MAX_MEMORY_MB = int(os.environ.get("BAMCRAM_MAX_MEMORY_MB", 0)) or default_memory_budget_mb()
+
+# QualiMap JVMs running at once, whatever memory is left
+MAX_JVMS = int(os.environ.get("BAMCRAM_MAX_JVMS", 2))
+
+# Threads handed out to the tools of one analysis, capped by MAX_CPUS
+DEFAULT_THREADS = min(int(os.environ.get("BAMCRAM_THREADS", MAX_CPUS)), MAX_CPUS)
+
+
+def max_parallel_samples():
+    """Samples analyzed at once: bounded by cores and by QualiMap JVM memory"""
+    workers = int(os.environ.get("BAMCRAM_BATCH_WORKERS", 0)) or MAX_CPUS
+    if MAX_MEMORY_MB:
+        workers = min(workers, MAX_MEMORY_MB // java_mem_to_mb(QUALIMAP_JAVA_MEM))
+    return max(1, min(workers, MAX_CPUS))
+
+
+def split_thread_budget(budget, weights):
+    """Divide a thread budget between steps in proportion to their weights.
+
+    Every step gets at least one thread. Steps that never overlap can share
+    threads, so callers pass the weights of the steps that run together.
+    """
+    total = sum(weights.values())
+    return {
+        name: max(1, int(budget * weight // total))
+        for name, weight in weights.items()
+    }
+
+
+class Step:
+    """A single unit of work in the scheduler's DAG"""
+
+    def __init__(self, name, func, deps=(), cpus=1, mem_mb=0, label=None, progress=None, jvm=False):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.cpus = cpus
+        self.mem_mb = mem_mb
+        self.jvm = jvm
+        self.label = label or name
+        # Optional live progress the step's tool reports (see progress.ToolProgress)
+        self.progress = progress
+        self.state = PENDING
+        self.result = None
+        self.error = None
+        self.started = None
+        self.finished = None
+        # Resource the step is queued for in the governor ('CPUs', 'memory', 'JVM slot')
+        self.waiting_for = None
+
+    @property
+    def wall_time(self):
+        """Seconds spent running so far (or in total once finished)"""
+        if self.started is None:
+            return None
+        return (self.finished or time.monotonic()) - self.started
+
+    def __repr__(self):
+        return f"Step({self.name!r}, state={self.state!r})"
+
+
+class ResourceRequest:
+    """Resources one step holds, or waits for, in a ``ResourceGovernor``"""
+
+    def __init__(self, cpus, mem_mb, jvm, label=""):
+        self.cpus = cpus
+        self.mem_mb = mem_mb
+        self.jvm = jvm
+        self.label = label
+        self.requested = time.monotonic()
+        self.blocked = None
+
+
+class ResourceGovernor:
+    """Process-wide CPU, memory and JVM budget shared by every scheduler.
+
+    Requests are served oldest first: resources an older request is waiting
+    for are held back for it, and younger requests may only use what is
+    left over, so a QualiMap JVM is never starved by a stream of small
+    samtools steps. Oversized requests are capped to the budget, so they
+    run alone instead of never.
+    """
+
+    def __init__(self, max_cpus=None, max_mem_mb=None, max_jvms=None):
+        self.max_cpus = max(1, max_cpus or MAX_CPUS)
+        self.max_mem_mb = max_mem_mb if max_mem_mb is not None else MAX_MEMORY_MB
+        self.max_jvms = max(1, max_jvms or MAX_JVMS)
+        self.used_cpus = self.used_mem_mb = self.used_jvms = 0
+        self.waiting = []
+        self.grants = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+
+    def request(self, cpus=1, mem_mb=0, jvm=False, label=""):
+        """Queue a request; poll ``try_acquire`` with it until it is granted"""
+        if self.max_mem_mb:
+            mem_mb = min(mem_mb, self.max_mem_mb)
+        request = ResourceRequest(min(cpus, self.max_cpus), mem_mb, jvm, label)
+        with self._lock:
+            self.waiting.append(request)
+        return request
+
+    def try_acquire(self, request):
+        """Grant a queued request if it fits next to the running and older waiting ones"""
+        with self._lock:
+            free_cpus = self.max_cpus - self.used_cpus
+            free_mem = self.max_mem_mb - self.used_mem_mb if self.max_mem_mb else None
+            free_jvms = self.max_jvms - self.used_jvms
+            for older in self.waiting:
+                if older is request:
+                    break
+                free_cpus -= older.cpus
+                free_jvms -= older.jvm
+                if free_mem is not None:
+                    free_mem -= older.mem_mb
+
+            if request.cpus > free_cpus:
+                request.blocked = "CPUs"
+            elif free_mem is not None and request.mem_mb > free_mem:
+                request.blocked = "memory"
+            elif request.jvm and free_jvms < 1:
+                request.blocked = "JVM slot"
+            else:
+                request.blocked = None
+                self.waiting.remove(request)
+                self.used_cpus += request.cpus
+                self.used_mem_mb += request.mem_mb
+                self.used_jvms += request.jvm
+                waited = time.monotonic() - request.requested
+                self.grants += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+                return True
+            return False
+
+    def release(self, request):
+        """Return the resources of a granted request"""
+        with self._lock:
+            self.used_cpus -= request.cpus
+            self.used_mem_mb -= request.mem_mb
+            self.used_jvms -= request.jvm
+
+    def cancel(self, request):
+        """Withdraw a request that is still waiting"""
+        with self._lock:
+            if request in self.waiting:
+                self.waiting.remove(request)
+
+    def stats(self):
+        """Current usage and the waits of granted requests so far"""
+        with self._lock:
+            return {
+                'used_cpus': self.used_cpus, 'max_cpus': self.max_cpus,
+                'used_mem_mb': self.used_mem_mb, 'max_mem_mb': self.max_mem_mb,
+                'used_jvms': self.used_jvms, 'max_jvms': self.max_jvms,
+                'waiting': len(self.waiting), 'grants': self.grants,
+                'mean_wait': self.total_wait / self.grants if self.grants else 0.0,
+                'max_wait': self.max_wait,
+            }
+
+
+# The one governor of this process, shared by every scheduler
+GOVERNOR = ResourceGovernor()
+
+
+class Scheduler:
+    """Run a DAG of steps in parallel within a CPU and memory budget.
+
+    Steps must be added after their dependencies, which keeps the graph
+    acyclic. Insertion order doubles as priority: when several steps are
+    ready, earlier ones are started first, so add the critical path early.
+    """
+
+    def __init__(self, max_cpus=None, max_mem_mb=None, poll_interval=0.5, governor=None):
+        self.max_cpus = max(1, max_cpus or MAX_CPUS)
+        self.max_mem_mb = max_mem_mb if max_mem_mb is not None else MAX_MEMORY_MB
+        self.poll_interval = poll_interval
+        self.governor = governor or GOVERNOR
+        self.steps = {}
+
+    def add(self, name, func, deps=(), cpus=1, mem_mb=0, label=None, progress=None, jvm=False):
+        """Register a step; ``func`` is called with no arguments.
+
+        ``jvm`` marks steps that start a JVM, which the governor caps separately.
+        """
+        if name in self.steps:
+            raise ValueError(f"Duplicate step name: {name}")
+        missing = [dep for dep in deps if dep not in self.steps]
+        if missing:
+            raise ValueError(f"Step {name} depends on unknown steps: {', '.join(missing)}")
+        step = Step(name, func, deps, cpus, mem_mb, label, progress, jvm)
+        self.steps[name] = step
+        return step
+
+    def _step_mem(self, step):
+        """Memory a step is accounted for: its request, capped to the budget like the governor does"""
+        return min(step.mem_mb, self.max_mem_mb) if self.max_mem_mb else step.mem_mb
+
+    def _fits(self, step, used_cpus, used_mem):
+        """Check whether a step fits next to the currently running ones"""
+        if used_cpus + min(step.cpus, self.max_cpus) > self.max_cpus:
+            return False
+        if self.max_mem_mb and used_mem + self._step_mem(step) > self.max_mem_mb:
+            return False
+        return True
+
+    def run(self, on_update=None):
+        """Run every step and return the steps keyed by name.
+
+        ``on_update`` is called from the calling thread with the list of
+        steps whenever a step changes state, and every ``poll_interval``
+        seconds while steps are running, so callers can safely update a UI.
+        Step exceptions are stored on the step instead of being raised; steps
+        that depend on a failed step are skipped.
+        """
+        steps = list(self.steps.values())
+        pending = list(steps)
+        running = {}
+        requests = {}
+        used_cpus = used_mem = 0
+
+        def notify():
+            if on_update:
+                on_update(steps)
+
+        try:
+            # Leaving the pool waits for running steps, so their resources are released after
+            with ThreadPoolExecutor(max_workers=max(1, len(steps))) as pool:
+                while pending or running:
+                    for step in list(pending):
+                        dep_states = [self.steps[dep].state for dep in step.deps]
+                        if any(state in (FAILED, SKIPPED) for state in dep_states):
+                            step.state = SKIPPED
+                            step.error = "dependency failed"
+                            pending.remove(step)
+                            continue
+                        if not all(state == DONE for state in dep_states):
+                            continue
+                        # An oversized step may still run alone
+                        if running and not self._fits(step, used_cpus, used_mem):
+                            continue
+
+                        # Other schedulers of this process share the governor's budget
+                        if step not in requests:
+                            requests[step] = self.governor.request(
+                                min(step.cpus, self.max_cpus), step.mem_mb, step.jvm, step.label
+                            )
+                        if not self.governor.try_acquire(requests[step]):
+                            step.waiting_for = requests[step].blocked
+                            continue
+
+                        step.waiting_for = None
+                        step.state = RUNNING
+                        step.started = time.monotonic()
+                        running[pool.submit(step.func)] = step
+                        used_cpus += min(step.cpus, self.max_cpus)
+                        used_mem += self._step_mem(step)
+                        pending.remove(step)
+
+                    notify()
+                    if not running:
+                        if not pending:
+                            break
+                        if not any(step in requests for step in pending):
+                            raise RuntimeError("Scheduler deadlock: no runnable steps")
+                        # Everything runnable waits for resources held by other analyses
+                        time.sleep(self.poll_interval)
+                        continue
+
+                    done, _ = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        step = running.pop(future)
+                        step.finished = time.monotonic()
+                        used_cpus -= min(step.cpus, self.max_cpus)
+                        used_mem -= self._step_mem(step)
+                        self.governor.release(requests.pop(step))
+                        try:
+                            step.result = future.result()
+                            step.state = DONE
+                        except Exception as e:
+                            step.error = e
+                            step.state = FAILED
+        finally:
+            for step in pending:
+                if step in requests:
+                    self.governor.cancel(requests.pop(step))
+            for step in running.values():
+                self.governor.release(requests.pop(step))
+
+        notify()
+        return self.steps
@@ -0,0 +1,346 @@
+"""Sharded samtools stats and coverage: whole contigs in parallel, merged exactly.
+
+samtools stats reads a file as one stream on one core. With an index the
+file is cut into shards of whole contigs instead, each read through the
+index by its own samtools processes (``samtools view -u file contigs... |
+samtools stats -``, teed into ``samtools flagstat -``), and the shards'
+reports are added back together.
+Contigs are packed into shards longest first, weighed by their reads
+(idxstats) or, before the index exists, their lengths; the unplaced
+unmapped reads ('*') ride along in one of them. Shards never split a
+contig, so coverage runs and read pairs are never cut and the merge stays
+exact; the largest contig bounds the wall-clock time.
+
+The merge reproduces what samtools stats prints for the whole file. Count
+sections (RL, FRL, LRL, MAPQ, ID, IC, FFQ/LFQ, MPC, FTC/LTC, COV) are summed.
+GCF/GCL are expanded from samtools' run-length printing back to their
+bins, summed and compressed again. Shards print their whole insert size
+histogram (``-m 1``), so the main-bulk cutoff and the SN insert size
+average and deviation are applied to the sum. CHK sums the CRC32s modulo
+2^32. SN counts are summed and the averages and rates recomputed from
+them. Base content per cycle (GCC, GCT, FBC, LBC) is printed as
+percentages, which are averaged weighted by each shard's bases at that
+cycle, so it matches to print precision only. GCD holds percentiles of
+depth per window and cannot be combined; merged reports leave it out.
+Both are noted in the merged report and, through ``stats_shards`` in the
+analysis results, next to the plots.
+flagstat counts are summed and its percentages recomputed, which is exact.
+
+Native coverage shards read their depths with ``samtools depth``, whose
+processes run side by side (pysam would hold the GIL of this one), and
+their accumulators are added up, which is exact.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from coverage_engine import accumulate_coverage
+from parsers import parse_flagstat, parse_header_contigs, parse_samtools_stats_text
+from progress import contig_layout
+from regions import CONTIG_END
+from tools import samtools_header, samtools_scan
+
+# idxstats/samtools view name of the unplaced unmapped reads
+UNPLACED = "*"
+
+# samtools stats: GC content bins, and the share of pairs in the insert size main bulk (-m)
+GC_BINS = 200
+INSERT_SIZE_MAIN_BULK = 0.99
+
+# Sections in the order samtools stats prints them
+STATS_SECTION_ORDER = ('CHK', 'SN', 'FFQ', 'LFQ', 'MPC', 'GCF', 'GCL', 'GCC', 'GCT', 'FBC', 'FTC', 'LBC',
+                       'LTC', 'IS', 'RL', 'FRL', 'LRL', 'MAPQ', 'ID', 'IC', 'COV')
+
+# Per-cycle base content sections and the quality histograms counting their bases
+BASE_CONTENT_WEIGHTS = {'GCC': ('FFQ', 'LFQ'), 'GCT': ('FFQ', 'LFQ'), 'FBC': ('FFQ',), 'LBC': ('LFQ',)}
+
+# What a merged report lacks next to an unsharded one, shown with sharded results
+SHARDED_STATS_CAVEAT = ("GC-depth (GCD) is left out, and per-cycle base content (GCC, GCT, FBC, LBC) "
+                        "may differ from an unsharded run by up to 0.01 percentage points")
+
+# flagstat metrics printed with a percentage, and the metric it is a percentage of
+FLAGSTAT_PERCENT_OF = {
+    'mapped': 'in total', 'primary mapped': 'primary',
+    'properly paired': 'paired in sequencing', 'singletons': 'paired in sequencing',
+}
+
+# SN metrics that are not summed over the shards
+SN_MAXIMA = ('maximum length', 'maximum first fragment length', 'maximum last fragment length')
+SN_DERIVED = (
+    'is sorted', 'error rate', 'average length', 'average first fragment length',
+    'average last fragment length', 'average quality', 'insert size average',
+    'insert size standard deviation', 'percentage of properly paired reads (%)',
+)
+
+def pack_shards(names, weights, n_shards):
+    """Deal contigs into at most ``n_shards`` shards of similar weight, heaviest first.
+
+    Contigs without weight are left out; each shard lists its contigs in
+    their original (file) order.
+    """
+    shards = [[] for _ in range(max(1, n_shards))]
+    loads = np.zeros(len(shards))
+    for index in sorted(range(len(names)), key=lambda i: -weights[i]):
+        if weights[index] <= 0:
+            continue
+        lightest = int(np.argmin(loads))
+        shards[lightest].append(index)
+        loads[lightest] += weights[index]
+    return [[names[index] for index in sorted(shard)] for shard in shards if shard]
+
+
+def stats_shards(file_path, n_shards, indexed=False):
+    """Contig lists of the samtools stats shards, balanced on reads (or lengths without an index)"""
+    names, weights, _ = contig_layout(file_path, indexed)
+    if not indexed:
+        # How many reads are unplaced is unknown until the index exists
+        names, weights = names + [UNPLACED], np.append(weights, 1)
+    return pack_shards(names, weights, n_shards)
+
+
+def coverage_shards(file_path, n_shards):
+    """Contig lists of the coverage shards, balanced on contig lengths"""
+    contigs = parse_header_contigs(samtools_header(file_path))
+    return pack_shards([name for name, _ in contigs], [length for _, length in contigs], n_shards)
+
+
+def shard_label(contigs):
+    """Short description of a shard's contigs, e.g. 'chr1' or 'chr5 +3'"""
+    return contigs[0] if len(contigs) == 1 else f"{contigs[0]} +{len(contigs) - 1}"
+
+
+def stats_shard_step(file_path, workdir, contigs, reference_path=None, name="shard_0"):
+    """Parsed samtools stats and flagstat text of whole contigs, read once through the index"""
+    stats_text, flagstat_text = samtools_scan(
+        file_path, os.path.join(workdir, f"samtools_stats_{name}.txt"),
+        os.path.join(workdir, f"samtools_flagstat_{name}.txt"), reference_path, contigs=contigs,
+        insert_size_bulk=1
+    )
+    return parse_samtools_stats_text(stats_text), flagstat_text
+
+
+def coverage_shard_step(file_path, workdir, contigs, reference_path=None, name="shard_0"):
+    """Coverage accumulator of whole contigs, from a samtools depth process of their own"""
+    regions = [(contig, 1, CONTIG_END) for contig in contigs]
+    return accumulate_coverage(file_path, workdir, regions, reference_path, reader='samtools',
+                               name=f"coverage_{name}")
+
+
+def merge_coverage(accumulators):
+    """QualiMap-shaped coverage tables of the shards' accumulators added up"""
+    merged = accumulators[0]
+    for accumulator in accumulators[1:]:
+        merged.merge(accumulator)
+    return merged.frames()
+
+
+def _format_row(tag, values):
+    return "\t".join([tag, *map(str, values)])
+
+
+def _merge_checksums(frames):
+    sums = [0, 0, 0]
+    for frame in frames:
+        for i, value in enumerate(frame.iloc[0]):
+            sums[i] = (sums[i] + int(value, 16)) % 2 ** 32
+    return [_format_row('CHK', [f"{value:08x}" for value in sums])]
+
+
+def _summed(frames, key):
+    """Rows of ``frames`` added up on ``key``, missing columns counting as zero"""
+    merged = pd.concat(frames, ignore_index=True).fillna(0).groupby(key, sort=True).sum()
+    return merged.reset_index().astype(np.int64)
+
+
+def _quality_histogram(frames):
+    """Summed FFQ/LFQ counts, one column per quality, without the derived mean"""
+    merged = _summed([frame.drop(columns='Quality') for frame in frames], 'Cycle')
+    qualities = sorted(merged.columns[1:], key=lambda name: int(name[1:]))
+    return merged[['Cycle', *qualities]]
+
+
+def _merge_gc_content(tag, frames):
+    """GCF/GCL: samtools prints runs of equal bins at their midpoint and leaves the last run out"""
+    bins = np.zeros(GC_BINS, dtype=np.int64)
+    for frame in frames:
+        start = 0
+        for gc, count in zip(frame['GC%'], frame['Count']):
+            end = int(round(gc * (GC_BINS - 1) / 50)) - start
+            bins[start:end] += count
+            start = end
+    lines = []
+    start = 0
+    for end in range(GC_BINS):
+        if bins[end] == bins[start]:
+            continue
+        lines.append(f"{tag}\t{(end + start) * 0.5 * 100 / (GC_BINS - 1):.2f}\t{bins[start]}")
+        start = end
+    return lines
+
+
+def _merge_base_content(tag, frames, parts):
+    """Per-cycle percentages averaged weighted by each shard's bases at that cycle"""
+    columns = [name for name in frames[0].columns if name != 'Cycle']
+    weighted = []
+    for frame, part in zip(frames, parts):
+        weights = np.zeros(len(frame))
+        for source in BASE_CONTENT_WEIGHTS[tag]:
+            if source in part:
+                histogram = part[source]
+                bases = histogram.drop(columns=['Cycle', 'Quality']).sum(axis=1).set_axis(histogram['Cycle'])
+                weights += bases.reindex(frame['Cycle']).fillna(0).to_numpy()
+        rows = frame[columns].mul(weights, axis=0)
+        rows['Cycle'] = frame['Cycle'].to_numpy()
+        rows['Bases'] = weights
+        weighted.append(rows)
+    merged = pd.concat(weighted, ignore_index=True).groupby('Cycle', sort=True).sum()
+    merged = merged[merged['Bases'] > 0]
+    percentages = merged[columns].div(merged['Bases'], axis=0)
+    return [
+        "\t".join([tag, str(cycle), *(f"{value:.2f}" for value in row)])
+        for cycle, row in zip(merged.index, percentages.to_numpy())
+    ]
+
+
+def _merge_insert_sizes(frames):
+    """IS lines of the summed histogram cut to the main bulk, plus the bulk's mean and deviation"""
+    merged = _summed(frames, 'Insert Size')
+    sizes = merged['Insert Size'].to_numpy()
+    pairs = merged['Count'].to_numpy()
+    if not pairs.sum():
+        return [], 0.0, 0.0
+    bulk = np.cumsum(pairs)
+    end = int(np.argmax(bulk / bulk[-1] > INSERT_SIZE_MAIN_BULK)) + 1
+    sizes, pairs, bulk_pairs = sizes[:end], pairs[:end], bulk[end - 1]
+    average = (sizes * pairs).sum() / bulk_pairs
+    # samtools leaves insert size 0 out of the deviation, but not out of the mean
+    deviation = np.sqrt((pairs[1:] * (sizes[1:] - average) ** 2 / bulk_pairs).sum())
+    lines = [_format_row('IS', row) for row in merged.iloc[:end].itertuples(index=False)]
+    return lines, average, deviation
+
+
+def _ratio(numerator, denominator, single=False):
+    """``numerator / denominator`` or 0, in C float precision with ``single``"""
+    if not denominator:
+        return 0.0
+    if single:
+        return float(np.float32(numerator) / np.float32(denominator))
+    return numerator / denominator
+
+
+def _merge_summary(frames, quality_sum, insert_size, flagstat_text=None):
+    """SN lines: counts summed, maxima kept, averages and rates recomputed like samtools"""
+    values = pd.concat(
+        [pd.to_numeric(frame['Value'], errors='coerce').set_axis(frame['Metric']) for frame in frames],
+        axis=1
+    )
+    sn = {}
+    for metric, row in values.iterrows():
+        if metric in SN_MAXIMA:
+            sn[metric] = int(row.max())
+        elif metric not in SN_DERIVED:
+            sn[metric] = int(row.sum())
+    if flagstat_text and 'pairs on different chromosomes' in sn:
+        # samtools halves the reads whose mate is on another contig; a shard
+        # holds one of the mates, so the shards' halves lose the odd ones
+        flagstat = dict(parse_flagstat(flagstat_text, qc_failed=True))
+        if 'with mate mapped to a different chr' in flagstat:
+            sn['pairs on different chromosomes'] = flagstat['with mate mapped to a different chr'] // 2
+
+    reads = sn.get('sequences', 0)
+    insert_size_average, insert_size_deviation = insert_size
+    sn.update({
+        'is sorted': int(values.loc['is sorted'].min()) if 'is sorted' in values.index else 1,
+        'error rate': f"{_ratio(sn.get('mismatches', 0), sn.get('bases mapped (cigar)', 0), True):e}",
+        'average length': f"{_ratio(sn.get('total length', 0), reads, True):.0f}",
+        'average first fragment length':
+            f"{_ratio(sn.get('total first fragment length', 0), sn.get('1st fragments', 0)):.0f}",
+        'average last fragment length':
+            f"{_ratio(sn.get('total last fragment length', 0), sn.get('last fragments', 0)):.0f}",
+        'average quality': f"{_ratio(quality_sum, sn.get('total length', 0)):.1f}",
+        'insert size average': f"{insert_size_average:.1f}",
+        'insert size standard deviation': f"{insert_size_deviation:.1f}",
+        'percentage of properly paired reads (%)':
+            f"{_ratio(100 * sn.get('reads properly paired', 0), reads, True):.1f}",
+    })
+    return [f"SN\t{metric}:\t{sn[metric]}" for metric in values.index]
+
+
+def merge_stats(parts, flagstat_text=None):
+    """samtools stats text of the whole file, from the parsed reports of its contig shards.
+
+    ``parts`` come from shards run with ``-m 1`` (see ``stats_shard_step``).
+    flagstat's count of mates on other contigs, when given, fixes the pairs
+    on different chromosomes, which the shards can only report rounded down.
+    """
+    parts = [part for part in parts if part]
+    sections = {tag: [part[tag] for part in parts if tag in part] for tag in STATS_SECTION_ORDER}
+    sections = {tag: frames for tag, frames in sections.items() if frames}
+
+    quality = {tag: _quality_histogram(sections[tag]) for tag in ('FFQ', 'LFQ') if tag in sections}
+    quality_sum = sum(
+        (histogram.iloc[:, 1:].to_numpy() @ np.arange(histogram.shape[1] - 1, dtype=np.float64)).sum()
+        for histogram in quality.values()
+    )
+    insert_size_lines, *insert_size = _merge_insert_sizes(sections.get('IS', []))
+
+    lines = [f"# samtools stats merged from {len(parts)} contig shards", f"# {SHARDED_STATS_CAVEAT}"]
+    for tag, frames in sections.items():
+        if tag == 'CHK':
+            lines += _merge_checksums(frames)
+        elif tag == 'SN':
+            lines += _merge_summary(frames, quality_sum, insert_size, flagstat_text)
+        elif tag in quality:
+            lines += [_format_row(tag, row) for row in quality[tag].itertuples(index=False)]
+        elif tag in ('GCF', 'GCL'):
+            lines += _merge_gc_content(tag, frames)
+        elif tag in BASE_CONTENT_WEIGHTS:
+            lines += _merge_base_content(tag, frames, [part for part in parts if tag in part])
+        elif tag in ('FTC', 'LTC'):
+            lines.append(_format_row(tag, pd.concat(frames).sum().astype(np.int64)))
+        elif tag == 'IS':
+            lines += insert_size_lines
+        elif tag == 'COV':
+            merged = pd.concat(frames).groupby(['Coverage', 'Range'], sort=True)['Count'].sum()
+            lines += [f"COV\t{label}\t{coverage}\t{count}" for (coverage, label), count in merged.items()]
+        else:
+            merged = _summed(frames, frames[0].columns[0])
+            lines += [_format_row(tag, row) for row in merged.itertuples(index=False)]
+    return "\n".join(lines) + "\n"
+
+
+def _flagstat_percent(count, total):
+    """A flagstat percentage, computed in C float precision like samtools"""
+    return f"{_ratio(count, total, True) * 100:.2f}%" if total else "N/A"
+
+
+def merge_flagstat(texts):
+    """samtools flagstat text of the whole file, from the flagstat texts of its contig shards.
+
+    Every count adds up over shards of disjoint reads; the percentages are
+    recomputed from the sums.
+    """
+    passed, failed = {}, {}
+    for text in texts:
+        for (metric, passed_count), (_, total_count) in zip(parse_flagstat(text),
+                                                             parse_flagstat(text, qc_failed=True)):
+            passed[metric] = passed.get(metric, 0) + passed_count
+            failed[metric] = failed.get(metric, 0) + total_count - passed_count
+    lines = []
+    for metric in passed:
+        line = f"{passed[metric]} + {failed[metric]} {metric}"
+        if metric == 'in total':
+            line += " (QC-passed reads + QC-failed reads)"
+        elif FLAGSTAT_PERCENT_OF.get(metric) in passed:
+            of = FLAGSTAT_PERCENT_OF[metric]
+            line += (f" ({_flagstat_percent(passed[metric], passed[of])} : "
+                     f"{_flagstat_percent(failed[metric], failed[of])})")
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def merged_stats_result(parts, flagstat_text=None):
+    """``(stats_text, stats)`` of merged shards, like an unsharded samtools stats step"""
+    stats_text = merge_stats(parts, flagstat_text)
+    return stats_text, parse_samtools_stats_text(stats_text)
@@ -0,0 +1,20 @@
+import shutil
+
+import pytest
+
+from synthetic import write_synthetic_bam
+
+requires_samtools = pytest.mark.skipif(shutil.which("samtools") is None, reason="samtools is not installed")
+
+
+@pytest.fixture(scope="session")
+def bam_path(tmp_path_factory):
+    """A small indexed paired-end BAM over two contigs"""
+    path = tmp_path_factory.mktemp("bam") / "sample.bam"
+    return write_synthetic_bam(str(path), 2000, threads=1, contigs=(("chr1", 200_000), ("chr2", 100_000)))
+
+
+@pytest.fixture
+def unindexed_bam(bam_path, tmp_path):
+    """A copy of the BAM without its index"""
+    return shutil.copy(bam_path, tmp_path / "unindexed.bam")
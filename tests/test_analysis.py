@@ -0,0 +1,39 @@
+import subprocess
+
+import pytest
+
+import analysis
+from analysis import AnalysisError, analyze_sample, flagstat_rerun
+from conftest import requires_samtools
+from tools import samtools_flagstat
+
+
+def failing_scan(*args, **kwargs):
+    raise subprocess.CalledProcessError(1, ["samtools", "stats"], stderr="stats crashed")
+
+
+@requires_samtools
+def test_stats_failure_keeps_flagstat(bam_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(analysis, "samtools_scan", failing_scan)
+    results = analyze_sample(bam_path, str(tmp_path), index_ready=True, threads=1, coverage_engine='native')
+    assert results['flagstat_text'] == samtools_flagstat(bam_path)
+    assert results['stats'] == {}
+    assert results['errors'] == ["samtools stats failed with error: stats crashed"]
+
+
+@requires_samtools
+def test_flagstat_rerun_failure_aborts(bam_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(analysis, "samtools_scan", failing_scan)
+    monkeypatch.setattr(analysis, "samtools_flagstat", failing_scan)
+    with pytest.raises(AnalysisError, match="samtools flagstat"):
+        analyze_sample(bam_path, str(tmp_path), index_ready=True, threads=1, coverage_engine='native')
+
+
+@requires_samtools
+def test_flagstat_rerun_covers_the_regions_only(bam_path, tmp_path):
+    regions = [("chr1", 1, 50_000)]
+    flagstat_text = flagstat_rerun(bam_path, str(tmp_path), threads=1, regions=regions)()
+    bed_path = tmp_path / "expected.bed"
+    bed_path.write_text("chr1\t0\t50000\n")
+    assert flagstat_text == samtools_flagstat(bam_path, 1, str(bed_path))
+    assert flagstat_text != samtools_flagstat(bam_path)
@@ -0,0 +1,27 @@
+import pytest
+
+from jobs import JobQueue, QueueFull
+
+
+def failing_stage(job):
+    raise OSError("No space left on device")
+
+
+def test_failed_staging_leaves_no_active_job(tmp_path):
+    queue = JobQueue(str(tmp_path), max_workers=1, max_queued=5)
+    with pytest.raises(OSError):
+        queue.create_staged("sample.bam", failing_stage, "key")
+    assert queue.find_active("key") is None
+    assert queue.queued() == 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_failed_staging_frees_its_queue_slot(tmp_path):
+    queue = JobQueue(str(tmp_path), max_workers=1, max_queued=1)
+    with pytest.raises(OSError):
+        queue.create_staged("sample.bam", failing_stage, "key")
+    job, _ = queue.create_staged("sample.bam", lambda job: None, "key")
+    assert queue.queued() == 1
+    with pytest.raises(QueueFull):
+        queue.create("other.bam", "other")
+    queue.discard(job)
@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from bench_stats_parser import parse_samtools_stats_linewise, write_wgs_like_stats
+from conftest import requires_samtools
+from parsers import load_qualimap_raw_data, load_qualimap_table, parse_samtools_stats, qualimap_raw_data_dir
+from tools import samtools_stats
+
+# Sections the line-by-line parser read in full, with the columns it kept
+LINEWISE_COLUMNS = {
+    'SN': ['Metric', 'Value'], 'GCF': ['GC%', 'Count'], 'GCL': ['GC%', 'Count'],
+    'IS': ['Insert Size', 'Count'], 'RL': ['Length', 'Count'],
+}
+
+
+def assert_matches_linewise(stats_path):
+    old, new = parse_samtools_stats_linewise(stats_path), parse_samtools_stats(stats_path)
+    for tag, columns in LINEWISE_COLUMNS.items():
+        pd.testing.assert_frame_equal(old[tag][columns], new[tag][columns].reset_index(drop=True),
+                                      check_dtype=False)
+    # The old parser kept the first count of each cycle under 'Quality'
+    for tag in ('FFQ', 'LFQ'):
+        assert (old[tag]['Quality'].to_numpy() == new[tag]['Q0'].to_numpy()).all()
+        assert (old[tag]['Cycle'].to_numpy() == new[tag]['Cycle'].to_numpy()).all()
+
+
+def test_stats_parser_matches_linewise_parser_on_wgs_report(tmp_path):
+    assert_matches_linewise(write_wgs_like_stats(str(tmp_path / "stats.txt"), cycles=20))
+
+
+@requires_samtools
+def test_stats_parser_matches_linewise_parser_on_samtools_output(bam_path, tmp_path):
+    stats_path = str(tmp_path / "stats.txt")
+    samtools_stats(bam_path, stats_path)
+    assert_matches_linewise(stats_path)
+
+
+def test_stats_parser_keeps_every_quality_and_the_mean(tmp_path):
+    stats = parse_samtools_stats(write_wgs_like_stats(str(tmp_path / "stats.txt"), cycles=20))
+    ffq = stats['FFQ']
+    counts = ffq[[f"Q{quality}" for quality in range(42)]].to_numpy(dtype=np.float64)
+    mean = counts @ np.arange(42) / counts.sum(axis=1)
+    assert ffq['Quality'].to_numpy() == pytest.approx(mean)
+    assert len(stats['GCD']) == 2500
+
+
+def write_raw_data(report_dir, tables):
+    raw_data_dir = qualimap_raw_data_dir(str(report_dir))
+    os.makedirs(raw_data_dir)
+    for name, text in tables.items():
+        with open(os.path.join(raw_data_dir, f"{name}.txt"), "w") as f:
+            f.write(text)
+    return raw_data_dir
+
+
+def test_qualimap_table_keeps_extra_columns_and_counts_bad_rows(tmp_path):
+    raw_data_dir = write_raw_data(tmp_path, {'coverage_across_reference': (
+        "#Position (bp)\tCoverage\tStd\n"
+        "0\t12.5\t3.1\n"
+        "\n"
+        "100\tn/a\t2.0\n"
+        "200\t14.0\t2.5\textra\n"
+        "300\t11.0\t1.9\n"
+    )})
+    frame, skipped = load_qualimap_table(os.path.join(raw_data_dir, "coverage_across_reference.txt"))
+    assert list(frame.columns) == ['Position', 'Coverage', 'Std']
+    assert frame['Position'].tolist() == [0, 300]
+    assert frame['Position'].dtype == np.int64
+    assert frame['Coverage'].tolist() == [12.5, 11.0]
+    assert skipped == 2
+
+
+def test_qualimap_loader_reads_every_table(tmp_path):
+    write_raw_data(tmp_path, {
+        'coverage_histogram': "#Coverage\tNumber of genomic locations\n0.0\t10\n1.0\t20\n",
+        'homopolymer_indels': "#Type of indel\tNumber of indels\nPoly A\t4\nNon-poly A\t7\n",
+        'mapping_quality_histogram': "#Mapping quality\tNumber of reads\n",
+    })
+    frames, skipped, errors = load_qualimap_raw_data(str(tmp_path), max_workers=2)
+    assert sorted(frames) == ['coverage_histogram', 'homopolymer_indels', 'mapping_quality_histogram']
+    assert frames['coverage_histogram']['Frequency'].tolist() == [10, 20]
+    assert frames['homopolymer_indels']['Type of indel'].tolist() == ['Poly A', 'Non-poly A']
+    assert frames['mapping_quality_histogram'].empty
+    assert skipped == {'coverage_histogram': 0, 'homopolymer_indels': 0, 'mapping_quality_histogram': 0}
+    assert errors == {}
+
+
+def test_qualimap_loader_without_raw_data(tmp_path):
+    assert load_qualimap_raw_data(str(tmp_path)) == ({}, {}, {})
@@ -0,0 +1,52 @@
+import math
+
+import pandas as pd
+import pytest
+
+from conftest import requires_samtools
+from parsers import parse_flagstat
+from quicklook import group_estimates, group_windows, quick_look, sample_windows, t_critical_95
+from tools import samtools_flagstat
+
+
+@pytest.mark.parametrize("df, expected", [(1, 12.706), (3, 3.182), (7, 2.365), (8, 2.306), (10, 2.228),
+                                          (30, 2.042)])
+def test_t_critical_95(df, expected):
+    assert t_critical_95(df) == pytest.approx(expected, rel=2.5e-3)
+
+
+def test_group_estimates_mean_and_interval():
+    table = pd.DataFrame({0: [1.0, 10.0], 1: [2.0, 10.0], 2: [3.0, 10.0], 3: [4.0, 10.0]}, index=['a', 'b'])
+    estimates = group_estimates(table).set_index('Metric')
+    stderr = math.sqrt(5 / 3) / 2
+    assert estimates.loc['a', 'Value'] == 2.5
+    assert estimates.loc['a', 'Std. Error'] == pytest.approx(stderr)
+    assert estimates.loc['a', 'CI Low'] == pytest.approx(2.5 - 3.1824 * stderr)
+    assert estimates.loc['a', 'CI High'] == pytest.approx(2.5 + 3.1824 * stderr)
+    assert estimates.loc['b', ['CI Low', 'Value', 'CI High']].tolist() == [10.0, 10.0, 10.0]
+
+
+def test_group_estimates_of_one_group_have_no_interval():
+    estimates = group_estimates(pd.DataFrame({0: [5.0]}, index=['a']))
+    assert estimates['Value'].tolist() == [5.0]
+    assert estimates[['Std. Error', 'CI Low', 'CI High']].isna().all(axis=None)
+
+
+def test_windows_are_spread_and_interleaved():
+    windows = sample_windows([("chr1", 2_000_000), ("chr2", 1_000_000)], n_windows=6, window_bases=1000)
+    assert [name for name, _, _ in windows] == ["chr1"] * 4 + ["chr2"] * 2
+    assert all(end - start + 1 == 1000 for _, start, end in windows)
+    groups = group_windows(windows, groups=4)
+    assert groups[0] == [windows[0], windows[4]]
+    assert sorted(window for group in groups for window in group) == sorted(windows)
+
+
+@requires_samtools
+def test_quick_look_interval_covers_the_flagstat_total(bam_path, tmp_path):
+    results = quick_look(bam_path, str(tmp_path), index_ready=True, threads=1, n_windows=32,
+                         window_bases=2000)
+    assert results['errors'] == []
+    assert results['quick_look']['groups'] == 8
+    total = dict(parse_flagstat(samtools_flagstat(bam_path)))['in total']
+    estimate = results['quick_look']['flagstat'].set_index('Metric').loc['in total']
+    assert estimate['CI Low'] <= total <= estimate['CI High']
@@ -0,0 +1,79 @@
+import os
+from hashlib import md5
+
+import pytest
+
+from conftest import requires_samtools
+from references import EBI_REF_PATH, ReferenceRegistry
+
+pytestmark = requires_samtools
+
+CHR_A = "ACGTACGTNNacgtacgt" * 5
+CHR_B = "GGGCCCAAATTT" * 4
+
+
+def write_fasta(path, sequences, width=20):
+    with open(path, "w") as f:
+        for name, sequence in sequences:
+            f.write(f">{name} description\n")
+            for start in range(0, len(sequence), width):
+                f.write(sequence[start:start + width] + "\n")
+    return str(path)
+
+
+def m5(sequence):
+    return md5(sequence.upper().encode()).hexdigest()
+
+
+def sq_header(*lines):
+    return "@HD\tVN:1.6\tSO:coordinate\n" + "".join(f"@SQ\t{line}\n" for line in lines)
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = ReferenceRegistry(str(tmp_path / "references"))
+    registry.add("genome", write_fasta(tmp_path / "genome.fa", [("chrA", CHR_A), ("chrB", CHR_B)]))
+    # Same contig names and lengths as "genome", different bases
+    registry.add("variant", write_fasta(tmp_path / "variant.fa", [("chrA", "T" * len(CHR_A))]))
+    return registry
+
+
+def test_added_reference_is_indexed_and_cached_by_md5(registry):
+    assert registry.names() == ["genome", "variant"]
+    assert os.path.exists(registry.fasta_path("genome") + ".fai")
+    sequences = registry.manifest("genome")['sequences']
+    assert sequences == [["chrA", len(CHR_A), m5(CHR_A)], ["chrB", len(CHR_B), m5(CHR_B)]]
+    with open(registry._cache_file(m5(CHR_A))) as f:
+        assert f.read() == CHR_A.upper()
+
+
+def test_resolve_by_m5_before_names(registry):
+    header = sq_header(f"SN:chrA\tLN:{len(CHR_A)}\tM5:{m5('T' * len(CHR_A))}")
+    assert registry.resolve(header) == "variant"
+    header = sq_header(f"SN:chrA\tLN:{len(CHR_A)}\tM5:{m5(CHR_A)}",
+                       f"SN:chrB\tLN:{len(CHR_B)}\tM5:{m5(CHR_B)}")
+    assert registry.resolve(header) == "genome"
+    # Renamed contigs still resolve by their sequence
+    assert registry.resolve(sq_header(f"SN:1\tLN:{len(CHR_B)}\tM5:{m5(CHR_B)}")) == "genome"
+    assert registry.resolve(sq_header(f"SN:chrA\tLN:{len(CHR_A)}\tM5:{m5('A')}")) is None
+
+
+def test_resolve_by_names_without_m5(registry):
+    assert registry.resolve(sq_header(f"SN:chrB\tLN:{len(CHR_B)}")) == "genome"
+    assert registry.resolve(sq_header(f"SN:chrB\tLN:{len(CHR_B) + 1}")) is None
+    assert registry.resolve("@HD\tVN:1.6\n") is None
+
+
+def test_remove_and_invalid_names(registry, tmp_path):
+    registry.remove("variant")
+    assert registry.names() == ["genome"]
+    assert registry.resolve(sq_header(f"SN:chrA\tLN:{len(CHR_A)}\tM5:{m5('T' * len(CHR_A))}")) is None
+    with pytest.raises(ValueError, match="Invalid reference name"):
+        registry.add("../escape", str(tmp_path / "genome.fa"))
+
+
+def test_environment_puts_the_registry_cache_first(registry):
+    local = os.path.join(registry.cache_dir, "%2s/%2s/%s")
+    assert registry.environment({}) == {'REF_PATH': f"{local}:{EBI_REF_PATH}", 'REF_CACHE': local}
+    environment = registry.environment({'REF_PATH': "/refs/%s", 'REF_CACHE': "/cache/%s"})
+    assert environment == {'REF_PATH': f"{local}:/refs/%s", 'REF_CACHE': "/cache/%s"}
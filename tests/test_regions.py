@@ -0,0 +1,55 @@
+import pytest
+
+from regions import (CONTIG_END, clamp_regions, load_regions, merge_regions, parse_bed, parse_region,
+                     regions_key, regions_length, write_regions)
+
+
+def test_parse_region_forms():
+    assert parse_region("chr1") == ("chr1", 1, CONTIG_END)
+    assert parse_region("chr1:1,000") == ("chr1", 1000, 1000)
+    assert parse_region(" chr2:100-2,000 ") == ("chr2", 100, 2000)
+
+
+@pytest.mark.parametrize("text", ["chr1:0-10", "chr1:20-10", "chr1:a-b", "chr 1"])
+def test_parse_region_rejects_invalid(text):
+    with pytest.raises(ValueError, match="Invalid region"):
+        parse_region(text)
+
+
+def test_parse_bed_converts_to_one_based():
+    text = "track name=panel\n# comment\n\nchr1\t0\t100\tgene\nchr2 9 20\n"
+    assert parse_bed(text) == [("chr1", 1, 100), ("chr2", 10, 20)]
+    with pytest.raises(ValueError, match="BED line 1"):
+        parse_bed("chr1\t10\t10\n")
+
+
+def test_merge_regions_joins_overlapping_and_touching_regions():
+    regions = [("chr2", 50, 60), ("chr1", 300, 400), ("chr1", 1, 100), ("chr1", 101, 150),
+               ("chr2", 10, 55), ("chr1", 120, 130)]
+    assert merge_regions(regions) == [("chr2", 10, 60), ("chr1", 1, 150), ("chr1", 300, 400)]
+
+
+def test_load_regions_combines_list_and_bed():
+    regions = load_regions("chr1:1-100; chr1:90-200\nchr3", "chr1\t199\t300\n")
+    assert regions == [("chr1", 1, 300), ("chr3", 1, CONTIG_END)]
+    assert regions_length(regions) is None
+    assert regions_length(regions[:1]) == 300
+    assert load_regions("", " ") == []
+
+
+def test_regions_key_depends_on_the_merged_regions_only():
+    key = regions_key(load_regions("chr1:1-100 chr1:50-150"))
+    assert key == regions_key(load_regions("", "chr1\t0\t150\n"))
+    assert key != regions_key(load_regions("chr1:1-151"))
+    assert regions_key(load_regions("chr1")) != regions_key(load_regions("chr2"))
+
+
+def test_clamp_and_write_regions(tmp_path):
+    regions = clamp_regions([("chr1", 1, CONTIG_END), ("chr2", 500, 900), ("chrX", 1, 10)],
+                            [("chr1", 1000), ("chr2", 400)])
+    assert regions == [("chr1", 1, 1000)]
+    targets_path, bed_path = write_regions(regions + [("chr2", 10, 20)], str(tmp_path))
+    with open(targets_path) as f:
+        assert f.read() == "chr1\t1\t1000\nchr2\t10\t20\n"
+    with open(bed_path) as f:
+        assert f.read() == "chr1\t0\t1000\tregion_1\t0\t+\nchr2\t9\t20\tregion_2\t0\t+\n"
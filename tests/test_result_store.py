@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+
+from analysis import analyze_sample
+from conftest import requires_samtools
+from result_store import ResultStore
+
+pytestmark = [requires_samtools, pytest.mark.skipif(not ResultStore.available, reason="pyarrow is not installed")]
+
+
+@pytest.fixture(scope="module")
+def results(bam_path, tmp_path_factory):
+    workdir = str(tmp_path_factory.mktemp("work"))
+    return analyze_sample(bam_path, workdir, index_ready=True, threads=1, coverage_engine='native',
+                          regions=[("chr1", 1, 150_000)])
+
+
+def test_saved_results_load_back_unchanged(results, tmp_path):
+    store = ResultStore(str(tmp_path))
+    store.save("key1", "sample.bam", "bam", results)
+    assert "key1" in store and "key2" not in store
+    loaded = store.load("key1")
+    for key in ('flagstat_text', 'stats_text', 'idxstats_text', 'errors', 'warnings', 'regions'):
+        assert loaded[key] == results[key]
+    assert sorted(loaded['stats']) == sorted(results['stats'])
+    for tag, frame in results['stats'].items():
+        pd.testing.assert_frame_equal(loaded['stats'][tag], frame.reset_index(drop=True))
+    for name, frame in results['qualimap_results'].items():
+        pd.testing.assert_frame_equal(loaded['qualimap_results'][name], frame.reset_index(drop=True))
+    assert store.load("key2") is None
+
+
+def test_query_finds_samples_by_metric(results, tmp_path):
+    store = ResultStore(str(tmp_path))
+    store.save("key1", "first.bam", "bam", results)
+    store.save("key2", "second.bam", "bam", results)
+    assert store.samples()['Name'].tolist() == ["second.bam", "first.bam"]
+    assert "reads mapped" in store.metrics()
+
+    mapped = float(results['stats']['SN'].set_index('Metric').loc['reads mapped', 'Value'])
+    matches = store.query("reads mapped", ">=", mapped)
+    assert sorted(matches['Name']) == ["first.bam", "second.bam"]
+    assert (matches['Value'] == mapped).all()
+    assert store.query("reads mapped", "<", mapped).empty
+    with pytest.raises(ValueError, match="Unknown operator"):
+        store.query("reads mapped", "=~", 0)
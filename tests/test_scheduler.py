@@ -0,0 +1,16 @@
+import threading
+
+from scheduler import DONE, ResourceGovernor, Scheduler
+
+
+def test_oversized_step_leaves_room_for_steps_without_memory():
+    governor = ResourceGovernor(max_cpus=2, max_mem_mb=100)
+    scheduler = Scheduler(max_cpus=2, max_mem_mb=100, poll_interval=0.01, governor=governor)
+    small_started = threading.Event()
+    scheduler.add("big", lambda: small_started.wait(timeout=5), mem_mb=500)
+    scheduler.add("small", small_started.set)
+    steps = scheduler.run()
+    assert steps['big'].state == DONE and steps['small'].state == DONE
+    # The oversized step was accounted at the capped budget, so the other one ran beside it
+    assert steps['big'].result is True
+    assert governor.used_mem_mb == 0
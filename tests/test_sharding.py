@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis import analyze_sample
+from conftest import requires_samtools
+from sharding import BASE_CONTENT_WEIGHTS, SHARDED_STATS_CAVEAT, merge_flagstat, pack_shards
+from synthetic import write_synthetic_bam
+
+pytestmark = requires_samtools
+
+CONTIGS = (("chr1", 120_000), ("chr2", 90_000), ("chr3", 60_000), ("chr4", 30_000))
+
+
+@pytest.fixture(scope="module")
+def runs(tmp_path_factory):
+    """Unsharded and 3-shard analyses of a BAM over four contigs"""
+    workdir = tmp_path_factory.mktemp("sharding")
+    bam_path = write_synthetic_bam(str(workdir / "sample.bam"), 3000, threads=1, contigs=CONTIGS)
+    runs = {}
+    for shards in (1, 3):
+        shard_dir = workdir / f"shards_{shards}"
+        shard_dir.mkdir()
+        runs[shards] = analyze_sample(bam_path, str(shard_dir), index_ready=True, threads=1,
+                                      coverage_engine='native', shards=shards)
+    return runs
+
+
+def test_pack_shards_balances_and_keeps_contigs_whole():
+    shards = pack_shards(["a", "b", "c", "d", "e"], [50, 40, 30, 20, 10], 2)
+    assert shards == [["a", "d", "e"], ["b", "c"]]
+    assert pack_shards(["a", "b"], [1, 1], 4) == [["a"], ["b"]]
+
+
+def test_merged_stats_match_the_unsharded_run(runs):
+    whole, merged = runs[1], runs[3]
+    assert merged['errors'] == [] and merged['stats_shards'] == 3
+    assert 'stats_shards' not in whole
+    assert 'GCD' in whole['stats'] and 'GCD' not in merged['stats']
+    assert SHARDED_STATS_CAVEAT in merged['stats_text']
+    for tag, frame in whole['stats'].items():
+        if tag == 'GCD':
+            continue
+        other = merged['stats'][tag]
+        if tag in BASE_CONTENT_WEIGHTS:
+            assert list(other.columns) == list(frame.columns)
+            assert np.abs(other.to_numpy(dtype=np.float64) - frame.to_numpy(dtype=np.float64)).max() <= 0.01 + 1e-9
+        else:
+            pd.testing.assert_frame_equal(other, frame, check_dtype=False)
+
+
+def test_merged_coverage_matches_the_unsharded_run(runs):
+    whole, merged = runs[1]['qualimap_results'], runs[3]['qualimap_results']
+    assert sorted(merged) == sorted(whole)
+    for name, frame in whole.items():
+        pd.testing.assert_frame_equal(merged[name], frame)
+
+
+def flagstat_text(total, mapped):
+    """flagstat lines for ``(passed, failed)`` totals and mapped counts"""
+    return (f"{total[0]} + {total[1]} in total (QC-passed reads + QC-failed reads)\n"
+            f"{total[0]} + {total[1]} primary\n"
+            f"{mapped[0]} + {mapped[1]} mapped (50.00% : N/A)\n"
+            f"{mapped[0]} + {mapped[1]} primary mapped (50.00% : N/A)\n")
+
+
+def test_merge_flagstat_sums_counts_and_recomputes_percentages():
+    merged = merge_flagstat([flagstat_text((100, 10), (90, 5)), flagstat_text((50, 0), (25, 0))])
+    assert merged == ("150 + 10 in total (QC-passed reads + QC-failed reads)\n"
+                      "150 + 10 primary\n"
+                      "115 + 5 mapped (76.67% : 50.00%)\n"
+                      "115 + 5 primary mapped (76.67% : 50.00%)\n")
+    assert merge_flagstat([flagstat_text((0, 0), (0, 0))]).splitlines()[2] == "0 + 0 mapped (N/A : N/A)"
+
+
+def test_merged_flagstat_matches_the_unsharded_run(runs):
+    assert runs[3]['flagstat_text'] == runs[1]['flagstat_text']
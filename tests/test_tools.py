@@ -0,0 +1,40 @@
+import subprocess
+
+import pytest
+
+from conftest import requires_samtools
+from tools import samtools_flagstat, samtools_scan, samtools_stats
+
+
+@requires_samtools
+def test_region_stats_fail_when_the_region_view_fails(unindexed_bam, tmp_path):
+    bed_path = tmp_path / "regions.bed"
+    bed_path.write_text("chr1\t0\t1000\n")
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        samtools_stats(str(unindexed_bam), str(tmp_path / "stats.txt"), bed_path=str(bed_path))
+    assert error.value.cmd[:2] == ["samtools", "view"]
+
+
+@requires_samtools
+def test_contig_stats_fail_when_the_contig_view_fails(unindexed_bam, tmp_path):
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        samtools_stats(str(unindexed_bam), str(tmp_path / "stats.txt"), contigs=["chr1"])
+    assert error.value.cmd[:2] == ["samtools", "view"]
+
+
+@requires_samtools
+def test_contig_scan_fails_when_the_contig_view_fails(unindexed_bam, tmp_path):
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        samtools_scan(str(unindexed_bam), str(tmp_path / "stats.txt"), str(tmp_path / "flagstat.txt"),
+                      contigs=["chr1"])
+    assert error.value.cmd[:2] == ["samtools", "view"]
+
+
+@requires_samtools
+def test_scan_matches_separate_runs(bam_path, tmp_path):
+    stats_text, flagstat_text = samtools_scan(bam_path, str(tmp_path / "scan.txt"),
+                                              str(tmp_path / "flagstat.txt"))
+    assert flagstat_text == samtools_flagstat(bam_path)
+    separate = samtools_stats(bam_path, str(tmp_path / "stats.txt"))
+    assert ([line for line in stats_text.splitlines() if not line.startswith('#')] ==
+            [line for line in separate.splitlines() if not line.startswith('#')])
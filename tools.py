@@ -0,0 +1,391 @@
+"""Thin wrappers around the samtools and QualiMap command lines.
+
+These functions only run the external tools and return their output; they
+never touch the Streamlit UI, so they can run on scheduler worker threads.
+Failures raise ``subprocess.CalledProcessError`` with stderr attached.
+"""
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# Largest and smallest QualiMap heap; the heap of a run is sized from its input
+QUALIMAP_JAVA_MEM = os.environ.get("BAMCRAM_QUALIMAP_MAX_HEAP", "8G")
+QUALIMAP_MIN_JAVA_MEM = "2G"
+
+# Memory a JVM needs beyond its heap (metaspace, thread stacks, GC)
+JVM_OVERHEAD_MB = 512
+
+# Memory budgeted for one samtools process
+SAMTOOLS_MEM_MB = 256
+
+# Bytes per write when a file is fed to a tool through a pipe
+FEED_CHUNK_BYTES = 1024 ** 2
+
+# What computes BAM coverage: 'qualimap' runs QualiMap bamqc (full report),
+# 'native' only the coverage tables, in process (see coverage_engine.py)
+COVERAGE_ENGINES = ('qualimap', 'native')
+COVERAGE_ENGINE = os.environ.get("BAMCRAM_COVERAGE_ENGINE", "qualimap")
+
+# Contig shards a whole-file samtools stats (and native coverage) run is
+# split into, run in parallel and merged (see sharding.py); 1 runs it as one stream
+STATS_SHARDS = int(os.environ.get("BAMCRAM_STATS_SHARDS", 1))
+
+
+def run_tool(command, **kwargs):
+    """Run a command, capturing text output and raising on failure"""
+    return subprocess.run(command, capture_output=True, text=True, check=True, **kwargs)
+
+
+def samtools_thread_args(threads):
+    """samtools ``-@`` arguments for a total of ``threads`` threads.
+
+    ``-@ N`` adds N compression/decompression threads to the main one.
+    """
+    if threads and threads > 1:
+        return ["-@", str(threads - 1)]
+    return []
+
+
+def run_piped(producer, consumer):
+    """Run ``producer | consumer`` and return the consumer's text output.
+
+    Raises ``subprocess.CalledProcessError`` for whichever side failed,
+    with that side's stderr attached.
+    """
+    with tempfile.TemporaryFile() as upstream_stderr:
+        with subprocess.Popen(producer, stdout=subprocess.PIPE, stderr=upstream_stderr) as upstream:
+            try:
+                result = subprocess.run(consumer, stdin=upstream.stdout, capture_output=True, text=True)
+            finally:
+                upstream.stdout.close()
+        if upstream.returncode:
+            upstream_stderr.seek(0)
+            raise subprocess.CalledProcessError(upstream.returncode, producer,
+                                                stderr=upstream_stderr.read().decode(errors="replace"))
+    result.check_returncode()
+    return result.stdout
+
+
+@contextmanager
+def upstream_process(command):
+    """Run a producer and yield its stdout for a consumer to read.
+
+    On leaving, the producer is waited for and a failure raises
+    ``CalledProcessError`` with its stderr. It takes precedence over the
+    consumer's error, which is usually caused by the truncated stream,
+    unless the producer only died of the closed pipe after the consumer
+    gave up.
+    """
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file)
+        consumer_failed = False
+        try:
+            with process:
+                try:
+                    yield process.stdout
+                except BaseException:
+                    consumer_failed = True
+                    raise
+                finally:
+                    process.stdout.close()
+        finally:
+            if process.returncode and not (consumer_failed and process.returncode == -signal.SIGPIPE):
+                stderr_file.seek(0)
+                raise subprocess.CalledProcessError(process.returncode, command,
+                                                    stderr=stderr_file.read().decode(errors="replace"))
+
+
+def feed_pipes(source, pipes, on_bytes=None):
+    """Copy a binary stream into tools' stdin pipes, calling ``on_bytes(n)`` after every chunk.
+
+    A tool that exits early drops out; the others still get the whole
+    stream. Its return code tells why it exited.
+    """
+    open_pipes = list(pipes)
+    try:
+        while open_pipes and (chunk := source.read(FEED_CHUNK_BYTES)):
+            for pipe in list(open_pipes):
+                try:
+                    pipe.write(chunk)
+                except BrokenPipeError:
+                    open_pipes.remove(pipe)
+            if on_bytes:
+                on_bytes(len(chunk))
+    finally:
+        close_pipes(pipes)
+
+
+def close_pipes(pipes):
+    """Close stdin pipes, whether or not their tool has exited"""
+    for pipe in pipes:
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            pass
+
+
+def feed_file(file_path, pipes, on_bytes=None):
+    """Copy a file into tools' stdin pipes (see ``feed_pipes``)"""
+    try:
+        with open(file_path, 'rb') as source:
+            feed_pipes(source, pipes, on_bytes)
+    finally:
+        close_pipes(pipes)
+
+
+def stream_tool(command, out_path, on_line=None, stdin=None, feed_path=None, on_bytes=None,
+                merge_stderr=False, feed_stream=None, tee=()):
+    """Run a command, streaming its output line by line into ``out_path`` and ``on_line``.
+
+    Nothing is buffered beyond one line. ``stdin`` is handed to the process;
+    with ``feed_path`` that file is piped into it instead, reporting the
+    bytes written to ``on_bytes``, and with ``feed_stream`` that binary
+    stream. What is fed is also written to the ``tee`` pipes of other
+    processes. stderr is attached to the ``CalledProcessError`` raised on
+    failure; with ``merge_stderr`` it is part of the streamed output, which
+    is attached instead.
+    """
+    fed = feed_path or feed_stream
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(
+            command, stdin=subprocess.PIPE if fed else stdin, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if merge_stderr else stderr_file
+        )
+        feeder = None
+        if feed_path:
+            feeder = threading.Thread(target=feed_file, args=(feed_path, [process.stdin, *tee], on_bytes),
+                                      daemon=True)
+        elif feed_stream:
+            feeder = threading.Thread(target=feed_pipes, args=(feed_stream, [process.stdin, *tee], on_bytes),
+                                      daemon=True)
+        if feeder:
+            feeder.start()
+        try:
+            with open(out_path, 'w') as out:
+                for raw_line in process.stdout:
+                    line = raw_line.decode(errors="replace")
+                    out.write(line)
+                    if on_line:
+                        on_line(line)
+        finally:
+            process.stdout.close()
+            if feeder:
+                feeder.join()
+            process.wait()
+        if process.returncode:
+            if merge_stderr:
+                with open(out_path) as out:
+                    stderr = out.read()
+            else:
+                stderr_file.seek(0)
+                stderr = stderr_file.read().decode(errors="replace")
+            raise subprocess.CalledProcessError(process.returncode, command, stderr=stderr)
+
+
+def samtools_region_view(file_path, bed_path, reference_path=None, threads=1):
+    """samtools view command streaming the reads that overlap ``bed_path``.
+
+    ``-M`` walks the regions with the index, reading only the blocks they
+    touch, and emits each read once even if it overlaps several regions.
+    The output is uncompressed BAM for another samtools on the other end
+    of a pipe.
+    """
+    command = ["samtools", "view", "-u", "-M", "-L", bed_path, *samtools_thread_args(threads)]
+    if reference_path:
+        command += ["-T", reference_path]
+    command.append(file_path)
+    return command
+
+
+def samtools_contig_view(file_path, contigs, reference_path=None, threads=1):
+    """samtools view command streaming the reads of whole contigs as uncompressed BAM.
+
+    The contigs are read through the index; ``*`` stands for the unplaced
+    unmapped reads at the end of the file.
+    """
+    command = ["samtools", "view", "-u", *samtools_thread_args(threads)]
+    if reference_path:
+        command += ["-T", reference_path]
+    return command + [file_path, *contigs]
+
+
+def samtools_flagstat(file_path, threads=1, bed_path=None, reference_path=None):
+    """Return the text output of samtools flagstat, optionally over BED regions only"""
+    if bed_path:
+        return run_piped(
+            samtools_region_view(file_path, bed_path, reference_path, threads),
+            ["samtools", "flagstat", "-"]
+        )
+    return run_tool(["samtools", "flagstat", *samtools_thread_args(threads), file_path]).stdout
+
+
+def samtools_extract_regions(file_path, bed_path, out_path, threads=1):
+    """Write the reads overlapping ``bed_path`` to an indexed BAM and return its path"""
+    run_tool(["samtools", "view", "-b", "-M", "-L", bed_path, *samtools_thread_args(threads),
+              "-o", out_path, file_path])
+    samtools_index(out_path, threads)
+    return out_path
+
+
+def samtools_index(file_path, threads=1):
+    """Build the .bai/.crai index next to an alignment file"""
+    run_tool(["samtools", "index", *samtools_thread_args(threads), file_path])
+
+
+def samtools_faidx(fasta_path):
+    """Build the .fai index next to a FASTA file"""
+    run_tool(["samtools", "faidx", fasta_path])
+
+
+def samtools_header(file_path):
+    """Return the SAM header of an alignment file"""
+    return run_tool(["samtools", "view", "-H", file_path]).stdout
+
+
+def samtools_depth_command(file_path, bed_path=None, reference_path=None, threads=1):
+    """samtools depth command printing every position's depth, zeros included.
+
+    Contigs without reads are printed too (``-aa``); with ``bed_path`` only
+    the positions of those regions are.
+    """
+    command = ["samtools", "depth", *samtools_thread_args(threads)]
+    if bed_path:
+        command += ["-a", "-b", bed_path]
+    else:
+        command += ["-a", "-a"]
+    if reference_path:
+        command += ["--reference", reference_path]
+    command.append(file_path)
+    return command
+
+
+def samtools_idxstats(file_path):
+    """Return the text output of samtools idxstats (requires an index)"""
+    return run_tool(["samtools", "idxstats", file_path]).stdout
+
+
+def samtools_stats_command(reference_path=None, threads=1, targets_path=None, insert_size_bulk=None):
+    """samtools stats command and options, without its input"""
+    command = ["samtools", "stats", *samtools_thread_args(threads)]
+    if reference_path:
+        command += ["-r", reference_path]
+    if targets_path:
+        command += ["-t", targets_path]
+    if insert_size_bulk is not None:
+        command += ["-m", str(insert_size_bulk)]
+    return command
+
+
+def samtools_stats(file_path, stats_file, reference_path=None, threads=1,
+                   targets_path=None, regions=None, bed_path=None, on_line=None, on_bytes=None,
+                   contigs=None, insert_size_bulk=None):
+    """Run samtools stats, stream its output into ``stats_file`` and return it.
+
+    With ``targets_path`` (``-t``) the statistics cover the target regions
+    only. ``regions`` (samtools region strings) make samtools read just
+    those regions through the index; with ``bed_path`` instead the reads
+    come from a region view, for region lists too long for the command line.
+    ``contigs`` read whole contigs through the index (including ``*``, which
+    region arguments cannot name). ``insert_size_bulk`` is the share of
+    pairs in the reported insert sizes (``-m``). Output lines are passed to
+    ``on_line`` as they arrive. With ``on_bytes`` a whole-file run reads the
+    file from a pipe fed here, and ``on_bytes(n)`` reports its progress.
+    """
+    command = samtools_stats_command(reference_path, threads, targets_path, insert_size_bulk)
+    if bed_path or contigs:
+        # A failed view (bad BED file, missing index) must not pass for empty
+        # statistics, nor a failed shard drop its reads from the merge
+        if contigs:
+            view = samtools_contig_view(file_path, contigs, reference_path, threads)
+        else:
+            view = samtools_region_view(file_path, bed_path, reference_path, threads)
+        with upstream_process(view) as reads:
+            stream_tool(command + ["-"], stats_file, on_line, stdin=reads)
+    elif on_bytes and not regions:
+        stream_tool(command + ["-"], stats_file, on_line, feed_path=file_path, on_bytes=on_bytes)
+    else:
+        stream_tool(command + [file_path, *(regions or [])], stats_file, on_line)
+
+    with open(stats_file) as f:
+        return f.read()
+
+
+def samtools_scan(file_path, stats_file, flagstat_file, reference_path=None, threads=1, flagstat_threads=1,
+                  on_line=None, on_bytes=None, contigs=None, insert_size_bulk=None):
+    """Run samtools stats and samtools flagstat over one read of the file; returns both texts.
+
+    The file's bytes, or with ``contigs`` the output of a contig view, are
+    teed into the stdin of both tools, so the file is read once instead of
+    once per tool. samtools stats' output streams into ``stats_file`` and
+    ``on_line`` as in ``samtools_stats``, and ``on_bytes(n)`` reports the
+    bytes read of a whole-file scan.
+    """
+    command = samtools_stats_command(reference_path, threads, insert_size_bulk=insert_size_bulk) + ["-"]
+    flagstat_command = ["samtools", "flagstat", *samtools_thread_args(flagstat_threads), "-"]
+    with tempfile.TemporaryFile() as flagstat_stderr, open(flagstat_file, 'w') as flagstat_out:
+        flagstat = subprocess.Popen(flagstat_command, stdin=subprocess.PIPE, stdout=flagstat_out,
+                                    stderr=flagstat_stderr)
+        try:
+            if contigs:
+                view = samtools_contig_view(file_path, contigs, reference_path, threads)
+                with upstream_process(view) as reads:
+                    stream_tool(command, stats_file, on_line, feed_stream=reads, tee=[flagstat.stdin])
+            else:
+                stream_tool(command, stats_file, on_line, feed_path=file_path, on_bytes=on_bytes,
+                            tee=[flagstat.stdin])
+        finally:
+            close_pipes([flagstat.stdin])
+            flagstat.wait()
+        if flagstat.returncode:
+            flagstat_stderr.seek(0)
+            raise subprocess.CalledProcessError(flagstat.returncode, flagstat_command,
+                                                stderr=flagstat_stderr.read().decode(errors="replace"))
+
+    with open(stats_file) as f, open(flagstat_file) as g:
+        return f.read(), g.read()
+
+
+def qualimap_bamqc(file_path, out_dir, java_mem=QUALIMAP_JAVA_MEM, threads=None, feature_file=None,
+                   on_line=None):
+    """Run QualiMap bamqc into ``out_dir`` and return the directory.
+
+    With ``feature_file`` (BED or GFF, ``-gff``) the report covers those regions.
+    Its log streams into ``qualimap.log`` in ``out_dir`` and, line by line,
+    to ``on_line``.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    command = [
+        "qualimap", "bamqc",
+        "-bam", file_path,
+        "-outdir", out_dir,
+        f"--java-mem-size={java_mem}"
+    ]
+    if threads:
+        command += ["-nt", str(threads)]
+    if feature_file:
+        command += ["-gff", feature_file]
+    stream_tool(command, os.path.join(out_dir, "qualimap.log"), on_line, merge_stderr=True)
+    return out_dir
+
+
+def qualimap_java_mem(file_size):
+    """QualiMap heap for an input of ``file_size`` bytes: 1 GB plus half the input size.
+
+    Kept between QUALIMAP_MIN_JAVA_MEM and QUALIMAP_JAVA_MEM, so small
+    files do not hold 8 GB of a shared machine.
+    """
+    heap_mb = 1024 + file_size // 1024 ** 2 // 2
+    heap_mb = max(java_mem_to_mb(QUALIMAP_MIN_JAVA_MEM), min(java_mem_to_mb(QUALIMAP_JAVA_MEM), heap_mb))
+    return f"{heap_mb}M"
+
+
+def java_mem_to_mb(java_mem):
+    """Convert a JVM size like '8G' or '512M' to megabytes"""
+    units = {'k': 1 / 1024, 'm': 1, 'g': 1024, 't': 1024 ** 2}
+    value = java_mem.strip().lower()
+    if value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value) // 1024 ** 2